@@ -1,5 +1,15 @@
-from flask import Flask
+"""
+Queue server package
 
-app = Flask(__name__)
+The Flask app and its routes are created on first access to ``app.app`` (as
+``from app import app`` does), so the queue engine can be imported and
+embedded without starting a server, opening DATABASE_PATH or configuring
+logging.
+"""
 
-from app import routes
+
+def __getattr__(name):
+    if name == 'app':
+        from app.server import app
+        return app
+    raise AttributeError(f"module 'app' has no attribute {name!r}")
@@ -0,0 +1,177 @@
+"""
+Streaming queue snapshots as NDJSON
+
+A snapshot is one header object followed by one compact JSON array per task,
+in queue order, then the claimed jobs:
+
+    {"format": "queue-snapshot", "version": 1, "queue": "default", "tasks": 2, "claimed": 1, ...}
+    ["a", {"priority": 0, "timestamp": ...}, null]
+    ["b", {"priority": 5, "timestamp": ...}, "cGF5bG9hZA=="]
+    ["c", {"priority": 0, "timestamp": ...}, "...", {"worker": "w1", "claimed_at": ...}]
+
+The third element is the base64 payload of a job, the fourth the claim of a
+running job. The header's counts let a restore reject a truncated upload;
+duplicate names and malformed metadata are rejected as well.
+Lines are written from an export view (QueueEngine.export_view), so the dump
+is consistent as of one instant while writers carry on.
+"""
+import base64
+import gc
+import itertools
+import json
+import math
+import time
+import zlib
+
+FORMAT = 'queue-snapshot'
+VERSION = 1
+
+# Tasks encoded per chunk yielded to the response
+CHUNK_TASKS = 1000
+
+_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+class SnapshotFormatError(ValueError):
+    """Raised for a snapshot stream that cannot be restored"""
+
+
+def dump_lines(view, queue):
+    """Yield a snapshot of an export view as chunks of NDJSON bytes"""
+    metadata, payloads, claimed = view['metadata'], view['payloads'], view['claimed']
+    header = {
+        'format': FORMAT,
+        'version': VERSION,
+        'queue': queue,
+        'created_at': time.time(),
+        'tasks': len(view['queue']),
+        'claimed': len(claimed),
+        'metrics': view['metrics']
+    }
+    yield (_encoder.encode(header) + '\n').encode()
+
+    def task_line(name, claim=None):
+        payload = payloads.get(name)
+        task = [name, metadata.get(name, {}), None if payload is None else base64.b64encode(payload).decode()]
+        if claim is not None:
+            task.append(claim)
+        return _encoder.encode(task)
+
+    tasks = itertools.chain(
+        (task_line(name) for name in view['queue']),
+        (task_line(name, claim) for name, claim in claimed.items())
+    )
+    while True:
+        chunk = list(itertools.islice(tasks, CHUNK_TASKS))
+        if not chunk:
+            return
+        yield ('\n'.join(chunk) + '\n').encode()
+
+
+def gzip_stream(chunks, level=1):
+    """Gzip a stream of byte chunks"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def load_lines(lines):
+    """Parse a snapshot from an iterable of byte lines into QueueEngine.load_state's input"""
+    lines = iter(lines)
+    try:
+        header = json.loads(next(lines))
+    except (StopIteration, ValueError) as e:
+        raise SnapshotFormatError('Missing snapshot header') from e
+    if not isinstance(header, dict) or header.get('format') != FORMAT:
+        raise SnapshotFormatError('Not a queue snapshot')
+    if header.get('version') != VERSION:
+        raise SnapshotFormatError(f"Unsupported snapshot version {header.get('version')}")
+
+    queue, metadata, payloads, claimed = [], {}, {}, {}
+    # Millions of new dicts would trigger repeated full collections
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        while True:
+            # Parsing a chunk of lines as one array saves a call per task
+            chunk = [line for line in itertools.islice(lines, CHUNK_TASKS) if line.strip()]
+            if not chunk:
+                break
+            for task in json.loads(b'[' + b','.join(chunk) + b']'):
+                name = task[0]
+                if not isinstance(name, str) or name in metadata:
+                    raise SnapshotFormatError(f'Duplicate or invalid task name {name!r}')
+                metadata[name] = task[1]
+                if task[2] is not None:
+                    payloads[name] = task[2]
+                if len(task) > 3:
+                    claimed[name] = task[3]
+                else:
+                    queue.append(name)
+    except SnapshotFormatError:
+        raise
+    except (IndexError, KeyError, TypeError, ValueError) as e:
+        raise SnapshotFormatError(f'Invalid task line: {e}') from e
+    finally:
+        if collecting:
+            gc.enable()
+
+    if len(queue) != header.get('tasks') or len(claimed) != header.get('claimed'):
+        raise SnapshotFormatError(
+            f"Snapshot is incomplete: expected {header.get('tasks')} tasks and "
+            f"{header.get('claimed')} claimed jobs, read {len(queue)} and {len(claimed)}")
+
+    status = dict.fromkeys(queue, 'queued')
+    status.update(dict.fromkeys(claimed, 'running'))
+    state = {
+        'queue': queue,
+        'metadata': metadata,
+        'status': status,
+        'payloads': payloads,
+        'claimed': claimed,
+        'metrics': header.get('metrics') or {}
+    }
+    check_state(state)
+    return state
+
+
+def check_state(state):
+    """Raise SnapshotFormatError unless a state can be loaded as it is
+
+    Names must be unique across the queue and the claimed jobs, and every
+    task needs a metadata object with an integer priority and, where set, a
+    numeric timestamp, a non-negative numeric ttl and a list of string tags.
+    """
+    queue, claimed, metadata = state['queue'], state.get('claimed', {}), state['metadata']
+    if not isinstance(state.get('metrics', {}), dict):
+        raise SnapshotFormatError('Metrics are not an object')
+    names = set(queue)
+    if len(names) != len(queue):
+        raise SnapshotFormatError('Duplicate task names in the queue')
+    if not names.isdisjoint(claimed):
+        raise SnapshotFormatError('Tasks are both queued and claimed')
+    for name in itertools.chain(queue, claimed):
+        task = metadata.get(name)
+        if not isinstance(task, dict):
+            raise SnapshotFormatError(f'Metadata of task {name!r} is not an object')
+        priority = task.get('priority', 0)
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            raise SnapshotFormatError(f'Priority of task {name!r} is not an integer')
+        if 'timestamp' in task and not _is_number(task['timestamp']):
+            raise SnapshotFormatError(f'Timestamp of task {name!r} is not a number')
+        ttl = task.get('ttl')
+        if ttl is not None and not (_is_number(ttl) and ttl >= 0):
+            raise SnapshotFormatError(f'TTL of task {name!r} is not a non-negative number')
+        tags = task.get('tags', [])
+        if not isinstance(tags, list) or not all(isinstance(tag, str) and tag for tag in tags):
+            raise SnapshotFormatError(f'Tags of task {name!r} are not a list of names')
+        if name in claimed and not isinstance(claimed[name], dict):
+            raise SnapshotFormatError(f'Claim of task {name!r} is not an object')
+
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
@@ -20,9 +20,66 @@ class Config:
     TASK_TIMEOUT = int(os.environ.get('TASK_TIMEOUT', '3600'))  # 1 hour default
     ENABLE_PRIORITY_QUEUE = os.environ.get('ENABLE_PRIORITY_QUEUE', 'true').lower() == 'true'
 
+    # Waiting tasks whose client has not polled for this many seconds are
+    # dropped (0 disables); the task at the head is allowed TASK_TIMEOUT
+    TASK_HEARTBEAT_TTL = float(os.environ.get('TASK_HEARTBEAT_TTL', '300'))
+
+    # Remote jobs: payload/result size limit, claim lease and result retention
+    MAX_PAYLOAD_BYTES = int(os.environ.get('MAX_PAYLOAD_BYTES', str(1024 * 1024)))
+    JOB_LEASE_TIMEOUT = int(os.environ.get('JOB_LEASE_TIMEOUT', os.environ.get('TASK_TIMEOUT', '3600')))
+    JOB_RESULT_RETENTION = int(os.environ.get('JOB_RESULT_RETENTION', '10000'))
+    MAX_CLAIM_BATCH = int(os.environ.get('MAX_CLAIM_BATCH', '100'))
+
+    # Idempotency keys of joins are remembered this long (seconds) and bounded in number
+    IDEMPOTENCY_KEY_TTL = float(os.environ.get('IDEMPOTENCY_KEY_TTL', '600'))
+    IDEMPOTENCY_MAX_KEYS = int(os.environ.get('IDEMPOTENCY_MAX_KEYS', '100000'))
+
     # Monitoring
     ENABLE_METRICS = os.environ.get('ENABLE_METRICS', 'true').lower() == 'true'
     METRICS_RETENTION_DAYS = int(os.environ.get('METRICS_RETENTION_DAYS', '7'))
+    # Metric events are written in batches at most this far apart
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '1'))
+    METRICS_FLUSH_SIZE = int(os.environ.get('METRICS_FLUSH_SIZE', '500'))
+
+    # Logging: level, 'text' or 'json' output, background writer thread, and
+    # per-event sampling rates such as 'task_added=0.01,task_completed=0.1'
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+    LOG_ASYNC = os.environ.get('LOG_ASYNC', 'true').lower() == 'true'
+    LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', '')
+
+    # Start-time estimates and adaptive polling hints
+    ETA_EWMA_ALPHA = float(os.environ.get('ETA_EWMA_ALPHA', '0.2'))
+    POLL_MIN_INTERVAL = float(os.environ.get('POLL_MIN_INTERVAL', '0.5'))
+    POLL_MAX_INTERVAL = float(os.environ.get('POLL_MAX_INTERVAL', '60'))
+
+    # Binary protocol for co-located clients (disabled when empty); the first
+    # server process to lock UNIX_SOCKET_PATH + '.lock' binds the socket
+    UNIX_SOCKET_PATH = os.environ.get('UNIX_SOCKET_PATH', '')
+
+    # Upper bound on any blocking wait a client asks for (seconds)
+    MAX_WAIT_SECONDS = float(os.environ.get('MAX_WAIT_SECONDS', '30'))
+
+    # Execution: 'thread' runs the engine in each server process; 'process'
+    # sends every command to one engine process (python -m app.engine_process)
+    # through shared-memory rings announced at ENGINE_ADDRESS. Without
+    # ENGINE_AUTHKEY the engine writes a random key to ENGINE_ADDRESS + '.key'
+    ENGINE_MODE = os.environ.get('ENGINE_MODE', 'thread')
+    ENGINE_ADDRESS = os.environ.get('ENGINE_ADDRESS', 'queue_engine.sock')
+    ENGINE_AUTHKEY = os.environ.get('ENGINE_AUTHKEY', '').encode() or None
+    ENGINE_RING_BYTES = int(os.environ.get('ENGINE_RING_BYTES', str(4 * 1024 * 1024)))
+
+    # Replication: 'primary' ships its journal, 'follower' replays PRIMARY_URL's
+    REPLICATION_ROLE = os.environ.get('REPLICATION_ROLE', 'primary')
+    PRIMARY_URL = os.environ.get('PRIMARY_URL', '')
+    REPLICATION_API_KEY = os.environ.get('REPLICATION_API_KEY') or None
+    REPLICATION_POLL_TIMEOUT = float(os.environ.get('REPLICATION_POLL_TIMEOUT', '5'))
+    REPLICATION_JOURNAL_SIZE = int(os.environ.get('REPLICATION_JOURNAL_SIZE', '10000'))
+
+    # Sharding: named queues are placed on CLUSTER_NODES by consistent hashing
+    CLUSTER_NODES = [n for n in os.environ.get('CLUSTER_NODES', '').split(',') if n]
+    NODE_URL = os.environ.get('NODE_URL', '')
+    CLUSTER_VNODES = int(os.environ.get('CLUSTER_VNODES', '64'))
 
 class DevelopmentConfig(Config):
     """Development configuration"""
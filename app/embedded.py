@@ -0,0 +1,133 @@
+"""
+The queue engine as a library, without HTTP
+
+QueueService puts the operations the HTTP routes expose behind plain method
+calls on a QueueRegistry. InProcessQueueClient (queue_enhanced) calls it
+directly; QueueManager serves one QueueService from a separate process so
+clients in several processes share a queue. Blocking calls (wait, claim)
+wait on the engine's condition variable, in the manager process when
+served remotely.
+"""
+import io
+from multiprocessing.managers import BaseManager
+
+from app.backup import dump_lines, load_lines
+from app.engine import QueueRegistry
+from app.expiry import start_reaper
+
+
+class QueueService:
+    """Queue operations by queue name, returning plain (picklable) values
+
+    A service creating its own registry also expires its abandoned tasks, so
+    a client process that dies while waiting does not block the queue.
+    """
+
+    def __init__(self, registry=None):
+        if registry is None:
+            registry = QueueRegistry()
+            start_reaper(registry)
+        self.registry = registry
+
+    def _engine(self, queue, create=False):
+        if create:
+            return self.registry.get(queue or QueueRegistry.DEFAULT)
+        return self.registry.lookup(queue or QueueRegistry.DEFAULT)
+
+    def join(self, queue, name, priority=0, payload=None, idempotency_key=None, tags=None, ttl=None):
+        engine = self._engine(queue, create=True)
+        result = engine.join(name, priority, payload, idempotency_key, tags, ttl)
+        return {**result, **engine.estimate_start(result['position'], name)}
+
+    def wait(self, queue, name, timeout):
+        """Block until the task reaches the head or leaves the queue, up to ``timeout``"""
+        engine = self._engine(queue)
+        position = engine.wait(name, timeout)
+        return {'position': position, 'queue_size': engine.size(), **engine.estimate_start(position, name)}
+
+    def position(self, queue, name):
+        engine = self._engine(queue)
+        result = engine.position(name)
+        if result is None:
+            return {'position': -1, 'status': 'not_found'}
+        return {**result, **engine.estimate_start(result['position'], name)}
+
+    def positions(self, queue, names):
+        engine = self._engine(queue)
+        positions, queue_size = engine.positions(names)
+        queued = [p for p in positions.values() if p > 0]
+        return {
+            'positions': positions,
+            'queue_size': queue_size,
+            **(engine.estimate_start(min(queued), *names) if queued else {})
+        }
+
+    def update(self, queue, name, priority):
+        engine = self._engine(queue)
+        result = engine.update(name, priority)
+        if result is None:
+            return None
+        return {**result, **engine.estimate_start(result['position'], name)}
+
+    def remove_matching(self, queue, tag=None, prefix=None):
+        return self._engine(queue).remove_matching(tag, prefix)
+
+    def reprioritize_matching(self, queue, priority, tag=None, prefix=None):
+        return self._engine(queue).reprioritize_matching(priority, tag, prefix)
+
+    def next(self, queue, name=None):
+        name, metadata, remaining = self._engine(queue).next(name)
+        return {'next': name, 'metadata': metadata, 'remaining': remaining}
+
+    def remove(self, queue, name):
+        return self._engine(queue).remove(name)
+
+    def list_tasks(self, queue):
+        tasks = self._engine(queue).list_tasks()
+        return {'queue': tasks, 'total': len(tasks)}
+
+    def metrics(self, queue):
+        return {'metrics': self._engine(queue).current_metrics()}
+
+    def claim(self, queue, count, worker, wait=0):
+        return self._engine(queue, create=True).claim(count, worker, wait)
+
+    def report(self, queue, name, status, result=None, error=None):
+        return self._engine(queue).report(name, status, result, error)
+
+    def job(self, queue, name):
+        return self._engine(queue).job(name)
+
+    def snapshot(self, queue):
+        """Return a snapshot of the queue in the /admin/snapshot format"""
+        return b''.join(dump_lines(self._engine(queue).export_view(), queue or QueueRegistry.DEFAULT))
+
+    def restore(self, queue, data):
+        state = load_lines(io.BytesIO(data))
+        self._engine(queue, create=True).restore(state)
+        return {'queue': queue or QueueRegistry.DEFAULT, 'restored': len(state['queue']),
+                'claimed': len(state['claimed'])}
+
+
+class QueueManager(BaseManager):
+    """Serves one shared QueueService to clients in other processes"""
+
+
+_shared_service = None
+
+
+def _service():
+    global _shared_service
+    if _shared_service is None:
+        _shared_service = QueueService()
+    return _shared_service
+
+
+QueueManager.register('service', callable=_service)
+
+
+def start_manager(address=None, authkey=None):
+    """Start a manager process serving a fresh in-memory queue"""
+    manager = QueueManager(address=address, authkey=authkey)
+    manager.start()
+    return manager
@@ -0,0 +1,1213 @@
+"""
+Queue engine: in-memory priority queue state shared by every front end
+
+The HTTP routes and the Unix socket server both call into a QueueEngine, so
+queue semantics, metrics and persistence live in one place.
+"""
+import os
+import re
+import glob
+import base64
+import bisect
+import itertools
+import threading
+import time
+import logging
+from collections import OrderedDict, namedtuple
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from types import MappingProxyType
+
+from app.backup import check_state
+from app.config import Config
+from app.estimator import RunTimeEstimator
+from app.expiry import TimingWheel
+from app.idempotency import IdempotencyCache
+from app.logs import log_event
+from app.persistence import PersistenceLayer
+
+logger = logging.getLogger(__name__)
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii') if data is not None else None
+
+
+def _unb64(text):
+    return base64.b64decode(text) if text is not None else None
+
+
+class QueueFullError(Exception):
+    """Raised when a task is added to a queue at MAX_QUEUE_SIZE"""
+
+
+class PayloadTooLargeError(Exception):
+    """Raised when a job payload or result exceeds MAX_PAYLOAD_BYTES"""
+
+
+class IdempotencyConflictError(Exception):
+    """Raised when an idempotency key is reused for a different task"""
+
+
+class TaskClaimedError(Exception):
+    """Raised when a task joins under the name of a job a worker is running"""
+
+
+class ReadOnlyError(Exception):
+    """Raised when a follower engine is asked to mutate the queue"""
+
+
+class QueueMovedError(ReadOnlyError):
+    """Raised when a queue handed off to another node is asked to mutate"""
+
+    @property
+    def owner(self):
+        return self.args[0]
+
+
+QueueSnapshot = namedtuple('QueueSnapshot', 'queue positions metadata status metrics')
+QueueSnapshot.__doc__ = """Immutable view of a queue's ordering, task state and counters"""
+
+
+class QueueEngine:
+    """Thread-safe priority queue with metrics, persistence and ETAs
+
+    Writers mutate under ``lock`` and publish a new QueueSnapshot when done.
+    Readers (position, list, size, metrics) dereference ``snapshot`` without
+    taking the lock, so polling never waits for a sort or a database write.
+    """
+
+    def __init__(self, persistence=None, journal=None, name='default'):
+        self.name = name
+
+        # Thread-safe lock for queue operations; `changed` is notified on
+        # every mutation so callers can block until their position moves
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+
+        # In-memory queue structures
+        self.queue = []
+        self.queue_position = {}
+        self.task_metadata = {}  # Store task metadata (priority, timestamp, etc.)
+        self.task_status = {}    # Track task execution status
+
+        # Secondary index of queued tasks by tag, for bulk operations
+        self.tag_index = {}
+
+        # Waiting tasks with a TTL: [alive_until, ttl] per task, pushed forward
+        # by polls without the lock, and a timing wheel of their deadlines
+        self.heartbeats = {}
+        self.expiry_wheel = TimingWheel()
+        self.expiry_head = None
+
+        # Remote jobs: opaque payloads of queued/claimed jobs, jobs claimed by
+        # workers and awaiting a result, and recently finished job results
+        self.task_payloads = {}
+        self.claimed = {}
+        self.job_results = OrderedDict()
+
+        # Metrics storage
+        self.metrics = {
+            'total_tasks': 0,
+            'completed_tasks': 0,
+            'failed_tasks': 0,
+            'current_queue_size': 0,
+            'avg_wait_time': 0,
+            'avg_run_time': None,
+            'task_history': []
+        }
+
+        # Run-time statistics for start-time estimates
+        self.estimator = RunTimeEstimator(alpha=Config.ETA_EWMA_ALPHA)
+
+        # Idempotency keys of recent joins, so retried joins are not queued twice
+        self.idempotency_keys = IdempotencyCache(Config.IDEMPOTENCY_KEY_TTL, Config.IDEMPOTENCY_MAX_KEYS)
+
+        # Optional mutation journal shipped to followers (see app.replication).
+        # Read-only engines only change through apply()
+        self.journal = journal
+        self.read_only = False
+
+        # Node a sharded queue was handed off to; it no longer changes here
+        self.moved_to = None
+
+        # Set while persistence writes are coalesced (see deferred_persistence)
+        self.persist_deferred = False
+        self.persist_pending = False
+
+        self.snapshot = None
+        with self.lock:
+            self._publish()
+
+        self.persistence = persistence
+        if persistence is not None:
+            self.load()
+
+    def load(self):
+        """Load initial state from persistence"""
+        loaded_queue, loaded_positions, loaded_metadata, loaded_payloads = self.persistence.load_queue_state()
+        if loaded_queue:
+            with self.lock:
+                self.queue = loaded_queue
+                self.queue_position = loaded_positions
+                self.task_metadata = loaded_metadata
+                self.task_payloads = loaded_payloads
+                self._rebuild_tag_index()
+                self._rebuild_expiry()
+                self._track_queue_head()
+                self._publish()
+            logger.info(f"Loaded {len(self.queue)} tasks from persistent storage")
+
+    def _persist(self):
+        if self.persistence is None:
+            return
+        if self.persist_deferred:
+            self.persist_pending = True
+            return
+
+        names, positions = self.queue, self.queue_position
+        if self.claimed:
+            # Claimed jobs are saved behind the queue so a restart runs them again
+            names = self.queue + list(self.claimed)
+            positions = dict(positions)
+            for i, name in enumerate(self.claimed):
+                positions[name] = len(self.queue) + i + 1
+        self.persistence.save_queue_state(names, positions, self.task_metadata, self.task_payloads)
+
+    @contextmanager
+    def deferred_persistence(self):
+        """Save the state once when the block exits instead of after every mutation
+
+        Used by a single writer applying a batch of commands; it must not
+        acknowledge the batch until the block has exited.
+        """
+        with self.lock:
+            self.persist_deferred = True
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.persist_deferred = False
+                if self.persist_pending:
+                    self.persist_pending = False
+                    self._persist()
+
+    def _publish(self):
+        """Publish a snapshot of the current state and wake blocked waiters
+
+        Called with the lock held at the end of every mutation.
+        """
+        metrics = dict(self.metrics)
+        metrics['task_history'] = list(metrics['task_history'])
+        self.snapshot = QueueSnapshot(
+            queue=tuple(self.queue),
+            positions=MappingProxyType(dict(self.queue_position)),
+            metadata=MappingProxyType(dict(self.task_metadata)),
+            status=MappingProxyType(dict(self.task_status)),
+            metrics=MappingProxyType(metrics)
+        )
+        self.changed.notify_all()
+
+    def set_read_only(self, read_only):
+        """Switch between follower and primary
+
+        Heartbeats are not replicated, so on promotion every waiting task gets
+        a full TTL from now to show up again, as after a restart.
+        """
+        with self.lock:
+            if self.read_only and not read_only:
+                self._rebuild_expiry()
+                self._track_queue_head()
+            self.read_only = read_only
+
+    def _check_writable(self):
+        if self.moved_to is not None:
+            raise QueueMovedError(self.moved_to)
+        if self.read_only:
+            raise ReadOnlyError('Queue is read-only on a follower')
+
+    def _record(self, op):
+        if self.journal is not None:
+            op['queue'] = self.name
+            self.journal.append(op)
+
+    def _update_metrics(self, action, value=None, run_time=None, count=1):
+        """Update metrics
+
+        Each event is recorded with the number of tasks it covers (1 except
+        for bulk removals), and the run time of a completed task as a
+        ``run_time`` metric, so history rollups can count and average.
+        """
+        if not Config.ENABLE_METRICS:
+            return
+
+        with self.lock:
+            metrics = self.metrics
+            if action == 'task_added':
+                metrics['total_tasks'] += 1
+                metrics['current_queue_size'] = len(self.queue)
+            elif action == 'task_completed':
+                metrics['completed_tasks'] += 1
+                metrics['current_queue_size'] = len(self.queue)
+                if value:
+                    metrics['task_history'].append({
+                        'task': value,
+                        'completed_at': datetime.now().isoformat(),
+                        'status': 'completed'
+                    })
+            elif action == 'task_failed':
+                metrics['failed_tasks'] += count
+                metrics['current_queue_size'] = len(self.queue)
+                if value:
+                    metrics['task_history'].append({
+                        'task': value,
+                        'completed_at': datetime.now().isoformat(),
+                        'status': 'failed'
+                    })
+
+            # Keep only recent history
+            if len(metrics['task_history']) > 100:
+                metrics['task_history'] = metrics['task_history'][-100:]
+
+            # Save to persistence
+            if self.persistence is not None:
+                self.persistence.record_metric(action, 1, count)
+                if run_time is not None:
+                    self.persistence.record_metric('run_time', run_time)
+
+    def _index_tags(self, name):
+        for tag in self.task_metadata.get(name, {}).get('tags', ()):
+            self.tag_index.setdefault(tag, set()).add(name)
+
+    def _unindex_tags(self, name, metadata):
+        for tag in metadata.get('tags', ()):
+            names = self.tag_index.get(tag)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self.tag_index[tag]
+
+    @staticmethod
+    def _build_tag_index(names, metadata):
+        tag_index = {}
+        for name in names:
+            for tag in metadata.get(name, {}).get('tags', ()):
+                tag_index.setdefault(tag, set()).add(name)
+        return tag_index
+
+    def _rebuild_tag_index(self):
+        self.tag_index = self._build_tag_index(self.queue, self.task_metadata)
+
+    def _schedule_expiry(self, name):
+        ttl = self.task_metadata[name].get('ttl')
+        if ttl:
+            alive_until = time.monotonic() + ttl
+            self.heartbeats[name] = [alive_until, ttl]
+            self.expiry_wheel.schedule(name, alive_until)
+
+    def _unschedule_expiry(self, name):
+        if self.heartbeats.pop(name, None) is not None:
+            self.expiry_wheel.remove(name)
+
+    @staticmethod
+    def _build_expiry(names, metadata):
+        """Return (heartbeats, wheel) giving every task with a TTL a full one from now"""
+        now = time.monotonic()
+        heartbeats, wheel = {}, TimingWheel(now=now)
+        for name in names:
+            ttl = metadata[name].get('ttl')
+            if ttl:
+                heartbeats[name] = [now + ttl, ttl]
+                wheel.schedule(name, now + ttl)
+        return heartbeats, wheel
+
+    def _rebuild_expiry(self):
+        # Every client gets a full TTL to show up again after a restart
+        self.heartbeats, self.expiry_wheel = self._build_expiry(self.queue, self.task_metadata)
+        self.expiry_head = None
+
+    def _touch(self, name, busy_for=0):
+        """Record a sign of life from a waiting task's client
+
+        A single store into the task's cell, so readers need no lock; a cell
+        dropped concurrently is simply garbage.
+        """
+        entry = self.heartbeats.get(name)
+        if entry is not None:
+            entry[0] = max(entry[0], time.monotonic() + busy_for + entry[1])
+
+    def _renumber(self, start=0, end=None):
+        """Refresh positions for queue indexes ``start`` up to ``end`` (the end by default)"""
+        queue_position = self.queue_position
+        for i in range(start, len(self.queue) if end is None else end):
+            queue_position[self.queue[i]] = i + 1
+
+    def _sort_key(self, name):
+        metadata = self.task_metadata.get(name, {})
+        return -metadata.get('priority', 0), metadata.get('timestamp', time.time())
+
+    def _reorder_by_priority(self):
+        """Reorder queue based on priority"""
+        if not Config.ENABLE_PRIORITY_QUEUE:
+            return
+
+        self.queue.sort(key=self._sort_key)
+        self._renumber()
+
+    def _reposition(self, name):
+        """Move one task whose priority changed to its place in the sorted queue
+
+        Only the tasks between its old and new index change position.
+        """
+        if not Config.ENABLE_PRIORITY_QUEUE:
+            return
+
+        old = self.queue_position[name] - 1
+        del self.queue[old]
+        new = bisect.bisect_right(self.queue, self._sort_key(name), key=self._sort_key)
+        self.queue.insert(new, name)
+        self._renumber(min(old, new), max(old, new) + 1)
+
+    def _track_queue_head(self):
+        """Start the run-time clock for whichever task is now at the head
+
+        The head's client runs its task without polling, so the task may go
+        TASK_TIMEOUT without a heartbeat.
+        """
+        if self.queue:
+            self.estimator.mark_started(self.queue[0], time.time())
+            if self.queue[0] != self.expiry_head:
+                self.expiry_head = self.queue[0]
+                self._touch(self.expiry_head, busy_for=Config.TASK_TIMEOUT)
+        else:
+            self.expiry_head = None
+
+    def estimate_start(self, position, *names):
+        """Build the ETA and polling hint fields for a queue position
+
+        Polls are the heartbeats of the tasks in ``names``, so the hint stays
+        at a quarter of the shortest of their TTLs.
+        """
+        now = time.time()
+        snapshot = self.snapshot
+        head_name = snapshot.queue[0] if snapshot.queue else None
+        wait = self.estimator.estimate_wait(position, head_name, now)
+        poll_after = self.estimator.poll_delay(wait, Config.POLL_MIN_INTERVAL, Config.POLL_MAX_INTERVAL)
+        ttls = [snapshot.metadata[name]['ttl'] for name in names if snapshot.metadata.get(name, {}).get('ttl')]
+        if ttls:
+            poll_after = min(ttls) / 4 if poll_after is None else min(poll_after, min(ttls) / 4)
+        return {
+            'estimated_wait': wait,
+            'estimated_start': datetime.fromtimestamp(now + wait).isoformat() if wait is not None else None,
+            'poll_after': poll_after
+        }
+
+    def join(self, name, priority=0, payload=None, idempotency_key=None, tags=None, ttl=None):
+        """Add a task to the queue, returning its position and queue size
+
+        Joining with a name that is already queued is a no-op; joining with
+        the name of a claimed job raises TaskClaimedError. A task with a
+        ``payload`` (bytes) is a remote job that workers claim and execute.
+        ``tags`` group tasks for bulk cancellation and reprioritization.
+        A task without a payload expires unless its client polls at least
+        every ``ttl`` seconds (TASK_HEARTBEAT_TTL by default, 0 for never).
+        A join repeating a recent ``idempotency_key`` changes nothing and
+        reports the task's current position (-1 once it has left the queue).
+        """
+        if payload is not None and len(payload) > Config.MAX_PAYLOAD_BYTES:
+            raise PayloadTooLargeError(f'Payload exceeds {Config.MAX_PAYLOAD_BYTES} bytes')
+
+        with self.lock:
+            self._check_writable()
+
+            if idempotency_key is not None:
+                original = self.idempotency_keys.get(idempotency_key)
+                if original is not None:
+                    if original != name:
+                        raise IdempotencyConflictError(f'Idempotency key was used for task {original}')
+                    return {
+                        'position': self.queue_position.get(name, -1),
+                        'priority': self.task_metadata.get(name, {}).get('priority', priority),
+                        'queue_size': len(self.queue),
+                        'duplicate': True
+                    }
+
+            if name in self.claimed:
+                raise TaskClaimedError(f'Task {name} is claimed by a worker')
+
+            # Add to queue if not already present
+            if name not in self.queue_position:
+                # Check queue size limit
+                if len(self.queue) >= Config.MAX_QUEUE_SIZE:
+                    logger.warning(f"Queue full, rejecting task: {name}")
+                    raise QueueFullError('Maximum queue size reached')
+
+                metadata = {
+                    'priority': priority,
+                    'timestamp': time.time(),
+                    'added_at': datetime.now().isoformat()
+                }
+                if payload is not None:
+                    metadata['job'] = True
+                if tags:
+                    metadata['tags'] = sorted(set(tags))
+                ttl = Config.TASK_HEARTBEAT_TTL if ttl is None else ttl
+                if payload is None and ttl:
+                    metadata['ttl'] = ttl
+                self._insert(name, metadata, payload)
+                self._record({'op': 'join', 'name': name, 'metadata': metadata, 'payload': _b64(payload),
+                              'idempotency_key': idempotency_key})
+            elif idempotency_key is not None:
+                # Followers need the key too, or a retry after promotion joins again
+                self._record({'op': 'idempotency_key', 'name': name, 'key': idempotency_key})
+
+            if idempotency_key is not None:
+                self.idempotency_keys.put(idempotency_key, name)
+
+            return {
+                'position': self.queue_position[name],
+                'priority': self.task_metadata[name]['priority'],
+                'queue_size': len(self.queue)
+            }
+
+    def _insert(self, name, metadata, payload=None):
+        self.queue.append(name)
+        self.task_metadata[name] = metadata
+        self._index_tags(name)
+        self._schedule_expiry(name)
+        if payload is not None:
+            self.task_payloads[name] = payload
+
+        # Reorder by priority if enabled
+        self._reorder_by_priority()
+
+        # Update position
+        self.queue_position[name] = self.queue.index(name) + 1
+
+        # Initialize task status
+        self.task_status[name] = 'queued'
+        self._track_queue_head()
+
+        # Update metrics
+        self._update_metrics('task_added')
+
+        # Persist state
+        self._persist()
+        self._publish()
+
+        log_event(logger, logging.INFO, 'task_added', queue=self.name, task=name,
+                  position=self.queue_position[name])
+
+    def position(self, name):
+        """Return the position, status and metadata of a task, or None
+
+        Counts as a heartbeat for the task.
+        """
+        snapshot = self.snapshot
+        if name not in snapshot.positions:
+            return None
+        self._touch(name)
+        return {
+            'position': snapshot.positions[name],
+            'status': snapshot.status.get(name, 'unknown'),
+            'metadata': snapshot.metadata.get(name, {}),
+            'queue_size': len(snapshot.queue)
+        }
+
+    def positions(self, names):
+        """Return the positions of many tasks (-1 if not queued) and the queue size"""
+        snapshot = self.snapshot
+        for name in names:
+            self._touch(name)
+        return {name: snapshot.positions.get(name, -1) for name in names}, len(snapshot.queue)
+
+    def wait(self, name, timeout):
+        """Block until a task reaches the head, leaves the queue or times out
+
+        Returns the task's position at that point (-1 if not queued). The
+        task stays alive while its client waits.
+        """
+        deadline = time.monotonic() + timeout
+        self._touch(name, busy_for=timeout)
+        with self.changed:
+            while True:
+                position = self.queue_position.get(name, -1)
+                remaining = deadline - time.monotonic()
+                if position in (1, -1) or remaining <= 0:
+                    return position
+                self.changed.wait(remaining)
+
+    def next(self, name=None):
+        """Complete the named task, or the first queued task that is not a job
+
+        Remote jobs only leave through claim(), so a client finishing its
+        turn never takes a job off the queue. Returns (name, metadata,
+        remaining), with name None when there is no such task.
+        """
+        with self.lock:
+            self._check_writable()
+            if name is None:
+                name = next((n for n in self.queue if n not in self.task_payloads), None)
+            elif name not in self.queue_position or name in self.task_payloads:
+                name = None
+            if name is None:
+                return None, {}, len(self.queue)
+
+            metadata = self._discard(name, completed=True)
+            self._record({'op': 'next', 'name': name})
+            return name, metadata, len(self.queue)
+
+    def remove(self, name):
+        """Remove a specific task from the queue, returning False if absent"""
+        with self.lock:
+            self._check_writable()
+            if name not in self.queue_position:
+                return False
+
+            self._discard(name, completed=False)
+            self._record({'op': 'remove', 'name': name})
+            return True
+
+    def update(self, name, priority):
+        """Change a queued task's priority, returning its new position or None
+
+        The task keeps its original join time, so it stays ahead of tasks of
+        the new priority that joined after it.
+        """
+        with self.lock:
+            self._check_writable()
+            if name not in self.queue_position:
+                return None
+
+            self._reprioritize([name], priority)
+            self._record({'op': 'reprioritize', 'names': [name], 'priority': priority})
+            return {
+                'position': self.queue_position[name],
+                'priority': priority,
+                'queue_size': len(self.queue)
+            }
+
+    def select(self, tag=None, prefix=None):
+        """Names of queued tasks carrying ``tag`` and/or starting with ``prefix``"""
+        with self.lock:
+            if tag is not None:
+                names = self.tag_index.get(tag, set())
+            else:
+                names = self.queue_position
+            if prefix is not None:
+                return [name for name in names if name.startswith(prefix)]
+            return list(names)
+
+    def remove_matching(self, tag=None, prefix=None):
+        """Cancel every queued task matching a tag and/or name prefix
+
+        All matches leave in one pass over the queue, with one state write
+        and one journal entry. Returns the removed names.
+        """
+        with self.lock:
+            self._check_writable()
+            names = self.select(tag, prefix)
+            if names:
+                self._discard_many(names)
+                self._record({'op': 'remove_many', 'names': names})
+            return names
+
+    def reprioritize_matching(self, priority, tag=None, prefix=None):
+        """Set the priority of every queued task matching a tag and/or prefix
+
+        Returns the updated names.
+        """
+        with self.lock:
+            self._check_writable()
+            names = self.select(tag, prefix)
+            if names:
+                self._reprioritize(names, priority)
+                self._record({'op': 'reprioritize', 'names': names, 'priority': priority})
+            return names
+
+    def expire_tasks(self, now=None):
+        """Remove waiting tasks whose clients stopped polling, returning their names
+
+        Only deadlines falling due are examined; a task seen since its
+        deadline was set moves to its new one.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.read_only or self.moved_to is not None:
+                return []
+            expired = []
+            for name in self.expiry_wheel.pop_due(now):
+                alive_until = self.heartbeats[name][0]
+                if alive_until > now:
+                    self.expiry_wheel.schedule(name, alive_until)
+                else:
+                    expired.append(name)
+            if expired:
+                self._discard_many(expired)
+                self._record({'op': 'remove_many', 'names': expired})
+                log_event(logger, logging.WARNING, 'tasks_expired', queue=self.name, count=len(expired))
+            return expired
+
+    def _reprioritize(self, names, priority):
+        for name in names:
+            # Metadata dicts are shared with published snapshots, so replace them
+            self.task_metadata[name] = {**self.task_metadata[name], 'priority': priority}
+        if len(names) == 1:
+            self._reposition(names[0])
+        else:
+            self._reorder_by_priority()
+        self._track_queue_head()
+        self._persist()
+        self._publish()
+        log_event(logger, logging.INFO, 'tasks_reprioritized', queue=self.name, count=len(names),
+                  priority=priority)
+
+    def _discard_many(self, names):
+        """Drop queued tasks as removed, with one renumbering and state write"""
+        gone = set(names)
+        start = min(self.queue_position[name] for name in names) - 1
+        self.queue[start:] = [name for name in self.queue[start:] if name not in gone]
+        now = time.time()
+        for name in names:
+            del self.queue_position[name]
+            self._unindex_tags(name, self.task_metadata.pop(name, {}))
+            self._unschedule_expiry(name)
+            self.task_status.pop(name, None)
+            self.task_payloads.pop(name, None)
+            self.estimator.finish(name, now, record=False)
+
+        self._renumber(start)
+        self._track_queue_head()
+        self._update_metrics('task_failed', count=len(names))
+        self._persist()
+        self._publish()
+        log_event(logger, logging.INFO, 'tasks_removed', queue=self.name, count=len(names))
+
+    def _discard(self, name, completed):
+        """Drop a queued task as completed or removed, returning its metadata"""
+        index = self.queue_position.pop(name) - 1
+        del self.queue[index]
+        metadata = self.task_metadata.pop(name, {})
+        self._unindex_tags(name, metadata)
+        self._unschedule_expiry(name)
+        self.task_status.pop(name, None)
+        self.task_payloads.pop(name, None)
+
+        # Only tasks behind the removed one move up
+        self._renumber(index)
+
+        run_time = None
+        if completed:
+            # Fold the run time into the estimates
+            run_time = self.estimator.finish(name, time.time())
+            self.metrics['avg_run_time'] = self.estimator.queue_average
+        else:
+            # Cancelled tasks do not count towards run-time estimates
+            self.estimator.finish(name, time.time(), record=False)
+        self._track_queue_head()
+
+        # Update metrics
+        self._update_metrics('task_completed' if completed else 'task_failed', name, run_time)
+
+        # Persist state
+        self._persist()
+        self._publish()
+
+        log_event(logger, logging.INFO, 'task_completed' if completed else 'task_removed',
+                  queue=self.name, task=name)
+        return metadata
+
+    def list_tasks(self):
+        """List all tasks in the queue"""
+        snapshot = self.snapshot
+        task_list = []
+        for task_name in snapshot.queue:
+            task_list.append({
+                'name': task_name,
+                'position': snapshot.positions.get(task_name, -1),
+                'priority': snapshot.metadata.get(task_name, {}).get('priority', 0),
+                'status': snapshot.status.get(task_name, 'queued'),
+                'added_at': snapshot.metadata.get(task_name, {}).get('added_at', 'unknown')
+            })
+        return task_list
+
+    def size(self):
+        return len(self.snapshot.queue)
+
+    def current_metrics(self):
+        return dict(self.snapshot.metrics)
+
+    def metrics_history(self, metric_type, start, end, step):
+        """Rollup points for a metric, or None without persistence"""
+        if self.persistence is None:
+            return None
+        return self.persistence.query_metrics(metric_type, start, end, step)
+
+    def clear(self):
+        """Clear all tasks from the queue, returning how many were removed"""
+        with self.lock:
+            self._check_writable()
+            count = self._clear()
+            self._record({'op': 'clear'})
+            return count
+
+    def _clear(self):
+        count = len(self.queue)
+        self.queue.clear()
+        self.queue_position.clear()
+        self.task_metadata.clear()
+        self.task_status.clear()
+        self.task_payloads.clear()
+        self.claimed.clear()
+        self.tag_index.clear()
+        self.heartbeats.clear()
+        self.expiry_wheel.clear()
+        self.expiry_head = None
+        self.estimator.reset()
+
+        # Persist state
+        self._persist()
+        self._publish()
+
+        logger.warning(f"Queue cleared, removed {count} tasks")
+        return count
+
+    def claim(self, count, worker, wait=0):
+        """Hand up to ``count`` queued jobs to a worker, in queue order
+
+        Waits up to ``wait`` seconds for a job when none is queued. Jobs whose
+        worker has not reported within JOB_LEASE_TIMEOUT are queued again.
+        Returns a list of dicts with name, payload (bytes) and priority.
+        """
+        deadline = time.monotonic() + wait
+        with self.changed:
+            self._check_writable()
+            while True:
+                self._requeue_expired()
+                names = list(itertools.islice((n for n in self.queue if n in self.task_payloads), count))
+                remaining = deadline - time.monotonic()
+                if names or remaining <= 0:
+                    break
+                self.changed.wait(remaining)
+
+            if not names:
+                return []
+
+            claimed_at = time.time()
+            self._claim(names, worker, claimed_at)
+            self._record({'op': 'claim', 'names': names, 'worker': worker, 'claimed_at': claimed_at})
+            return [{
+                'name': name,
+                'payload': self.task_payloads[name],
+                'priority': self.task_metadata[name].get('priority', 0)
+            } for name in names]
+
+    def _claim(self, names, worker, claimed_at):
+        claimed_names = set(names)
+        self.queue[:] = [n for n in self.queue if n not in claimed_names]
+        for name in names:
+            self.queue_position.pop(name, None)
+            self._unindex_tags(name, self.task_metadata.get(name, {}))
+            self.task_status[name] = 'running'
+            self.claimed[name] = {'worker': worker, 'claimed_at': claimed_at}
+            # Run time is measured from the claim, not from reaching the head
+            self.estimator.finish(name, claimed_at, record=False)
+            self.estimator.mark_started(name, claimed_at)
+
+        self._renumber()
+        self._track_queue_head()
+        self._persist()
+        self._publish()
+        log_event(logger, logging.INFO, 'jobs_claimed', queue=self.name, worker=worker, count=len(names))
+
+    def report(self, name, status, result=None, error=None):
+        """Record the outcome of a claimed job, returning False if not claimed"""
+        if result is not None and len(result) > Config.MAX_PAYLOAD_BYTES:
+            raise PayloadTooLargeError(f'Result exceeds {Config.MAX_PAYLOAD_BYTES} bytes')
+
+        with self.lock:
+            self._check_writable()
+            if name not in self.claimed:
+                return False
+            self._finish_job(name, status, result, error)
+            self._record({'op': 'result', 'name': name, 'status': status, 'result': _b64(result), 'error': error})
+            return True
+
+    def _finish_job(self, name, status, result, error):
+        claim = self.claimed.pop(name)
+        self.task_metadata.pop(name, None)
+        self.task_status.pop(name, None)
+        self.task_payloads.pop(name, None)
+
+        completed = status == 'completed'
+        self.job_results[name] = {
+            'status': status,
+            'result': result,
+            'error': error,
+            'worker': claim['worker'],
+            'finished_at': datetime.now().isoformat()
+        }
+        self.job_results.move_to_end(name)
+        while len(self.job_results) > Config.JOB_RESULT_RETENTION:
+            self.job_results.popitem(last=False)
+
+        run_time = self.estimator.finish(name, time.time(), record=completed)
+        if completed:
+            self.metrics['avg_run_time'] = self.estimator.queue_average
+        self._update_metrics('task_completed' if completed else 'task_failed', name, run_time)
+
+        self._persist()
+        self._publish()
+        log_event(logger, logging.INFO, 'job_finished', queue=self.name, task=name, status=status,
+                  worker=claim['worker'])
+
+    def _requeue_expired(self):
+        now = time.time()
+        expired = [n for n, c in self.claimed.items() if now - c['claimed_at'] > Config.JOB_LEASE_TIMEOUT]
+        if expired:
+            self._requeue(expired)
+            self._record({'op': 'requeue', 'names': expired})
+            logger.warning(f"Requeued {len(expired)} jobs with expired leases")
+
+    def _requeue(self, names):
+        for name in names:
+            if self.claimed.pop(name, None) is None:
+                continue
+            self.estimator.finish(name, time.time(), record=False)
+            self.queue.append(name)
+            self._index_tags(name)
+            self.task_status[name] = 'queued'
+        self._reorder_by_priority()
+        self._renumber()
+        self._track_queue_head()
+        self._persist()
+        self._publish()
+
+    def job(self, name):
+        """Return the status of a job (and its result once finished), or None"""
+        with self.lock:
+            if name in self.queue_position:
+                return {'name': name, 'status': 'queued', 'position': self.queue_position[name]}
+            if name in self.claimed:
+                return {'name': name, 'status': 'running', **self.claimed[name]}
+            if name in self.job_results:
+                return {'name': name, **self.job_results[name]}
+            return None
+
+    def apply(self, op, seq=None):
+        """Apply a mutation recorded in another engine's journal
+
+        Followers replay the primary's journal through this so both engines
+        go through identical state transitions.
+        """
+        with self.lock:
+            kind = op['op']
+            if kind == 'join':
+                if op['name'] not in self.queue_position:
+                    self._insert(op['name'], op['metadata'], _unb64(op.get('payload')))
+                if op.get('idempotency_key') is not None:
+                    self.idempotency_keys.put(op['idempotency_key'], op['name'])
+            elif kind in ('next', 'remove'):
+                if op['name'] in self.queue_position:
+                    self._discard(op['name'], completed=(kind == 'next'))
+            elif kind == 'remove_many':
+                names = [name for name in op['names'] if name in self.queue_position]
+                if names:
+                    self._discard_many(names)
+            elif kind == 'reprioritize':
+                names = [name for name in op['names'] if name in self.queue_position]
+                if names:
+                    self._reprioritize(names, op['priority'])
+            elif kind == 'claim':
+                self._claim(op['names'], op['worker'], op['claimed_at'])
+            elif kind == 'result':
+                if op['name'] in self.claimed:
+                    self._finish_job(op['name'], op['status'], _unb64(op.get('result')), op.get('error'))
+            elif kind == 'requeue':
+                self._requeue(op['names'])
+            elif kind == 'clear':
+                self._clear()
+            elif kind == 'idempotency_key':
+                self.idempotency_keys.put(op['key'], op['name'])
+            elif kind == 'merge':
+                self._merge(op['state'])
+            else:
+                raise ValueError(f"Unknown journal operation: {kind}")
+
+            if self.journal is not None:
+                self.journal.append(op, seq)
+
+    def export_state(self):
+        """Return a copy of the queue state and counters"""
+        with self.lock:
+            names = itertools.chain(self.queue, self.claimed)
+            return {
+                'queue': list(self.queue),
+                'metadata': {name: self.task_metadata.get(name, {}) for name in names},
+                'status': dict(self.task_status),
+                'payloads': {name: _b64(payload) for name, payload in self.task_payloads.items()},
+                'claimed': dict(self.claimed),
+                'results': {name: {**result, 'result': _b64(result['result'])}
+                            for name, result in self.job_results.items()},
+                'metrics': {key: value for key, value in self.metrics.items() if key != 'task_history'}
+            }
+
+    def merge_state(self, state):
+        """Add a queue exported by another node, keeping the tasks already here
+
+        Used when a queue is handed off to a node where clients may already
+        have joined it. Recorded as one journal entry.
+        """
+        with self.lock:
+            self._check_writable()
+            self._merge(state)
+            self._record({'op': 'merge', 'state': state})
+
+    def _merge(self, state):
+        metadata = state['metadata']
+        payloads = state.get('payloads', {})
+        for name in itertools.chain(state['queue'], state.get('claimed', {})):
+            if name in self.queue_position or name in self.claimed:
+                continue
+            self.task_metadata[name] = metadata[name]
+            if payloads.get(name) is not None:
+                self.task_payloads[name] = _unb64(payloads[name])
+            claim = state.get('claimed', {}).get(name)
+            if claim is None:
+                self.queue.append(name)
+                self.task_status[name] = 'queued'
+                self._index_tags(name)
+                self._schedule_expiry(name)
+            else:
+                self.claimed[name] = claim
+                self.task_status[name] = 'running'
+                self.estimator.mark_started(name, claim['claimed_at'])
+
+        for name, result in state.get('results', {}).items():
+            if name not in self.job_results:
+                self.job_results[name] = {**result, 'result': _unb64(result.get('result'))}
+        while len(self.job_results) > Config.JOB_RESULT_RETENTION:
+            self.job_results.popitem(last=False)
+        for key in ('total_tasks', 'completed_tasks', 'failed_tasks'):
+            self.metrics[key] += state.get('metrics', {}).get(key, 0)
+        self.metrics['current_queue_size'] = len(self.queue)
+
+        self._reorder_by_priority()
+        self._renumber()
+        self._track_queue_head()
+        self._persist()
+        self._publish()
+
+    def begin_handoff(self, owner):
+        """Stop changing a queue that moves to ``owner`` and export its state
+
+        Writers waiting on the lock get QueueMovedError once it is released.
+        Returns None when there are no tasks, claims or results to ship.
+        """
+        with self.lock:
+            self.moved_to = owner
+            if not (self.queue or self.claimed or self.job_results):
+                return None
+            return self.export_state()
+
+    def cancel_handoff(self):
+        """Accept writes again after a failed handoff or once the queue is back"""
+        with self.lock:
+            self.moved_to = None
+
+    def export_view(self):
+        """Return a consistent point-in-time view for streaming exports
+
+        Only shallow copies are taken under the lock. Metadata dicts are
+        replaced rather than mutated and payloads are immutable, so the view
+        stays consistent while writers carry on.
+        """
+        with self.lock:
+            snapshot = self.snapshot
+            payloads = dict(self.task_payloads)
+            claimed = dict(self.claimed)
+        return {
+            'queue': snapshot.queue,
+            'metadata': dict(snapshot.metadata),
+            'payloads': payloads,
+            'claimed': claimed,
+            'metrics': {key: value for key, value in snapshot.metrics.items() if key != 'task_history'}
+        }
+
+    def restore(self, state):
+        """Replace the queue with an exported state on a primary
+
+        The state is too large to journal, so the journal restarts past its
+        last entry; followers find their position truncated and bootstrap
+        from a full snapshot.
+        """
+        with self.lock:
+            self._check_writable()
+            self.load_state(state)
+            if self.journal is not None:
+                self.journal.reset(self.journal.last_seq + 1)
+        logger.warning(f"Queue {self.name} restored with {len(state['queue'])} tasks")
+
+    def load_state(self, state):
+        """Replace the queue state with an exported copy
+
+        The state is checked, decoded and indexed in full before anything is
+        replaced, so a state that fails leaves the queue as it was.
+        """
+        check_state(state)
+        queue = list(state['queue'])
+        positions = {name: i + 1 for i, name in enumerate(queue)}
+        metadata = dict(state['metadata'])
+        tag_index = self._build_tag_index(queue, metadata)
+        heartbeats, expiry_wheel = self._build_expiry(queue, metadata)
+        status = dict(state['status'])
+        payloads = {name: _unb64(p) for name, p in state.get('payloads', {}).items()}
+        claimed = dict(state.get('claimed', {}))
+        results = OrderedDict((name, {**result, 'result': _unb64(result.get('result'))})
+                              for name, result in state.get('results', {}).items())
+
+        with self.lock:
+            self.queue = queue
+            self.queue_position = positions
+            self.task_metadata = metadata
+            self.task_status = status
+            self.task_payloads = payloads
+            self.claimed = claimed
+            self.job_results = results
+            self.tag_index = tag_index
+            self.heartbeats, self.expiry_wheel = heartbeats, expiry_wheel
+            self.expiry_head = None
+            self.metrics.update(state.get('metrics', {}))
+            self.estimator.reset()
+            self._track_queue_head()
+
+            self._persist()
+            self._publish()
+
+
+class QueueRegistry:
+    """Named queues, each backed by its own QueueEngine
+
+    Queues other than ``default`` persist to a sibling of DATABASE_PATH
+    (``queue_data.<name>.db``) and are rediscovered from those files on start.
+    All engines share one replication journal; entries carry their queue name.
+    """
+
+    DEFAULT = 'default'
+    NAME_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+    def __init__(self, db_path=None, journal=None, persistence_class=PersistenceLayer):
+        self.db_path = db_path
+        self.journal = journal
+        self.persistence_class = persistence_class
+        self.read_only = False
+        self.engines = {}
+        self.lock = threading.RLock()
+
+        if db_path is not None:
+            root, ext = os.path.splitext(db_path)
+            for path in sorted(glob.glob(f'{glob.escape(root)}.*{ext}')):
+                name = path[len(root) + 1:len(path) - len(ext)]
+                if self.NAME_PATTERN.match(name):
+                    self.get(name)
+        self.get(self.DEFAULT)
+
+    @classmethod
+    def valid_name(cls, name):
+        return bool(name and cls.NAME_PATTERN.match(name))
+
+    def _db_path_for(self, name):
+        if name == self.DEFAULT:
+            return self.db_path
+        root, ext = os.path.splitext(self.db_path)
+        return f'{root}.{name}{ext}'
+
+    def get(self, name=DEFAULT):
+        """Return the engine for a named queue, creating it on first use"""
+        engine = self.engines.get(name)
+        if engine is not None:
+            return engine
+
+        if not self.valid_name(name):
+            raise ValueError(f"Invalid queue name: {name!r}")
+
+        with self.lock:
+            engine = self.engines.get(name)
+            if engine is None:
+                persistence = None
+                if self.db_path is not None:
+                    persistence = self.persistence_class(self._db_path_for(name))
+                engine = QueueEngine(persistence, self.journal, name=name)
+                engine.read_only = self.read_only
+                self.engines[name] = engine
+            return engine
+
+    def lookup(self, name=DEFAULT):
+        """Return the engine for a named queue without creating it
+
+        An unknown queue is served by an empty, unregistered engine, so reads
+        and writes to existing tasks never leave a database file behind.
+        """
+        engine = self.engines.get(name)
+        if engine is not None:
+            return engine
+        if not self.valid_name(name):
+            raise ValueError(f"Invalid queue name: {name!r}")
+        engine = QueueEngine(name=name)
+        engine.read_only = self.read_only
+        return engine
+
+    def names(self):
+        with self.lock:
+            return list(self.engines)
+
+    def drop(self, name):
+        """Clear a queue and stop serving it from this node"""
+        with self.lock:
+            engine = self.engines.get(name)
+            if engine is None:
+                return
+            if name != self.DEFAULT:
+                del self.engines[name]
+
+        with engine.lock:
+            engine._clear()
+        if name != self.DEFAULT and engine.persistence is not None:
+            if os.path.exists(engine.persistence.db_path):
+                os.unlink(engine.persistence.db_path)
+            # A deferred write must not recreate the file
+            engine.persistence = None
+
+    def set_read_only(self, read_only):
+        with self.lock:
+            self.read_only = read_only
+            for engine in self.engines.values():
+                engine.set_read_only(read_only)
+
+    def expire_tasks(self):
+        """Expire abandoned waiting tasks in every queue"""
+        for name in self.names():
+            self.get(name).expire_tasks()
+
+    def apply(self, op, seq=None):
+        """Apply a replicated journal entry to the queue it belongs to"""
+        self.get(op.get('queue', self.DEFAULT)).apply(op, seq)
+
+    def export_state(self):
+        """Return (states by queue name, journal sequence) as of one instant"""
+        with self.lock, ExitStack() as stack:
+            engines = sorted(self.engines.items())
+            for _, engine in engines:
+                stack.enter_context(engine.lock)
+            last_seq = self.journal.last_seq if self.journal is not None else 0
+            return {name: engine.export_state() for name, engine in engines}, last_seq
+
+    def load_state(self, states):
+        """Replace every queue with exported states, dropping the rest"""
+        with self.lock:
+            for name in self.names():
+                if name not in states and name != self.DEFAULT:
+                    self.drop(name)
+            for name, state in states.items():
+                self.get(name).load_state(state)
+
@@ -0,0 +1,648 @@
+"""
+Single-writer engine process fed through shared-memory rings
+
+In process mode (``ENGINE_MODE=process``) one engine process owns every
+queue and applies commands one at a time on a single thread, so queue state
+is never contended. HTTP front ends, in any number of processes, talk to it
+through a pair of single-producer/single-consumer rings in a shared memory
+block each front end creates and announces over a multiprocessing
+connection. After that the connection only carries one-byte doorbells,
+sent when the reader of a ring may have gone to sleep.
+
+The engine drains every ring on each wakeup and runs the whole batch before
+answering. Persistence is written once per queue per batch (group commit),
+so mutation throughput is set by the engine loop rather than by lock
+hand-offs. Blocking calls (wait, claim, journal long-polls) are parked and
+retried once a batch has changed some queue, instead of blocking the loop.
+
+Run the engine with ``python -m app.engine_process`` and the front ends with
+``ENGINE_MODE=process`` and the same ``ENGINE_ADDRESS``. Front ends must
+present ``ENGINE_AUTHKEY``; without one the engine generates a key and
+writes it next to the address (``<ENGINE_ADDRESS>.key``, owner-only), where
+front ends running as the same user read it.
+"""
+import atexit
+import itertools
+import logging
+import os
+import pickle
+import queue
+import signal
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import ExitStack
+from multiprocessing import AuthenticationError, Pipe, resource_tracker
+from multiprocessing.connection import Client, Listener, wait
+from multiprocessing.shared_memory import SharedMemory
+
+from app.engine import QueueRegistry
+
+logger = logging.getLogger(__name__)
+
+RING_HEADER = struct.Struct('QQ')   # bytes consumed (head), bytes produced (tail)
+FRAME_HEADER = struct.Struct('IB')  # body length, frame kind
+SPILL_HEADER = struct.Struct('Q')   # pickled size, followed by the segment name
+
+FRAME_INLINE = 0
+FRAME_SPILLED = 1
+
+# Longest sleep of a ring reader, a backstop should a doorbell go missing
+IDLE_WAIT = 0.05
+
+# Seconds between sweeps for abandoned waiting tasks
+EXPIRY_INTERVAL = 1.0
+
+# Methods front ends may call, by target kind
+QUEUE_CALLS = frozenset({
+    'join', 'position', 'positions', 'wait', 'next', 'remove', 'update', 'select',
+    'remove_matching', 'reprioritize_matching', 'list_tasks', 'size', 'clear', 'claim',
+    'report', 'job', 'estimate_start', 'current_metrics', 'metrics_history',
+    'export_state', 'export_view', 'load_state', 'restore', 'begin_handoff', 'cancel_handoff',
+    'merge_state'
+})
+REGISTRY_CALLS = frozenset({'names', 'drop', 'export_state', 'load_state'})
+JOURNAL_CALLS = frozenset({'since', 'last_seq', 'id'})
+
+# Calls that may block: (index of the timeout argument, test of a result to
+# return early). The engine runs them without a timeout and parks them
+# until the test passes or the timeout expires.
+BLOCKING_CALLS = {
+    ('queue', 'wait'): (1, lambda position: position in (1, -1)),
+    ('lookup', 'wait'): (1, lambda position: position in (1, -1)),
+    ('queue', 'claim'): (2, bool),
+    ('journal', 'since'): (2, lambda result: bool(result[0]))
+}
+
+
+class EngineUnavailableError(Exception):
+    """Raised when the engine process cannot be reached"""
+
+
+def authkey_path(address):
+    return f'{address}.key'
+
+
+def _read_authkey(address):
+    try:
+        with open(authkey_path(address), 'rb') as f:
+            return f.read()
+    except OSError as e:
+        raise EngineUnavailableError(f"No ENGINE_AUTHKEY and no key file for {address}: {e}") from e
+
+
+def _write_authkey(address):
+    """Generate a key for the engine's listener, readable by its owner only"""
+    authkey = os.urandom(32)
+    path = authkey_path(address)
+    if os.path.exists(path):
+        os.unlink(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(authkey)
+    return authkey
+
+
+_fence_lock = threading.Lock()
+
+
+def _fence():
+    """Order the shared-memory accesses before and after this call
+
+    Python has no fence primitive; taking and releasing a lock runs the
+    atomic instructions of a mutex, which other cores observe in order.
+    """
+    with _fence_lock:
+        pass
+
+
+class ShmRing:
+    """Single-producer, single-consumer ring of byte frames in shared memory
+
+    ``head`` and ``tail`` count the bytes ever consumed and produced. Each
+    is written by one side only, so neither side takes a lock; fences make
+    sure an index is only published after the frames it covers.
+    """
+
+    def __init__(self, buf, capacity):
+        self.header = buf[:RING_HEADER.size]
+        self.data = buf[RING_HEADER.size:RING_HEADER.size + capacity]
+        self.capacity = capacity
+
+    @staticmethod
+    def size(capacity):
+        return RING_HEADER.size + capacity
+
+    def _write(self, pos, data):
+        offset = pos % self.capacity
+        first = min(len(data), self.capacity - offset)
+        self.data[offset:offset + first] = data[:first]
+        self.data[:len(data) - first] = data[first:]
+
+    def _read(self, pos, length):
+        offset = pos % self.capacity
+        first = min(length, self.capacity - offset)
+        return bytes(self.data[offset:offset + first]) + bytes(self.data[:length - first])
+
+    def put(self, kind, body):
+        """Append a frame; returns None when full, else whether to ring the reader"""
+        size = FRAME_HEADER.size + len(body)
+        if size > self.capacity:
+            raise ValueError(f"Frame of {size} bytes exceeds ring capacity")
+        head, tail = RING_HEADER.unpack(self.header)
+        if size > self.capacity - (tail - head):
+            return None
+        self._write(tail, FRAME_HEADER.pack(len(body), kind))
+        self._write(tail + FRAME_HEADER.size, body)
+        _fence()
+        struct.pack_into('Q', self.header, 8, tail + size)
+        # Read head only after publishing tail: if the reader had consumed
+        # everything before this frame it may be asleep
+        _fence()
+        return RING_HEADER.unpack(self.header)[0] == tail
+
+    def get_all(self):
+        """Remove and return all frames as (kind, body) pairs"""
+        frames = []
+        while True:
+            head, tail = RING_HEADER.unpack(self.header)
+            if head == tail:
+                return frames
+            _fence()
+            while head < tail:
+                length, kind = FRAME_HEADER.unpack(self._read(head, FRAME_HEADER.size))
+                frames.append((kind, self._read(head + FRAME_HEADER.size, length)))
+                head += FRAME_HEADER.size + length
+            # The writer may reuse the space as soon as head moves
+            _fence()
+            struct.pack_into('Q', self.header, 0, head)
+
+    def release(self):
+        self.header.release()
+        self.data.release()
+
+
+def _open_rings(shm, capacity):
+    """Return the (requests, responses) rings laid out in a shared memory block"""
+    span = ShmRing.size(capacity)
+    return ShmRing(shm.buf[:span], capacity), ShmRing(shm.buf[span:2 * span], capacity)
+
+
+def _encode(message, capacity):
+    """Pickle a message into a frame, moving large ones to a segment of their own"""
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    if len(data) <= capacity // 4:
+        return FRAME_INLINE, data
+
+    spill = SharedMemory(create=True, size=len(data))
+    spill.buf[:len(data)] = data
+    # The reader unlinks the segment once it has copied it out
+    resource_tracker.unregister(spill._name, 'shared_memory')
+    spill.close()
+    return FRAME_SPILLED, SPILL_HEADER.pack(len(data)) + spill.name.encode()
+
+
+def _decode(kind, body):
+    if kind == FRAME_SPILLED:
+        (size,) = SPILL_HEADER.unpack_from(body)
+        spill = SharedMemory(body[SPILL_HEADER.size:].decode())
+        try:
+            body = bytes(spill.buf[:size])
+        finally:
+            spill.close()
+            spill.unlink()
+    return pickle.loads(body)
+
+
+class _Channel:
+    """One front-end process's rings and doorbell connection to the engine"""
+
+    def __init__(self, address, authkey, capacity):
+        self.capacity = capacity
+        self.pending = {}
+        self.closed = False
+        self.write_lock = threading.Lock()
+        self.shm = SharedMemory(create=True, size=2 * ShmRing.size(capacity))
+        self.requests, self.responses = _open_rings(self.shm, capacity)
+        try:
+            self.conn = Client(address, authkey=authkey)
+            self.conn.send((self.shm.name, capacity, os.getpid()))
+        except (OSError, EOFError, AuthenticationError) as e:
+            self._release()
+            raise EngineUnavailableError(f"Cannot reach engine at {address}: {e}") from e
+
+        self.receiver = threading.Thread(target=self._receive, daemon=True)
+        self.receiver.start()
+
+    def send(self, request_id, message):
+        """Queue a request for the engine and return a Future for its result"""
+        future = Future()
+        # Registered before checking `closed`, so a concurrent failure fails it
+        self.pending[request_id] = future
+        frame = _encode(message, self.capacity)
+        with self.write_lock:
+            while True:
+                if self.closed:
+                    self.pending.pop(request_id, None)
+                    raise EngineUnavailableError('Engine connection is closed')
+                wake = self.requests.put(*frame)
+                if wake is not None:
+                    break
+                # Ring full: the engine is behind, give it time to drain
+                time.sleep(0.001)
+            if wake:
+                try:
+                    self.conn.send_bytes(b'\0')
+                except OSError as e:
+                    raise EngineUnavailableError('Engine connection lost') from e
+        return future
+
+    def _receive(self):
+        try:
+            while not self.closed:
+                if self.conn.poll(IDLE_WAIT):
+                    while self.conn.poll():
+                        self.conn.recv_bytes()
+                for kind, body in self.responses.get_all():
+                    request_id, failed, value = _decode(kind, body)
+                    future = self.pending.pop(request_id, None)
+                    if future is None:
+                        continue
+                    if failed:
+                        future.set_exception(value)
+                    else:
+                        future.set_result(value)
+        except (EOFError, OSError, ValueError):
+            pass
+        finally:
+            self.closed = True
+            for request_id in list(self.pending):
+                future = self.pending.pop(request_id, None)
+                if future is not None:
+                    future.set_exception(EngineUnavailableError('Engine connection lost'))
+            self.conn.close()
+            with self.write_lock:
+                self._release()
+
+    def close(self):
+        """Disconnect; the receiver thread releases the rings on its way out"""
+        self.closed = True
+        self.receiver.join(IDLE_WAIT * 4)
+
+    def _release(self):
+        self.requests.release()
+        self.responses.release()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class EngineClient:
+    """A front end's link to the engine process, usable from any thread
+
+    Connects on first use, and again in a forked child, so every front-end
+    process has rings of its own. Without an ``authkey`` the key the engine
+    wrote next to ``address`` is used.
+    """
+
+    def __init__(self, address, authkey=None, ring_bytes=4 * 1024 * 1024):
+        self.address = address
+        self.authkey = authkey
+        self.ring_bytes = ring_bytes
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._connection = None
+        atexit.register(self.close)
+
+    def _channel(self):
+        pid = os.getpid()
+        connection = self._connection
+        if connection is None or connection[0] != pid or connection[1].closed:
+            with self._lock:
+                connection = self._connection
+                if connection is None or connection[0] != pid or connection[1].closed:
+                    authkey = self.authkey or _read_authkey(self.address)
+                    connection = (pid, _Channel(self.address, authkey, self.ring_bytes))
+                    self._connection = connection
+        return connection[1]
+
+    def call(self, target, method, *args):
+        """Run ``method(*args)`` on a target in the engine process and return its result
+
+        ``target`` is ``('queue', name)``, ``('lookup', name)`` (a queue that
+        is not created), ``('registry', None)`` or ``('journal', None)``.
+        Exceptions raised by the engine are re-raised.
+        """
+        request_id = next(self._ids)
+        return self._channel().send(request_id, (request_id, target, method, args)).result()
+
+    def close(self):
+        connection = self._connection
+        if connection is not None and connection[0] == os.getpid():
+            self._connection = None
+            connection[1].close()
+
+
+class RemoteEngine:
+    """QueueEngine stand-in whose calls run in the engine process"""
+
+    def __init__(self, client, name, kind='queue'):
+        self.client = client
+        self.name = name
+        self.kind = kind
+
+    def __getattr__(self, method):
+        if method not in QUEUE_CALLS:
+            raise AttributeError(f"{method!r} is not available in process mode")
+
+        def call(*args):
+            return self.client.call((self.kind, self.name), method, *args)
+        return call
+
+
+class RemoteRegistry:
+    """QueueRegistry stand-in whose queues live in the engine process"""
+
+    DEFAULT = QueueRegistry.DEFAULT
+    valid_name = QueueRegistry.valid_name
+
+    def __init__(self, client):
+        self.client = client
+        self.engines = {}
+
+    def get(self, name=DEFAULT):
+        engine = self.engines.get(name)
+        if engine is None:
+            if not self.valid_name(name):
+                raise ValueError(f"Invalid queue name: {name!r}")
+            engine = self.engines.setdefault(name, RemoteEngine(self.client, name))
+        return engine
+
+    def lookup(self, name=DEFAULT):
+        """Engine for a queue that is not created if it does not exist"""
+        if not self.valid_name(name):
+            raise ValueError(f"Invalid queue name: {name!r}")
+        return RemoteEngine(self.client, name, kind='lookup')
+
+    def names(self):
+        return self.client.call(('registry', None), 'names')
+
+    def drop(self, name):
+        return self.client.call(('registry', None), 'drop', name)
+
+    def export_state(self):
+        return self.client.call(('registry', None), 'export_state')
+
+    def load_state(self, states):
+        return self.client.call(('registry', None), 'load_state', states)
+
+
+class RemoteJournal:
+    """MutationJournal stand-in for the engine process's journal"""
+
+    def __init__(self, client):
+        self.client = client
+
+    @property
+    def last_seq(self):
+        return self.client.call(('journal', None), 'last_seq')
+
+    @property
+    def id(self):
+        return self.client.call(('journal', None), 'id')
+
+    def since(self, seq, limit=1000, wait=0):
+        return self.client.call(('journal', None), 'since', seq, limit, wait)
+
+
+class _FrontEnd:
+    """Engine-side end of one front end's rings"""
+
+    def __init__(self, conn, shm_name, capacity, pid):
+        self.conn = conn
+        self.capacity = capacity
+        self.shm = SharedMemory(shm_name)
+        # The front end created the segment and unlinks it
+        if pid != os.getpid():
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.requests, self.responses = _open_rings(self.shm, capacity)
+        self.outbox = deque()
+
+    def reply(self, request_id, value, failed=False):
+        try:
+            frame = _encode((request_id, failed, value), self.capacity)
+        except Exception as e:
+            frame = _encode((request_id, True, RuntimeError(f"Unpicklable response: {e}")), self.capacity)
+        self.outbox.append(frame)
+
+    def flush(self):
+        """Move queued replies into the response ring, ringing the front end if needed"""
+        wake = False
+        while self.outbox:
+            woke = self.responses.put(*self.outbox[0])
+            if woke is None:
+                break
+            self.outbox.popleft()
+            wake = wake or woke
+        if wake:
+            self.conn.send_bytes(b'\0')
+
+    def close(self):
+        self.requests.release()
+        self.responses.release()
+        self.shm.close()
+        self.conn.close()
+
+
+class EngineServer:
+    """Applies front-end commands to a QueueRegistry on a single thread
+
+    Without an ``authkey`` a random one is written to ``<address>.key``;
+    the listener never accepts unauthenticated clients.
+    """
+
+    def __init__(self, registry, address, authkey=None):
+        self.registry = registry
+        self.address = address
+        if authkey is None:
+            authkey = _write_authkey(address)
+        self.listener = Listener(address, authkey=authkey)
+        self.frontends = {}
+        self.arrivals = queue.SimpleQueue()
+        self.parked = []
+        # Queue snapshots as of the last retry of parked calls
+        self.parked_seen = []
+        self.running = False
+        self._wake_reader, self._wake_writer = Pipe(duplex=False)
+
+    def _accept(self):
+        # Handshakes happen here so a slow client never stalls the engine loop
+        while self.running:
+            try:
+                conn = self.listener.accept()
+                self.arrivals.put(_FrontEnd(conn, *conn.recv()))
+                self._wake_writer.send_bytes(b'\0')
+            except (OSError, EOFError, AuthenticationError) as e:
+                if self.running:
+                    logger.warning(f"Rejected engine client: {e}")
+
+    def serve_forever(self):
+        self.running = True
+        threading.Thread(target=self._accept, daemon=True).start()
+        logger.info(f"Engine process serving on {self.address}")
+        next_expiry = time.monotonic() + EXPIRY_INTERVAL
+        try:
+            while self.running:
+                self._sleep()
+                self._run_batch()
+                if time.monotonic() >= next_expiry:
+                    self.registry.expire_tasks()
+                    next_expiry = time.monotonic() + EXPIRY_INTERVAL
+        finally:
+            self.running = False
+            self.listener.close()
+            for frontend in list(self.frontends.values()):
+                frontend.close()
+            self.frontends.clear()
+
+    def shutdown(self):
+        self.running = False
+        self._wake_writer.send_bytes(b'\0')
+
+    def _sleep(self):
+        timeout = IDLE_WAIT
+        if self.parked:
+            nearest = min(parked[-1] for parked in self.parked)
+            timeout = max(0, min(timeout, nearest - time.monotonic()))
+
+        for conn in wait([self._wake_reader, *self.frontends], timeout):
+            try:
+                while conn.poll():
+                    conn.recv_bytes()
+            except (EOFError, OSError):
+                self._drop(conn)
+
+        while not self.arrivals.empty():
+            frontend = self.arrivals.get()
+            self.frontends[frontend.conn] = frontend
+
+    def _drop(self, conn):
+        frontend = self.frontends.pop(conn)
+        self.parked = [parked for parked in self.parked if parked[0] is not frontend]
+        frontend.close()
+
+    def _run_batch(self):
+        batch = [(frontend, frame) for frontend in self.frontends.values()
+                 for frame in frontend.requests.get_all()]
+        if batch or self._parked_due():
+            # Replies are only sent after the batch's state is written
+            with ExitStack() as stack:
+                for engine in list(self.registry.engines.values()):
+                    stack.enter_context(engine.deferred_persistence())
+                for frontend, frame in batch:
+                    self._execute(frontend, _decode(*frame))
+                self._retry_parked()
+
+        for conn, frontend in list(self.frontends.items()):
+            try:
+                frontend.flush()
+            except OSError:
+                self._drop(conn)
+
+    def _resolve(self, target, method):
+        kind, name = target
+        if kind == 'queue' and method in QUEUE_CALLS:
+            return getattr(self.registry.get(name), method)
+        if kind == 'lookup' and method in QUEUE_CALLS:
+            return getattr(self.registry.lookup(name), method)
+        if kind == 'registry' and method in REGISTRY_CALLS:
+            return getattr(self.registry, method)
+        if kind == 'journal' and method in JOURNAL_CALLS and self.registry.journal is not None:
+            journal = self.registry.journal
+            if method == 'since':
+                return journal.since
+            return lambda: getattr(journal, method)
+        raise ValueError(f"{kind}.{method} cannot be called remotely")
+
+    def _execute(self, frontend, message):
+        request_id, target, method, args = message
+        try:
+            call = self._resolve(target, method)
+            blocking = BLOCKING_CALLS.get((target[0], method))
+            if blocking is not None and len(args) > blocking[0] and args[blocking[0]] > 0:
+                index, ready = blocking
+                deadline = time.monotonic() + args[index]
+                args = args[:index] + (0,) + args[index + 1:]
+                result = call(*args)
+                if not ready(result):
+                    self.parked.append((frontend, request_id, call, args, ready, deadline))
+                    return
+            else:
+                result = call(*args)
+        except Exception as e:
+            frontend.reply(request_id, e, failed=True)
+            return
+        frontend.reply(request_id, result)
+
+    def _snapshots(self):
+        # Every mutation publishes a new snapshot, and parked calls can only
+        # become ready through a mutation
+        return [engine.snapshot for engine in self.registry.engines.values()]
+
+    def _changed(self):
+        snapshots = self._snapshots()
+        return len(snapshots) != len(self.parked_seen) or any(
+            new is not old for new, old in zip(snapshots, self.parked_seen))
+
+    def _parked_due(self):
+        if not self.parked:
+            return False
+        now = time.monotonic()
+        return self._changed() or any(parked[-1] <= now for parked in self.parked)
+
+    def _retry_parked(self):
+        """Retry parked calls after a change, and answer those past their deadline"""
+        if not self.parked:
+            return
+        now = time.monotonic()
+        changed = self._changed()
+        self.parked_seen = self._snapshots()
+        still_parked = []
+        for parked in self.parked:
+            frontend, request_id, call, args, ready, deadline = parked
+            if not changed and now < deadline:
+                still_parked.append(parked)
+                continue
+            try:
+                result = call(*args)
+            except Exception as e:
+                frontend.reply(request_id, e, failed=True)
+                continue
+            if ready(result) or now >= deadline:
+                frontend.reply(request_id, result)
+            else:
+                still_parked.append(parked)
+        self.parked = still_parked
+
+
+def main():
+    from app.config import Config
+    from app.logs import configure_logging, parse_sample_rates
+    from app.replication import MutationJournal
+
+    configure_logging(Config.LOG_LEVEL, Config.LOG_FORMAT, Config.LOG_ASYNC,
+                      parse_sample_rates(Config.LOG_SAMPLE_RATES))
+    if Config.REPLICATION_ROLE == 'follower':
+        raise SystemExit('The engine process only runs on a primary')
+
+    registry = QueueRegistry(Config.DATABASE_PATH, MutationJournal(Config.REPLICATION_JOURNAL_SIZE))
+    if os.path.exists(Config.ENGINE_ADDRESS):
+        os.unlink(Config.ENGINE_ADDRESS)
+    server = EngineServer(registry, Config.ENGINE_ADDRESS, Config.ENGINE_AUTHKEY)
+    signal.signal(signal.SIGTERM, lambda *_: server.shutdown())
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
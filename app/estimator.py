@@ -0,0 +1,87 @@
+"""
+Run-time estimates used to predict start times and pace client polling
+"""
+import threading
+from collections import OrderedDict
+
+
+class RunTimeEstimator:
+    """Track EWMA run durations per task name and for the whole queue
+
+    A task is considered running from the moment it reaches the head of the
+    queue until it is completed. Names that have never completed fall back to
+    the queue-wide average.
+    """
+
+    def __init__(self, alpha=0.2, max_names=10000):
+        self.alpha = alpha
+        self.max_names = max_names
+        self.queue_average = None
+        self.name_averages = OrderedDict()
+        self.started_at = {}
+        self.lock = threading.Lock()
+
+    def _blend(self, previous, sample):
+        if previous is None:
+            return sample
+        return self.alpha * sample + (1 - self.alpha) * previous
+
+    def mark_started(self, name, now):
+        """Record when a task reached the head of the queue"""
+        with self.lock:
+            self.started_at.setdefault(name, now)
+
+    def finish(self, name, now, record=True):
+        """Stop tracking a task, folding its run time into the averages"""
+        with self.lock:
+            started = self.started_at.pop(name, None)
+            if started is None or not record:
+                return None
+
+            duration = max(0.0, now - started)
+            self.queue_average = self._blend(self.queue_average, duration)
+            self.name_averages[name] = self._blend(self.name_averages.get(name), duration)
+            self.name_averages.move_to_end(name)
+            while len(self.name_averages) > self.max_names:
+                self.name_averages.popitem(last=False)
+            return duration
+
+    def reset(self):
+        """Forget running tasks (averages are kept)"""
+        with self.lock:
+            self.started_at.clear()
+
+    def expected_duration(self, name):
+        """Expected run time for a task name, or None without history"""
+        with self.lock:
+            return self.name_averages.get(name, self.queue_average)
+
+    def estimate_wait(self, position, head_name, now):
+        """Estimate seconds until the task at ``position`` reaches the head
+
+        Returns None until at least one task has completed.
+        """
+        if position < 1:
+            return None
+        if position == 1:
+            return 0.0
+
+        with self.lock:
+            if self.queue_average is None:
+                return None
+            head_expected = self.name_averages.get(head_name, self.queue_average)
+            started = self.started_at.get(head_name)
+            queue_average = self.queue_average
+
+        head_remaining = head_expected
+        if started is not None:
+            head_remaining = max(0.0, head_expected - (now - started))
+
+        return head_remaining + (position - 2) * queue_average
+
+    @staticmethod
+    def poll_delay(estimated_wait, min_delay, max_delay, fraction=0.5):
+        """Suggest a delay before the next poll given an estimated wait"""
+        if estimated_wait is None:
+            return None
+        return min(max(estimated_wait * fraction, min_delay), max_delay)
@@ -0,0 +1,87 @@
+"""
+Incremental expiry of waiting tasks
+
+Each waiting task has a deadline on a hashed timing wheel. Clients push
+their task's "alive until" time forward whenever they poll or wait; that
+is a single store, so reads stay lock-free. The wheel is only consulted
+when a deadline comes due. A task whose client has been seen since is
+moved to its new deadline, and any other task is expired. Work per tick is
+proportional to the deadlines falling due, never to the queue length.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TimingWheel:
+    """Hashed timing wheel of keys by monotonic deadline
+
+    Deadlines fall into ``tick``-second buckets on a wheel of ``slots``
+    buckets. Scheduling, rescheduling and removing a key are O(1), and
+    ``pop_due`` only visits the buckets whose ticks have passed. Deadlines
+    more than one turn away stay in their bucket until the turn in which
+    they fall due.
+    """
+
+    def __init__(self, tick=1.0, slots=512, now=None):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.deadlines = {}
+        self.current = self._tick(time.monotonic() if now is None else now)
+
+    def _tick(self, deadline):
+        return int(deadline // self.tick)
+
+    def _slot(self, deadline):
+        # Deadlines in ticks already passed are due at the next pop
+        return self.slots[max(self._tick(deadline), self.current) % len(self.slots)]
+
+    def schedule(self, key, deadline):
+        self.remove(key)
+        self.deadlines[key] = deadline
+        self._slot(deadline).add(key)
+
+    def remove(self, key):
+        deadline = self.deadlines.pop(key, None)
+        if deadline is not None:
+            self._slot(deadline).discard(key)
+
+    def pop_due(self, now):
+        """Remove and return the keys whose deadlines are at or before ``now``"""
+        tick = self._tick(now)
+        last = min(tick, self.current + len(self.slots) - 1)
+        due = []
+        # The current tick is revisited: keys later in it were not due yet
+        for index in range(self.current, last + 1):
+            slot = self.slots[index % len(self.slots)]
+            for key in [key for key in slot if self.deadlines[key] <= now]:
+                slot.discard(key)
+                del self.deadlines[key]
+                due.append(key)
+        self.current = max(self.current, tick)
+        return due
+
+    def clear(self):
+        for slot in self.slots:
+            slot.clear()
+        self.deadlines.clear()
+
+    def __len__(self):
+        return len(self.deadlines)
+
+
+def start_reaper(registry, interval=1.0):
+    """Expire abandoned tasks of every queue in a registry from a daemon thread"""
+    def reap():
+        while True:
+            time.sleep(interval)
+            try:
+                registry.expire_tasks()
+            except Exception as e:
+                logger.error(f"Task expiry failed: {e}")
+
+    thread = threading.Thread(target=reap, name='queue-expiry', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,47 @@
+"""
+Bounded TTL cache of idempotency keys
+
+Clients send a key with each join so a retried request maps back to the task
+the first attempt created instead of queueing it again.
+"""
+import time
+from collections import OrderedDict
+
+
+class IdempotencyCache:
+    """Recently seen idempotency keys and the task name each one created
+
+    Every key lives for the same TTL, so insertion order is expiry order:
+    expired keys are always at the front of the OrderedDict and are dropped
+    in O(1) each. Not thread-safe; the owning QueueEngine holds its lock.
+    """
+
+    def __init__(self, ttl=600, max_entries=100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def _expire(self, now):
+        while self.entries:
+            expires_at, _ = next(iter(self.entries.values()))
+            if expires_at > now and len(self.entries) <= self.max_entries:
+                break
+            self.entries.popitem(last=False)
+
+    def get(self, key, now=None):
+        """Return the task name recorded for ``key``, or None"""
+        self._expire(time.time() if now is None else now)
+        entry = self.entries.get(key)
+        return entry[1] if entry else None
+
+    def put(self, key, name, now=None):
+        now = time.time() if now is None else now
+        self.entries.pop(key, None)
+        self.entries[key] = (now + self.ttl, name)
+        self._expire(now)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,157 @@
+"""
+Logging for the request hot path
+
+Hot-path events are logged with ``log_event(logger, level, event, **fields)``:
+the message is the constant event name and the fields travel on the record,
+so nothing is formatted unless a handler actually writes the record. Events
+can be sampled (``task_added=0.01`` keeps one in a hundred) before a record
+is even created; warnings and errors are never sampled.
+
+``configure_logging`` installs a QueueHandler on the root logger, so request
+threads only enqueue records and a background QueueListener formats and
+writes them.
+"""
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+
+# Keep-every-Nth interval per sampled event; events not listed are all kept
+_sample_every = {}
+_sample_counters = {}
+_sample_lock = threading.Lock()
+
+_listener = None
+_handler = None
+
+
+def parse_sample_rates(text):
+    """Parse ``event=rate,event=rate`` into a dict of floats"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in (text or '').split(','))):
+        event, _, rate = item.partition('=')
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+def set_sample_rates(rates):
+    """Keep roughly ``rate`` of each event's records (0 drops them all)"""
+    with _sample_lock:
+        _sample_every.clear()
+        _sample_counters.clear()
+        for event, rate in rates.items():
+            _sample_every[event] = 0 if rate <= 0 else max(1, round(1 / rate))
+
+
+def _sampled_out(event):
+    every = _sample_every.get(event)
+    if every is None:
+        return False
+    if every == 0:
+        return True
+    counter = _sample_counters.get(event)
+    if counter is None:
+        with _sample_lock:
+            counter = _sample_counters.setdefault(event, itertools.count())
+    # next() on itertools.count is atomic under the GIL
+    return next(counter) % every != 0
+
+
+def log_event(logger, level, event, **fields):
+    """Log a structured event without formatting it on the calling thread"""
+    if not logger.isEnabledFor(level):
+        return
+    if level < logging.WARNING and _sample_every and _sampled_out(event):
+        return
+    logger.log(level, event, extra={'event': event, 'fields': fields})
+
+
+class StructuredFormatter(logging.Formatter):
+    """Text formatter that appends an event's fields as key=value pairs"""
+
+    def __init__(self):
+        super().__init__('%(levelname)s:%(name)s:%(message)s')
+
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return text
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line with the event's fields at the top level"""
+
+    def format(self, record):
+        entry = {
+            'ts': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread
+
+    The stock handler formats every record before enqueueing it, which is
+    the cost this handler exists to move off request threads.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(level='INFO', fmt='text', async_logging=True, sample_rates=None, stream=None):
+    """Configure root logging for the server
+
+    Replaces handlers installed by a previous call, so it is safe to call
+    again with new settings.
+    """
+    global _listener, _handler
+
+    root = logging.getLogger()
+    if _handler is not None:
+        root.removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JSONFormatter() if fmt == 'json' else StructuredFormatter())
+
+    if async_logging:
+        records = queue.SimpleQueue()
+        _handler = _DeferredQueueHandler(records)
+        _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+        _listener.start()
+    else:
+        _handler = output
+
+    root.addHandler(_handler)
+    root.setLevel(level)
+    set_sample_rates(sample_rates or {})
+
+
+def flush_logging():
+    """Write out records still queued for the background listener"""
+    if _listener is not None:
+        _listener.stop()
+        _listener.start()
+
+
+@atexit.register
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
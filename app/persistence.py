@@ -0,0 +1,347 @@
+"""
+SQLite persistence for queue state and metrics
+
+Every metric event is stored as a raw row and folded into minute, hour and
+day rollups in the same transaction, so history queries read pre-aggregated
+buckets instead of scanning raw rows. Events are buffered and written in
+batches of one transaction every METRICS_FLUSH_INTERVAL seconds (or
+METRICS_FLUSH_SIZE events); queries and interpreter exit flush first, and a
+batch that fails to write is kept for the next flush. Raw rows and minute
+rollups are pruned after METRICS_RETENTION_DAYS; hour and day rollups are kept.
+"""
+import atexit
+import sqlite3
+import json
+import threading
+import time
+import logging
+import weakref
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Rollup table for each bucket width in seconds, finest first
+ROLLUPS = (
+    (60, 'metrics_minute'),
+    (3600, 'metrics_hour'),
+    (86400, 'metrics_day'),
+)
+
+# Seconds a connection waits for another writer before reporting busy
+BUSY_TIMEOUT = 30
+
+# Unwritten metric events kept per layer while the database fails, in flush batches
+MAX_BUFFERED_BATCHES = 20
+
+# Layers whose buffered metrics are flushed at exit
+_layers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_at_exit():
+    for layer in list(_layers):
+        try:
+            layer.flush_metrics()
+        except Exception as e:
+            logger.error(f"Failed to flush metrics at exit: {e}")
+
+
+class PersistenceLayer:
+    def __init__(self, db_path='queue_data.db', metrics_retention_days=None):
+        self.db_path = db_path
+        self.metrics_retention_days = (Config.METRICS_RETENTION_DAYS
+                                       if metrics_retention_days is None else metrics_retention_days)
+        self._pruned_hour = None
+        self._metric_buffer = []
+        self._metric_lock = threading.Lock()
+        self._flush_timer = None
+        self._retry_at = 0
+        # Payload object last written for each task in task_payloads
+        self._saved_payloads = {}
+        self.init_db()
+        _layers.add(self)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT)
+
+    def init_db(self):
+        """Initialize SQLite database
+        
+        Note: Table and column names are hardcoded constants and should never
+        come from user input to prevent SQL injection vulnerabilities.
+        """
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            # Readers never block the writer, and the engine's state writes
+            # and the metric flush only wait on each other briefly
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS queue_state (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    task_name TEXT UNIQUE NOT NULL,
+                    position INTEGER,
+                    priority INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    metadata TEXT
+                )
+            ''')
+            # Job payloads are written once per task, not with every state save
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS task_payloads (
+                    task_name TEXT PRIMARY KEY,
+                    payload BLOB NOT NULL
+                )
+            ''')
+            # Databases that kept payloads in queue_state
+            columns = [row[1] for row in cursor.execute('PRAGMA table_info(queue_state)')]
+            if 'payload' in columns:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO task_payloads (task_name, payload)
+                    SELECT task_name, payload FROM queue_state WHERE payload IS NOT NULL
+                ''')
+                cursor.execute('UPDATE queue_state SET payload = NULL WHERE payload IS NOT NULL')
+            # Unknown objects, so each is rewritten by the first save still holding it
+            self._saved_payloads = dict.fromkeys(
+                row[0] for row in cursor.execute('SELECT task_name FROM task_payloads'))
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS metrics (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    metric_type TEXT NOT NULL,
+                    metric_value REAL,
+                    event_count INTEGER DEFAULT 1,
+                    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            # Databases created before one row could stand for several events
+            columns = [row[1] for row in cursor.execute('PRAGMA table_info(metrics)')]
+            if 'event_count' not in columns:
+                cursor.execute('ALTER TABLE metrics ADD COLUMN event_count INTEGER DEFAULT 1')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_metrics_type_time ON metrics (metric_type, recorded_at)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_metrics_time ON metrics (recorded_at)')
+            for _, table in ROLLUPS:
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        metric_type TEXT NOT NULL,
+                        bucket INTEGER NOT NULL,
+                        count INTEGER NOT NULL,
+                        total REAL NOT NULL,
+                        min_value REAL,
+                        max_value REAL,
+                        PRIMARY KEY (metric_type, bucket)
+                    ) WITHOUT ROWID
+                ''')
+            self._backfill_rollups(cursor)
+            conn.commit()
+            conn.close()
+            logger.info("Database initialized successfully")
+        except Exception as e:
+            logger.error(f"Database initialization failed: {e}")
+
+    def save_queue_state(self, queue_data, position_data, metadata_data, payload_data=None):
+        """Save current queue state to database
+
+        Payloads are immutable per task, so only those not written yet (by
+        object identity) are inserted and those of departed tasks deleted.
+        """
+        payload_data = payload_data or {}
+        saved = self._saved_payloads
+        written = [(name, payload) for name, payload in payload_data.items() if saved.get(name) is not payload]
+        deleted = [(name,) for name in saved if name not in payload_data]
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM queue_state')
+            cursor.executemany('''
+                INSERT INTO queue_state (task_name, position, priority, metadata)
+                VALUES (?, ?, ?, ?)
+            ''', ((
+                task_name,
+                position_data.get(task_name, -1),
+                metadata_data.get(task_name, {}).get('priority', 0),
+                json.dumps(metadata_data.get(task_name, {}))
+            ) for task_name in queue_data))
+            cursor.executemany('DELETE FROM task_payloads WHERE task_name = ?', deleted)
+            cursor.executemany('INSERT OR REPLACE INTO task_payloads (task_name, payload) VALUES (?, ?)', written)
+            conn.commit()
+            conn.close()
+            self._saved_payloads = dict(payload_data)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save queue state: {e}")
+            return False
+
+    def load_queue_state(self):
+        """Load queue state from database
+
+        Returns (queue, positions, metadata, payloads); payloads only holds
+        tasks that carry one.
+        """
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            cursor.execute('SELECT task_name, position, priority, metadata FROM queue_state ORDER BY position')
+            rows = cursor.fetchall()
+            payloads = dict(cursor.execute('SELECT task_name, payload FROM task_payloads'))
+            conn.close()
+
+            loaded_queue = []
+            loaded_positions = {}
+            loaded_metadata = {}
+            loaded_payloads = {}
+
+            for row in rows:
+                task_name, position, priority, metadata_json = row
+                loaded_queue.append(task_name)
+                loaded_positions[task_name] = position
+                loaded_metadata[task_name] = json.loads(metadata_json) if metadata_json else {}
+                if payloads.get(task_name) is not None:
+                    loaded_payloads[task_name] = bytes(payloads[task_name])
+
+            # Rows of tasks no longer saved are deleted by the next save
+            self._saved_payloads = {**dict.fromkeys(payloads), **loaded_payloads}
+            return loaded_queue, loaded_positions, loaded_metadata, loaded_payloads
+        except Exception as e:
+            logger.error(f"Failed to load queue state: {e}")
+            return [], {}, {}, {}
+
+    def _backfill_rollups(self, cursor):
+        """Build rollups from raw rows recorded before rollups existed"""
+        if cursor.execute(f'SELECT 1 FROM {ROLLUPS[0][1]} LIMIT 1').fetchone():
+            return
+        for width, table in ROLLUPS:
+            cursor.execute(f'''
+                INSERT INTO {table} (metric_type, bucket, count, total, min_value, max_value)
+                SELECT metric_type, CAST(strftime('%s', recorded_at) AS INTEGER) / {width} * {width} AS slot,
+                       TOTAL(events), TOTAL(value * events), MIN(value), MAX(value)
+                FROM (
+                    -- Older rows stored task names as values; count them as events
+                    SELECT metric_type, recorded_at, COALESCE(event_count, 1) AS events,
+                           CASE WHEN typeof(metric_value) = 'text' THEN 1 ELSE metric_value END AS value
+                    FROM metrics
+                )
+                GROUP BY metric_type, slot
+            ''')
+
+    def record_metric(self, metric_type, metric_value, count=1, recorded_at=None):
+        """Buffer ``count`` events of ``metric_value`` for the next flush"""
+        now = time.time() if recorded_at is None else recorded_at
+        with self._metric_lock:
+            self._metric_buffer.append((metric_type, metric_value, count, now))
+            # After a failed flush, wait for the retry instead of failing on every event
+            flush_now = (len(self._metric_buffer) >= Config.METRICS_FLUSH_SIZE and
+                         time.monotonic() >= self._retry_at)
+            if not flush_now:
+                self._schedule_flush()
+        if flush_now:
+            self.flush_metrics()
+
+    def _schedule_flush(self):
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(Config.METRICS_FLUSH_INTERVAL, self.flush_metrics)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def save_metric(self, metric_type, metric_value, count=1, recorded_at=None):
+        """Save a metric to the database and fold it into the rollups"""
+        self.record_metric(metric_type, metric_value, count, recorded_at)
+        self.flush_metrics()
+
+    def flush_metrics(self):
+        """Write buffered metrics as raw rows and rollup updates in one transaction"""
+        with self._metric_lock:
+            events, self._metric_buffer = self._metric_buffer, []
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        if not events:
+            return
+
+        # Fold the batch per bucket first, so each rollup row is upserted once
+        rollups = {}
+        for metric_type, value, count, now in events:
+            for width, table in ROLLUPS:
+                key = (table, metric_type, int(now) // width * width)
+                bucket = rollups.get(key)
+                if bucket is None:
+                    rollups[key] = [count, value * count, value, value]
+                else:
+                    bucket[0] += count
+                    bucket[1] += value * count
+                    bucket[2] = min(bucket[2], value)
+                    bucket[3] = max(bucket[3], value)
+
+        try:
+            conn = self._connect()
+            try:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO metrics (metric_type, metric_value, event_count, recorded_at)
+                    VALUES (?, ?, ?, datetime(?, 'unixepoch'))
+                ''', events)
+                for _, table in ROLLUPS:
+                    cursor.executemany(f'''
+                        INSERT INTO {table} (metric_type, bucket, count, total, min_value, max_value)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (metric_type, bucket) DO UPDATE SET
+                            count = count + excluded.count,
+                            total = total + excluded.total,
+                            min_value = MIN(min_value, excluded.min_value),
+                            max_value = MAX(max_value, excluded.max_value)
+                    ''', [(metric_type, bucket, *values)
+                          for (rollup, metric_type, bucket), values in rollups.items() if rollup == table])
+                self._prune_metrics(cursor, max(event[3] for event in events))
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"Failed to save {len(events)} metrics, retrying later: {e}")
+            with self._metric_lock:
+                # Keep the batch ahead of newer events, up to a bound
+                self._metric_buffer[:0] = events
+                limit = Config.METRICS_FLUSH_SIZE * MAX_BUFFERED_BATCHES
+                if len(self._metric_buffer) > limit:
+                    logger.error(f"Dropping {len(self._metric_buffer) - limit} unwritten metrics")
+                    del self._metric_buffer[:-limit]
+                self._retry_at = time.monotonic() + Config.METRICS_FLUSH_INTERVAL
+                self._schedule_flush()
+
+    def _prune_metrics(self, cursor, now):
+        """Drop raw rows and minute rollups past retention, at most once an hour"""
+        hour = int(now) // 3600
+        if hour == self._pruned_hour:
+            return
+        self._pruned_hour = hour
+        cutoff = now - self.metrics_retention_days * 86400
+        cursor.execute("DELETE FROM metrics WHERE recorded_at < datetime(?, 'unixepoch')", (cutoff,))
+        cursor.execute(f'DELETE FROM {ROLLUPS[0][1]} WHERE bucket < ?', (cutoff,))
+
+    def query_metrics(self, metric_type, start, end, step):
+        """Aggregate a metric over [start, end) in buckets of ``step`` seconds
+
+        ``step`` must be a multiple of 60; the coarsest rollup whose bucket
+        width divides it is read. Returns dicts with time (epoch seconds),
+        count, sum, min, max and avg; buckets without events are omitted.
+        """
+        self.flush_metrics()
+        width, table = next((w, t) for w, t in reversed(ROLLUPS) if step % w == 0)
+        conn = self._connect()
+        try:
+            rows = conn.execute(f'''
+                SELECT bucket / ? * ? AS slot, SUM(count), SUM(total), MIN(min_value), MAX(max_value)
+                FROM {table}
+                WHERE metric_type = ? AND bucket >= ? AND bucket < ?
+                GROUP BY slot ORDER BY slot
+            ''', (step, step, metric_type, int(start) // step * step, end)).fetchall()
+        finally:
+            conn.close()
+
+        return [{
+            'time': slot,
+            'count': count,
+            'sum': total,
+            'min': min_value,
+            'max': max_value,
+            'avg': total / count if count else None
+        } for slot, count, total, min_value, max_value in rows]
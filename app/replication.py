@@ -0,0 +1,171 @@
+"""
+Primary/follower replication by journal shipping
+
+The primary records every queue mutation in a bounded, sequence-numbered
+journal. Followers long-poll the primary for entries after the last sequence
+they applied and replay them through QueueEngine.apply, so they can serve
+position, list and metrics reads. A follower that falls behind the journal's
+retention bootstraps from a full snapshot instead, as does one whose primary
+restarted: each journal has a random id, and sequence numbers only mean
+something within one id.
+"""
+import threading
+import time
+import uuid
+import logging
+from collections import deque
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class JournalTruncatedError(Exception):
+    """Raised when requested journal entries are no longer retained"""
+
+
+class MutationJournal:
+    """Bounded, sequence-numbered log of queue mutations"""
+
+    def __init__(self, max_entries=10000):
+        self.id = uuid.uuid4().hex
+        self.entries = deque(maxlen=max_entries)
+        self.last_seq = 0
+        self.changed = threading.Condition()
+
+    def append(self, op, seq=None):
+        """Record a mutation, optionally under a sequence number from upstream"""
+        with self.changed:
+            self.last_seq = self.last_seq + 1 if seq is None else seq
+            self.entries.append((self.last_seq, op))
+            self.changed.notify_all()
+            return self.last_seq
+
+    def reset(self, seq):
+        """Drop all entries and continue numbering after ``seq``"""
+        with self.changed:
+            self.entries.clear()
+            self.last_seq = seq
+
+    def since(self, seq, limit=1000, wait=0):
+        """Return entries after ``seq``, waiting up to ``wait`` seconds for new ones
+
+        Raises JournalTruncatedError if entries after ``seq`` were discarded.
+        """
+        with self.changed:
+            if seq >= self.last_seq and wait > 0:
+                self.changed.wait_for(lambda: self.last_seq > seq, timeout=wait)
+
+            first_seq = self.entries[0][0] if self.entries else self.last_seq + 1
+            if seq < first_seq - 1:
+                raise JournalTruncatedError(f"Journal starts at {first_seq}, requested after {seq}")
+
+            # Sequence numbers are contiguous, so skip straight to the offset
+            start = seq - first_seq + 1
+            entries = [self.entries[i] for i in range(max(start, 0), min(len(self.entries), start + limit))]
+            return entries, self.last_seq
+
+
+class Follower:
+    """Pulls the primary's journal into a local read-only QueueRegistry"""
+
+    def __init__(self, registry, primary_url, api_key=None, poll_timeout=5, retry_delay=1):
+        self.registry = registry
+        self.primary_url = primary_url.rstrip('/')
+        self.headers = {'X-API-Key': api_key} if api_key else {}
+        self.poll_timeout = poll_timeout
+        self.retry_delay = retry_delay
+        self.last_synced = None
+        self.journal_id = None
+        self.running = False
+        self.thread = None
+
+    @property
+    def last_seq(self):
+        return self.registry.journal.last_seq
+
+    def staleness(self):
+        """Upper bound in seconds on how far reads lag the primary, or None"""
+        if self.last_synced is None:
+            return None
+        return max(0.0, time.time() - self.last_synced)
+
+    def bootstrap(self):
+        """Replace local state with a snapshot of the primary
+
+        Does nothing once stopped, so a promoted node keeps its own writes.
+        """
+        requested_at = time.time()
+        response = requests.get(
+            f'{self.primary_url}/replication/snapshot',
+            headers=self.headers,
+            timeout=30
+        )
+        response.raise_for_status()
+        data = response.json()
+        with self.registry.lock:
+            if not self.running:
+                return
+            self.registry.load_state(data['state'])
+            self.registry.journal.reset(data['last_seq'])
+            self.journal_id = data['journal_id']
+        self.last_synced = requested_at
+        logger.info(f"Follower bootstrapped from snapshot at seq {data['last_seq']}")
+
+    def sync_once(self):
+        """Fetch and apply the next batch of journal entries"""
+        requested_at = time.time()
+        response = requests.get(
+            f'{self.primary_url}/replication/journal',
+            params={'since': self.last_seq, 'wait': self.poll_timeout},
+            headers=self.headers,
+            timeout=self.poll_timeout + 10
+        )
+        # Promoted while the long-poll was in flight
+        if not self.running:
+            return 0
+        if response.status_code == 410:
+            self.bootstrap()
+            return 0
+        response.raise_for_status()
+        data = response.json()
+
+        # The primary restarted (or another took over) and numbering began again
+        if data['journal_id'] != self.journal_id or data['last_seq'] < self.last_seq:
+            self.bootstrap()
+            return 0
+
+        for seq, op in data['entries']:
+            if not self.running:
+                return 0
+            self.registry.apply(op, seq)
+
+        # Caught up with everything the primary had when we asked
+        if self.last_seq >= data['last_seq']:
+            self.last_synced = requested_at
+        return len(data['entries'])
+
+    def run(self):
+        while self.running:
+            try:
+                if self.last_synced is None:
+                    self.bootstrap()
+                self.sync_once()
+            except requests.RequestException as e:
+                logger.warning(f"Replication from {self.primary_url} failed: {e}")
+                time.sleep(self.retry_delay)
+            except Exception as e:
+                logger.error(f"Error applying replicated entries: {e}")
+                time.sleep(self.retry_delay)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='replication-follower', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop replicating; once this returns no further entry is applied"""
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
@@ -1,147 +1,62 @@
-from flask import request, jsonify
-from app import app
+from flask import Response, request, jsonify
+from app.server import app
+from app.backup import SnapshotFormatError, dump_lines, gzip_stream, load_lines
 from app.config import Config
+from app.engine import (QueueRegistry, QueueFullError, ReadOnlyError, PayloadTooLargeError,
+                        IdempotencyConflictError, TaskClaimedError, QueueMovedError)
+from app.engine_process import EngineClient, RemoteJournal, RemoteRegistry
+from app.expiry import start_reaper
+from app.logs import configure_logging, parse_sample_rates
+from app.replication import MutationJournal, Follower, JournalTruncatedError
+from app.sharding import Cluster
+from app.unix_socket import start_unix_server
 from functools import wraps
-import threading
-import time
+import base64
+import binascii
+import gzip
 import logging
-from datetime import datetime, timedelta
-import sqlite3
-import json
+import math
+import requests
+import time
+import zlib
+from datetime import datetime
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+configure_logging(Config.LOG_LEVEL, Config.LOG_FORMAT, Config.LOG_ASYNC,
+                  parse_sample_rates(Config.LOG_SAMPLE_RATES))
 logger = logging.getLogger(__name__)
 
-# Thread-safe lock for queue operations
-queue_lock = threading.RLock()
-
-# In-memory queue structures
-queue = []
-queue_position = {}
-task_metadata = {}  # Store task metadata (priority, timestamp, etc.)
-task_status = {}    # Track task execution status
-
-# Metrics storage
-metrics = {
-    'total_tasks': 0,
-    'completed_tasks': 0,
-    'failed_tasks': 0,
-    'current_queue_size': 0,
-    'avg_wait_time': 0,
-    'task_history': []
-}
-
-# Persistence layer
-class PersistenceLayer:
-    def __init__(self, db_path='queue_data.db'):
-        self.db_path = db_path
-        self.init_db()
-
-    def init_db(self):
-        """Initialize SQLite database
-        
-        Note: Table and column names are hardcoded constants and should never
-        come from user input to prevent SQL injection vulnerabilities.
-        """
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS queue_state (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    task_name TEXT UNIQUE NOT NULL,
-                    position INTEGER,
-                    priority INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    metadata TEXT
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS metrics (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    metric_type TEXT NOT NULL,
-                    metric_value REAL,
-                    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            conn.commit()
-            conn.close()
-            logger.info("Database initialized successfully")
-        except Exception as e:
-            logger.error(f"Database initialization failed: {e}")
-
-    def save_queue_state(self, queue_data, position_data, metadata_data):
-        """Save current queue state to database"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM queue_state')
-            for task_name in queue_data:
-                cursor.execute('''
-                    INSERT INTO queue_state (task_name, position, priority, metadata)
-                    VALUES (?, ?, ?, ?)
-                ''', (
-                    task_name,
-                    position_data.get(task_name, -1),
-                    metadata_data.get(task_name, {}).get('priority', 0),
-                    json.dumps(metadata_data.get(task_name, {}))
-                ))
-            conn.commit()
-            conn.close()
-            return True
-        except Exception as e:
-            logger.error(f"Failed to save queue state: {e}")
-            return False
-
-    def load_queue_state(self):
-        """Load queue state from database"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT task_name, position, priority, metadata FROM queue_state ORDER BY position')
-            rows = cursor.fetchall()
-            conn.close()
-
-            loaded_queue = []
-            loaded_positions = {}
-            loaded_metadata = {}
-
-            for row in rows:
-                task_name, position, priority, metadata_json = row
-                loaded_queue.append(task_name)
-                loaded_positions[task_name] = position
-                loaded_metadata[task_name] = json.loads(metadata_json) if metadata_json else {}
-
-            return loaded_queue, loaded_positions, loaded_metadata
-        except Exception as e:
-            logger.error(f"Failed to load queue state: {e}")
-            return [], {}, {}
-
-    def save_metric(self, metric_type, metric_value):
-        """Save a metric to the database"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO metrics (metric_type, metric_value)
-                VALUES (?, ?)
-            ''', (metric_type, metric_value))
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            logger.error(f"Failed to save metric: {e}")
-
-# Initialize persistence
-persistence = PersistenceLayer(Config.DATABASE_PATH)
-
-# Load initial state
-loaded_queue, loaded_positions, loaded_metadata = persistence.load_queue_state()
-if loaded_queue:
-    queue = loaded_queue
-    queue_position = loaded_positions
-    task_metadata = loaded_metadata
-    logger.info(f"Loaded {len(queue)} tasks from persistent storage")
+# Named queue engines with persistence and a shared replication journal,
+# either in this process or served by a single-writer engine process
+if Config.ENGINE_MODE == 'process':
+    if Config.REPLICATION_ROLE == 'follower' or Config.CLUSTER_NODES:
+        raise RuntimeError('ENGINE_MODE=process only supports a standalone primary')
+    engine_client = EngineClient(Config.ENGINE_ADDRESS, Config.ENGINE_AUTHKEY, Config.ENGINE_RING_BYTES)
+    journal = RemoteJournal(engine_client)
+    registry = RemoteRegistry(engine_client)
+else:
+    journal = MutationJournal(Config.REPLICATION_JOURNAL_SIZE)
+    registry = QueueRegistry(Config.DATABASE_PATH, journal)
+    # The engine process expires tasks from its own loop
+    start_reaper(registry)
+engine = registry.get()  # default queue
+
+# Followers replay the primary's journal and reject writes until promoted
+follower = None
+if Config.REPLICATION_ROLE == 'follower':
+    registry.set_read_only(True)
+    follower = Follower(
+        registry,
+        Config.PRIMARY_URL,
+        api_key=Config.REPLICATION_API_KEY,
+        poll_timeout=Config.REPLICATION_POLL_TIMEOUT
+    ).start()
+
+# Binary protocol for co-located clients; with several server processes the
+# first to take the socket's lock serves it and the others skip it
+unix_server = None
+if Config.UNIX_SOCKET_PATH:
+    unix_server = start_unix_server(registry, Config.UNIX_SOCKET_PATH)
 
 # Authentication decorator
 def require_api_key(f):
@@ -158,61 +73,97 @@ def require_api_key(f):
         return f(*args, **kwargs)
     return decorated_function
 
-# Helper functions
-def update_metrics(action, value=None):
-    """Update metrics"""
-    if not Config.ENABLE_METRICS:
-        return
-
-    with queue_lock:
-        if action == 'task_added':
-            metrics['total_tasks'] += 1
-            metrics['current_queue_size'] = len(queue)
-        elif action == 'task_completed':
-            metrics['completed_tasks'] += 1
-            metrics['current_queue_size'] = len(queue)
-            if value:
-                metrics['task_history'].append({
-                    'task': value,
-                    'completed_at': datetime.now().isoformat(),
-                    'status': 'completed'
-                })
-        elif action == 'task_failed':
-            metrics['failed_tasks'] += 1
-            if value:
-                metrics['task_history'].append({
-                    'task': value,
-                    'completed_at': datetime.now().isoformat(),
-                    'status': 'failed'
-                })
-
-        # Keep only recent history
-        if len(metrics['task_history']) > 100:
-            metrics['task_history'] = metrics['task_history'][-100:]
-
-        # Save to persistence
-        persistence.save_metric(action, value or 0)
-
-def reorder_queue_by_priority():
-    """Reorder queue based on priority"""
-    if not Config.ENABLE_PRIORITY_QUEUE:
-        return
-
-    with queue_lock:
-        queue.sort(key=lambda name: (
-            -task_metadata.get(name, {}).get('priority', 0),
-            task_metadata.get(name, {}).get('timestamp', time.time())
-        ))
-
-        # Update positions
-        for i, task_name in enumerate(queue):
-            queue_position[task_name] = i + 1
+# Cluster membership when queues are sharded across nodes
+cluster = None
+if Config.CLUSTER_NODES:
+    cluster = Cluster(Config.NODE_URL, Config.CLUSTER_NODES, vnodes=Config.CLUSTER_VNODES)
+
+# Named queue helpers
+def queue_name():
+    return request.args.get('queue', QueueRegistry.DEFAULT)
+
+def current_engine(create=False):
+    """Engine for the queue named by ?queue= (the default queue if absent)
+
+    Only writes that add tasks create the queue; other requests for an
+    unknown queue see it empty.
+    """
+    if create:
+        return registry.get(queue_name())
+    return registry.lookup(queue_name())
+
+def with_queue(f):
+    """Validate ?queue= and send requests for queues on other nodes to their owner"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        name = queue_name()
+        if not QueueRegistry.valid_name(name):
+            return jsonify({'error': 'Bad Request', 'message': 'Invalid queue name'}), 400
+
+        if cluster is not None and not cluster.is_local(name):
+            return jsonify({
+                'error': 'Misdirected Request',
+                'message': 'Queue is owned by another node',
+                'owner': cluster.owner(name)
+            }), 421
+
+        return f(*args, **kwargs)
+    return decorated_function
+
+def decode_payload(data, field):
+    """Decode an optional base64 field of a JSON body into bytes"""
+    if data.get(field) is None:
+        return None
+    return base64.b64decode(data[field], validate=True)
+
+def valid_tags(tags):
+    return isinstance(tags, list) and all(isinstance(tag, str) and tag for tag in tags)
+
+def valid_priority(priority):
+    return isinstance(priority, int) and not isinstance(priority, bool)
+
+def valid_ttl(ttl):
+    return isinstance(ttl, (int, float)) and not isinstance(ttl, bool) and math.isfinite(ttl) and ttl >= 0
+
+# Replication helpers
+def primary_only(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        except QueueMovedError as e:
+            return jsonify({
+                'error': 'Misdirected Request',
+                'message': 'Queue is owned by another node',
+                'owner': e.owner
+            }), 421
+        except ReadOnlyError:
+            return jsonify({
+                'error': 'Read Only',
+                'message': 'This node is a follower, send writes to the primary',
+                'primary': follower.primary_url if follower else None
+            }), 503
+    return decorated_function
+
+def staleness_fields():
+    """Staleness bound reported with reads served by a follower"""
+    if follower is None:
+        return {}
+    return {'staleness': follower.staleness()}
 
 # Routes
 @app.route('/queue', methods=['POST'])
 @require_api_key
+@with_queue
+@primary_only
 def join_queue():
-    """Add a task to the queue"""
+    """Add a task to the queue
+
+    An ``Idempotency-Key`` header (or ``idempotency_key`` field) makes
+    retries of the same join safe: repeats return the task's current position.
+    A ``ttl`` (seconds, 0 for never) overrides how long a waiting task may
+    go without its client polling before it expires.
+    """
     try:
         data = request.json
         if not data or 'name' not in data:
@@ -220,170 +171,310 @@ def join_queue():
 
         name = data['name']
         priority = data.get('priority', 0)
+        if not valid_priority(priority):
+            return jsonify({'error': 'Bad Request', 'message': 'Priority must be an integer'}), 400
+        idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+        tags = data.get('tags')
+        if tags is not None and not valid_tags(tags):
+            return jsonify({'error': 'Bad Request', 'message': 'Tags must be a list of strings'}), 400
+        ttl = data.get('ttl')
+        if ttl is not None and not valid_ttl(ttl):
+            return jsonify({'error': 'Bad Request', 'message': 'TTL must be a non-negative number'}), 400
+        engine = current_engine(create=True)
 
-        with queue_lock:
-            # Check queue size limit
-            if len(queue) >= Config.MAX_QUEUE_SIZE:
-                logger.warning(f"Queue full, rejecting task: {name}")
-                return jsonify({'error': 'Queue Full', 'message': 'Maximum queue size reached'}), 429
-
-            # Add to queue if not already present
-            if name not in queue_position:
-                queue.append(name)
-                task_metadata[name] = {
-                    'priority': priority,
-                    'timestamp': time.time(),
-                    'added_at': datetime.now().isoformat()
-                }
-
-                # Reorder by priority if enabled
-                reorder_queue_by_priority()
-
-                # Update position
-                queue_position[name] = queue.index(name) + 1
-
-                # Initialize task status
-                task_status[name] = 'queued'
-
-                # Update metrics
-                update_metrics('task_added')
-
-                # Persist state
-                persistence.save_queue_state(queue, queue_position, task_metadata)
+        try:
+            payload = decode_payload(data, 'payload')
+        except (binascii.Error, TypeError):
+            return jsonify({'error': 'Bad Request', 'message': 'Payload must be base64 encoded'}), 400
 
-                logger.info(f"Task added: {name} at position {queue_position[name]}")
+        try:
+            result = engine.join(name, priority, payload, idempotency_key, tags, ttl)
+        except (IdempotencyConflictError, TaskClaimedError) as e:
+            return jsonify({'error': 'Conflict', 'message': str(e)}), 409
+        except QueueFullError:
+            return jsonify({'error': 'Queue Full', 'message': 'Maximum queue size reached'}), 429
+        except PayloadTooLargeError as e:
+            return jsonify({'error': 'Payload Too Large', 'message': str(e)}), 413
 
-            return jsonify({
-                'position': queue_position[name],
-                'priority': task_metadata[name]['priority'],
-                'queue_size': len(queue)
-            })
+        return jsonify({
+            **result,
+            **engine.estimate_start(result['position'], name)
+        })
 
+    except ReadOnlyError:
+        raise
     except Exception as e:
         logger.error(f"Error in join_queue: {e}")
         return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
 
 @app.route('/queue/<name>', methods=['GET'])
 @require_api_key
+@with_queue
 def check_position(name):
     """Check the position of a task in the queue"""
     try:
-        with queue_lock:
-            if name in queue_position:
-                return jsonify({
-                    'position': queue_position[name],
-                    'status': task_status.get(name, 'unknown'),
-                    'metadata': task_metadata.get(name, {}),
-                    'queue_size': len(queue)
-                })
-            else:
-                return jsonify({
-                    'position': -1,
-                    'status': 'not_found',
-                    'message': 'Task not in queue'
-                })
+        engine = current_engine()
+        result = engine.position(name)
+        if result is not None:
+            return jsonify({
+                **result,
+                **engine.estimate_start(result['position'], name),
+                **staleness_fields()
+            })
+        else:
+            return jsonify({
+                'position': -1,
+                'status': 'not_found',
+                'message': 'Task not in queue',
+                **staleness_fields()
+            })
 
     except Exception as e:
         logger.error(f"Error in check_position: {e}")
         return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
 
+@app.route('/queue/positions', methods=['POST'])
+@require_api_key
+@with_queue
+def check_positions():
+    """Check the positions of many tasks in one request
+
+    The ETA and polling hint describe the task nearest the head, so a client
+    tracking many tasks can poll once for all of them.
+    """
+    try:
+        data = request.json or {}
+        names = data.get('names')
+        if not isinstance(names, list) or len(names) > Config.MAX_QUEUE_SIZE:
+            return jsonify({'error': 'Bad Request', 'message': 'Names must be a list of task names'}), 400
+
+        engine = current_engine()
+        positions, queue_size = engine.positions(names)
+        queued = [p for p in positions.values() if p > 0]
+        estimate = engine.estimate_start(min(queued), *names) if queued else {}
+        return jsonify({
+            'positions': positions,
+            'queue_size': queue_size,
+            **estimate,
+            **staleness_fields()
+        })
+
+    except Exception as e:
+        logger.error(f"Error in check_positions: {e}")
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
 @app.route('/queue/next', methods=['POST'])
 @require_api_key
+@with_queue
+@primary_only
 def next_in_queue():
-    """Remove the next task from the queue"""
+    """Complete a task: the one named in the body, else the next that is not a job
+
+    Clients finishing their turn send their task's ``name``, so a task that
+    overtook theirs while they ran is not completed in its place.
+    """
     try:
-        with queue_lock:
-            if queue:
-                name = queue.pop(0)
-                queue_position.pop(name, None)
-                metadata = task_metadata.pop(name, {})
-                task_status.pop(name, None)
-
-                # Update remaining positions
-                for i, remaining_name in enumerate(queue):
-                    queue_position[remaining_name] = i + 1
-
-                # Update metrics
-                update_metrics('task_completed', name)
-
-                # Persist state
-                persistence.save_queue_state(queue, queue_position, task_metadata)
-
-                logger.info(f"Task completed: {name}")
-
-                return jsonify({
-                    'next': name,
-                    'metadata': metadata,
-                    'remaining': len(queue)
-                })
-            else:
-                return jsonify({
-                    'next': None,
-                    'remaining': 0
-                })
+        data = request.get_json(silent=True) or {}
+        requested = data.get('name')
+        name, metadata, remaining = current_engine().next(requested)
+        if name is not None:
+            return jsonify({
+                'next': name,
+                'metadata': metadata,
+                'remaining': remaining
+            })
+        elif requested is not None:
+            return jsonify({'error': 'Not Found', 'message': 'Task not in queue'}), 404
+        else:
+            return jsonify({
+                'next': None,
+                'remaining': remaining
+            })
 
+    except ReadOnlyError:
+        raise
     except Exception as e:
         logger.error(f"Error in next_in_queue: {e}")
         return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
 
 @app.route('/queue/remove/<name>', methods=['DELETE'])
 @require_api_key
+@with_queue
+@primary_only
 def remove_from_queue(name):
     """Remove a specific task from the queue"""
     try:
-        with queue_lock:
-            if name in queue_position:
-                queue.remove(name)
-                queue_position.pop(name, None)
-                task_metadata.pop(name, None)
-                task_status.pop(name, None)
-
-                # Update positions
-                for i, remaining_name in enumerate(queue):
-                    queue_position[remaining_name] = i + 1
-
-                # Update metrics
-                update_metrics('task_failed', name)
-
-                # Persist state
-                persistence.save_queue_state(queue, queue_position, task_metadata)
-
-                logger.info(f"Task removed: {name}")
-
-                return jsonify({
-                    'message': 'Task removed successfully',
-                    'task': name
-                })
-            else:
-                return jsonify({
-                    'error': 'Not Found',
-                    'message': 'Task not in queue'
-                }), 404
+        if current_engine().remove(name):
+            return jsonify({
+                'message': 'Task removed successfully',
+                'task': name
+            })
+        else:
+            return jsonify({
+                'error': 'Not Found',
+                'message': 'Task not in queue'
+            }), 404
 
+    except ReadOnlyError:
+        raise
     except Exception as e:
         logger.error(f"Error in remove_from_queue: {e}")
         return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
 
+@app.route('/queue/<name>', methods=['PATCH'])
+@require_api_key
+@with_queue
+@primary_only
+def update_task(name):
+    """Change the priority of a queued task without losing its join time"""
+    try:
+        data = request.json or {}
+        if not valid_priority(data.get('priority')):
+            return jsonify({'error': 'Bad Request', 'message': 'Priority must be an integer'}), 400
+
+        engine = current_engine()
+        result = engine.update(name, data['priority'])
+        if result is None:
+            return jsonify({'error': 'Not Found', 'message': 'Task not in queue'}), 404
+        return jsonify({**result, **engine.estimate_start(result['position'], name)})
+
+    except ReadOnlyError:
+        raise
+    except Exception as e:
+        logger.error(f"Error in update_task: {e}")
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
+@app.route('/queue/bulk', methods=['POST'])
+@require_api_key
+@with_queue
+@primary_only
+def bulk_update():
+    """Cancel or reprioritize every queued task with a tag and/or name prefix
+
+    Body: ``{"action": "remove" | "reprioritize", "tag": ..., "prefix": ...,
+    "priority": ...}``. Applied atomically with a single state write.
+    """
+    try:
+        data = request.json or {}
+        action = data.get('action')
+        tag, prefix = data.get('tag'), data.get('prefix')
+        if tag is None and prefix is None:
+            return jsonify({'error': 'Bad Request', 'message': 'A tag or prefix is required'}), 400
+        if not all(value is None or (isinstance(value, str) and value) for value in (tag, prefix)):
+            return jsonify({'error': 'Bad Request', 'message': 'Tag and prefix must be non-empty strings'}), 400
+
+        engine = current_engine()
+        if action == 'remove':
+            names = engine.remove_matching(tag, prefix)
+        elif action == 'reprioritize':
+            if not valid_priority(data.get('priority')):
+                return jsonify({'error': 'Bad Request', 'message': 'Priority must be an integer'}), 400
+            names = engine.reprioritize_matching(data['priority'], tag, prefix)
+        else:
+            return jsonify({'error': 'Bad Request', 'message': "Action must be 'remove' or 'reprioritize'"}), 400
+
+        return jsonify({
+            'action': action,
+            'affected': len(names),
+            'tasks': names,
+            'queue_size': engine.size()
+        })
+
+    except ReadOnlyError:
+        raise
+    except Exception as e:
+        logger.error(f"Error in bulk_update: {e}")
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
+@app.route('/queue/claim', methods=['POST'])
+@require_api_key
+@with_queue
+@primary_only
+def claim_jobs():
+    """Hand a batch of queued jobs (tasks with payloads) to a worker"""
+    try:
+        data = request.json or {}
+        count = max(1, min(int(data.get('count', 1)), Config.MAX_CLAIM_BATCH))
+        wait = min(float(data.get('wait', 0)), Config.MAX_WAIT_SECONDS)
+        worker = data.get('worker') or request.remote_addr
+
+        jobs = current_engine(create=True).claim(count, worker, wait)
+        return jsonify({
+            'jobs': [{
+                'name': job['name'],
+                'payload': base64.b64encode(job['payload']).decode('ascii'),
+                'priority': job['priority']
+            } for job in jobs]
+        })
+
+    except ReadOnlyError:
+        raise
+    except Exception as e:
+        logger.error(f"Error in claim_jobs: {e}")
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
+@app.route('/jobs/<name>/result', methods=['POST'])
+@require_api_key
+@with_queue
+@primary_only
+def report_job_result(name):
+    """Record the result of a claimed job"""
+    try:
+        data = request.json or {}
+        status = data.get('status', 'completed')
+        if status not in ('completed', 'failed'):
+            return jsonify({'error': 'Bad Request', 'message': "Status must be 'completed' or 'failed'"}), 400
+
+        try:
+            result = decode_payload(data, 'result')
+        except (binascii.Error, TypeError):
+            return jsonify({'error': 'Bad Request', 'message': 'Result must be base64 encoded'}), 400
+
+        try:
+            reported = current_engine().report(name, status, result, data.get('error'))
+        except PayloadTooLargeError as e:
+            return jsonify({'error': 'Payload Too Large', 'message': str(e)}), 413
+
+        if not reported:
+            return jsonify({'error': 'Not Found', 'message': 'Job is not claimed'}), 404
+        return jsonify({'job': name, 'status': status})
+
+    except ReadOnlyError:
+        raise
+    except Exception as e:
+        logger.error(f"Error in report_job_result: {e}")
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
+@app.route('/jobs/<name>', methods=['GET'])
+@require_api_key
+@with_queue
+def get_job(name):
+    """Status of a job, including its result once finished"""
+    try:
+        job = current_engine().job(name)
+        if job is None:
+            return jsonify({'error': 'Not Found', 'message': 'Unknown job'}), 404
+
+        if job.get('result') is not None:
+            job['result'] = base64.b64encode(job['result']).decode('ascii')
+        return jsonify({**job, **staleness_fields()})
+
+    except Exception as e:
+        logger.error(f"Error in get_job: {e}")
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
 @app.route('/queue/list', methods=['GET'])
 @require_api_key
+@with_queue
 def list_queue():
     """List all tasks in the queue"""
     try:
-        with queue_lock:
-            task_list = []
-            for task_name in queue:
-                task_list.append({
-                    'name': task_name,
-                    'position': queue_position.get(task_name, -1),
-                    'priority': task_metadata.get(task_name, {}).get('priority', 0),
-                    'status': task_status.get(task_name, 'queued'),
-                    'added_at': task_metadata.get(task_name, {}).get('added_at', 'unknown')
-                })
-
-            return jsonify({
-                'queue': task_list,
-                'total': len(task_list)
-            })
+        task_list = current_engine().list_tasks()
+        return jsonify({
+            'queue': task_list,
+            'total': len(task_list),
+            **staleness_fields()
+        })
 
     except Exception as e:
         logger.error(f"Error in list_queue: {e}")
@@ -391,34 +482,101 @@ def list_queue():
 
 @app.route('/metrics', methods=['GET'])
 @require_api_key
+@with_queue
 def get_metrics():
     """Get queue metrics"""
     try:
         if not Config.ENABLE_METRICS:
             return jsonify({'error': 'Metrics disabled'}), 403
 
-        with queue_lock:
-            return jsonify({
-                'metrics': metrics,
-                'timestamp': datetime.now().isoformat()
-            })
+        return jsonify({
+            'metrics': current_engine().current_metrics(),
+            'timestamp': datetime.now().isoformat(),
+            **staleness_fields()
+        })
 
     except Exception as e:
         logger.error(f"Error in get_metrics: {e}")
         return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
 
+HISTORY_STEPS = {'minute': 60, 'hour': 3600, 'day': 86400}
+MAX_HISTORY_POINTS = 10000
+
+def parse_time(value, default):
+    """Parse epoch seconds or an ISO 8601 timestamp from a query parameter"""
+    if value is None:
+        return default
+    try:
+        seconds = float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+    if not math.isfinite(seconds):
+        raise ValueError(f'{value} is not a time')
+    return seconds
+
+@app.route('/metrics/history', methods=['GET'])
+@require_api_key
+@with_queue
+def get_metrics_history():
+    """Metric history over a time range, answered from the rollup tables
+
+    Query parameters: ``type`` (e.g. task_added, task_completed, run_time),
+    ``from``/``to`` (epoch seconds or ISO 8601, default the last day) and
+    ``step`` (minute, hour, day or a multiple of 60 seconds, default hour).
+    """
+    try:
+        if not Config.ENABLE_METRICS:
+            return jsonify({'error': 'Metrics disabled'}), 403
+
+        metric_type = request.args.get('type')
+        if not metric_type:
+            return jsonify({'error': 'Bad Request', 'message': 'Metric type is required'}), 400
+
+        try:
+            end = parse_time(request.args.get('to'), time.time())
+            start = parse_time(request.args.get('from'), end - 86400)
+            step = request.args.get('step', 'hour')
+            step = HISTORY_STEPS[step] if step in HISTORY_STEPS else int(step)
+        except ValueError:
+            return jsonify({'error': 'Bad Request', 'message': 'Invalid from, to or step'}), 400
+
+        if step <= 0 or step % 60:
+            return jsonify({'error': 'Bad Request', 'message': 'Step must be a multiple of 60 seconds'}), 400
+        if end <= start or (end - start) / step > MAX_HISTORY_POINTS:
+            return jsonify({
+                'error': 'Bad Request',
+                'message': f'Range must be positive and span at most {MAX_HISTORY_POINTS} steps'
+            }), 400
+
+        points = current_engine().metrics_history(metric_type, start, end, step)
+        if points is None:
+            return jsonify({'error': 'Not Available', 'message': 'Metrics history needs persistence'}), 404
+
+        return jsonify({
+            'type': metric_type,
+            'from': start,
+            'to': end,
+            'step': step,
+            'points': points
+        })
+
+    except Exception as e:
+        logger.error(f"Error in get_metrics_history: {e}")
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     try:
-        with queue_lock:
-            health_status = {
-                'status': 'healthy',
-                'queue_size': len(queue),
-                'max_queue_size': Config.MAX_QUEUE_SIZE,
-                'persistence': 'enabled',
-                'timestamp': datetime.now().isoformat()
-            }
+        health_status = {
+            'status': 'healthy',
+            'queue_size': engine.size(),
+            'queues': len(registry.names()),
+            'max_queue_size': Config.MAX_QUEUE_SIZE,
+            'persistence': 'enabled',
+            'role': 'follower' if follower else 'primary',
+            'timestamp': datetime.now().isoformat()
+        }
 
         return jsonify(health_status)
 
@@ -431,28 +589,254 @@ def health_check():
 
 @app.route('/queue/clear', methods=['POST'])
 @require_api_key
+@with_queue
+@primary_only
 def clear_queue():
     """Clear all tasks from the queue (admin operation)"""
     try:
-        with queue_lock:
-            count = len(queue)
-            queue.clear()
-            queue_position.clear()
-            task_metadata.clear()
-            task_status.clear()
+        count = current_engine().clear()
+        return jsonify({
+            'message': 'Queue cleared successfully',
+            'tasks_removed': count
+        })
 
-            # Persist state
-            persistence.save_queue_state(queue, queue_position, task_metadata)
+    except ReadOnlyError:
+        raise
+    except Exception as e:
+        logger.error(f"Error in clear_queue: {e}")
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
 
-            logger.warning(f"Queue cleared, removed {count} tasks")
+@app.route('/admin/snapshot', methods=['GET'])
+@require_api_key
+@with_queue
+def admin_snapshot():
+    """Stream a point-in-time snapshot of the queue as NDJSON, gzipped if accepted"""
+    try:
+        name = queue_name()
+        chunks = dump_lines(current_engine().export_view(), name)
+        headers = {'Content-Disposition': f'attachment; filename="{name}.ndjson"'}
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            chunks = gzip_stream(chunks)
+            headers['Content-Encoding'] = 'gzip'
 
-            return jsonify({
-                'message': 'Queue cleared successfully',
-                'tasks_removed': count
-            })
+        return Response(chunks, mimetype='application/x-ndjson', headers=headers)
 
     except Exception as e:
-        logger.error(f"Error in clear_queue: {e}")
+        logger.error(f"Error in admin_snapshot: {e}")
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
+@app.route('/admin/restore', methods=['POST'])
+@require_api_key
+@with_queue
+@primary_only
+def admin_restore():
+    """Replace the queue with a snapshot streamed in the request body"""
+    try:
+        stream = request.stream
+        if request.headers.get('Content-Encoding') == 'gzip':
+            stream = gzip.GzipFile(fileobj=stream)
+
+        try:
+            state = load_lines(stream)
+        except (SnapshotFormatError, OSError, EOFError, zlib.error) as e:
+            return jsonify({'error': 'Bad Request', 'message': str(e)}), 400
+
+        current_engine(create=True).restore(state)
+        return jsonify({
+            'queue': queue_name(),
+            'restored': len(state['queue']),
+            'claimed': len(state['claimed'])
+        })
+
+    except ReadOnlyError:
+        raise
+    except Exception as e:
+        logger.error(f"Error in admin_restore: {e}")
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
+@app.route('/replication/journal', methods=['GET'])
+@require_api_key
+def replication_journal():
+    """Stream journal entries after ?since=<seq> to a follower (long-poll)"""
+    try:
+        since = request.args.get('since', 0, type=int)
+        wait = min(request.args.get('wait', 0, type=float), Config.MAX_WAIT_SECONDS)
+        limit = min(request.args.get('limit', 1000, type=int), 10000)
+
+        try:
+            entries, last_seq = journal.since(since, limit=limit, wait=wait)
+        except JournalTruncatedError as e:
+            return jsonify({'error': 'Gone', 'message': str(e)}), 410
+
+        return jsonify({
+            'entries': entries,
+            'last_seq': last_seq,
+            'journal_id': journal.id
+        })
+
+    except Exception as e:
+        logger.error(f"Error in replication_journal: {e}")
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
+@app.route('/replication/snapshot', methods=['GET'])
+@require_api_key
+def replication_snapshot():
+    """Full queue state and the journal sequence it corresponds to"""
+    try:
+        state, last_seq = registry.export_state()
+
+        return jsonify({
+            'state': state,
+            'last_seq': last_seq,
+            'journal_id': journal.id
+        })
+
+    except Exception as e:
+        logger.error(f"Error in replication_snapshot: {e}")
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
+@app.route('/replication/status', methods=['GET'])
+@require_api_key
+def replication_status():
+    """Replication role, journal position and staleness of this node"""
+    return jsonify({
+        'role': 'follower' if follower else 'primary',
+        'last_seq': journal.last_seq,
+        'journal_id': journal.id,
+        'primary': follower.primary_url if follower else None,
+        **staleness_fields()
+    })
+
+@app.route('/replication/promote', methods=['POST'])
+@require_api_key
+def replication_promote():
+    """Promote this follower to primary (e.g. after the primary died)"""
+    global follower
+
+    try:
+        if follower is None:
+            return jsonify({'error': 'Conflict', 'message': 'Node is already primary'}), 409
+
+        # Waits out an in-flight poll, so no replicated entry lands after writes open
+        follower.stop()
+        follower = None
+        registry.set_read_only(False)
+        logger.warning(f"Promoted to primary at seq {journal.last_seq}")
+
+        return jsonify({
+            'message': 'Promoted to primary',
+            'last_seq': journal.last_seq
+        })
+
+    except Exception as e:
+        logger.error(f"Error in replication_promote: {e}")
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
+@app.route('/cluster', methods=['GET'])
+@require_api_key
+def cluster_info():
+    """Cluster membership as seen by this node"""
+    if cluster is None:
+        return jsonify({'node': None, 'nodes': [], 'queues': registry.names()})
+    return jsonify({
+        'node': cluster.node_url,
+        'nodes': cluster.nodes,
+        'queues': registry.names()
+    })
+
+@app.route('/cluster/owner/<queue>', methods=['GET'])
+@require_api_key
+def cluster_owner(queue):
+    """Node that owns a named queue"""
+    if not QueueRegistry.valid_name(queue):
+        return jsonify({'error': 'Bad Request', 'message': 'Invalid queue name'}), 400
+    return jsonify({
+        'queue': queue,
+        'owner': cluster.owner(queue) if cluster else None
+    })
+
+@app.route('/cluster/nodes', methods=['POST'])
+@require_api_key
+@primary_only
+def cluster_set_nodes():
+    """Change membership and hand queues this node no longer owns to their new owner
+
+    Only queues whose owner changed are moved. Call this on every node when a
+    node joins or leaves, on the new owners first: a node only accepts an
+    import for a queue it owns.
+    """
+    try:
+        data = request.json
+        if cluster is None:
+            return jsonify({'error': 'Conflict', 'message': 'Cluster mode is not enabled'}), 409
+        if not data or not data.get('nodes'):
+            return jsonify({'error': 'Bad Request', 'message': 'Node list is required'}), 400
+
+        cluster.set_nodes(data['nodes'])
+
+        moved = []
+        for name in registry.names():
+            owner = cluster.owner(name)
+            queue_engine = registry.get(name)
+            if owner == cluster.node_url:
+                queue_engine.cancel_handoff()
+                continue
+
+            # Writers already past the ownership check get 421 from here on
+            state = queue_engine.begin_handoff(owner)
+            if state is None and name == QueueRegistry.DEFAULT:
+                continue
+            if state is not None:
+                try:
+                    response = requests.post(
+                        f'{owner}/cluster/import',
+                        params={'queue': name},
+                        json=state,
+                        headers={'X-API-Key': Config.REPLICATION_API_KEY} if Config.REPLICATION_API_KEY else {},
+                        timeout=30
+                    )
+                    response.raise_for_status()
+                except Exception:
+                    queue_engine.cancel_handoff()
+                    raise
+            registry.drop(name)
+            moved.append({'queue': name, 'owner': owner})
+
+        logger.warning(f"Cluster membership changed, moved {len(moved)} queues")
+        return jsonify({
+            'nodes': cluster.nodes,
+            'moved': moved
+        })
+
+    except ReadOnlyError:
+        raise
+    except Exception as e:
+        logger.error(f"Error in cluster_set_nodes: {e}")
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
+@app.route('/cluster/import', methods=['POST'])
+@require_api_key
+@with_queue
+@primary_only
+def cluster_import():
+    """Merge a queue handed off by its previous owner into this node's copy"""
+    try:
+        name = queue_name()
+        data = request.json
+        if not data:
+            return jsonify({'error': 'Bad Request', 'message': 'Queue state is required'}), 400
+
+        registry.get(name).merge_state(data)
+        logger.info(f"Imported queue {name} with {len(data['queue'])} tasks")
+        return jsonify({
+            'queue': name,
+            'imported': len(data['queue'])
+        })
+
+    except ReadOnlyError:
+        raise
+    except Exception as e:
+        logger.error(f"Error in cluster_import: {e}")
         return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
 
 # Error handlers
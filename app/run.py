@@ -1,4 +1,7 @@
 from app import app
+from app.config import Config
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # The app starts the unix socket server itself when UNIX_SOCKET_PATH is set;
+    # the reloader's parent process would take the socket's lock first
+    app.run(debug=True, use_reloader=not Config.UNIX_SOCKET_PATH)
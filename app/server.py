@@ -0,0 +1,5 @@
+from flask import Flask
+
+app = Flask('app')
+
+from app import routes_enhanced
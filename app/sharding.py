@@ -0,0 +1,78 @@
+"""
+Placement of named queues on cluster nodes by consistent hashing
+
+Each node URL is hashed onto a ring at many virtual points; a queue belongs
+to the first node clockwise from the hash of its name. Adding or removing a
+node only moves the queues whose arc changed owner.
+"""
+import bisect
+import hashlib
+import threading
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, nodes=(), vnodes=64):
+        self.vnodes = vnodes
+        self.nodes = []
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.vnodes):
+            point = _hash(f'{node}#{i}')
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove_node(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        keep = [(p, o) for p, o in zip(self._points, self._owners) if o != node]
+        self._points = [p for p, _ in keep]
+        self._owners = [o for _, o in keep]
+
+    def node_for(self, key):
+        """Return the node owning ``key``, or None for an empty ring"""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+class Cluster:
+    """This node's view of cluster membership"""
+
+    def __init__(self, node_url, nodes, vnodes=64):
+        self.node_url = node_url.rstrip('/')
+        self.vnodes = vnodes
+        self.lock = threading.Lock()
+        self.ring = HashRing([n.rstrip('/') for n in nodes], vnodes)
+
+    @property
+    def nodes(self):
+        return list(self.ring.nodes)
+
+    def owner(self, queue_name):
+        return self.ring.node_for(queue_name)
+
+    def is_local(self, queue_name):
+        return self.owner(queue_name) == self.node_url
+
+    def set_nodes(self, nodes):
+        """Replace membership and return the previous ring"""
+        with self.lock:
+            previous = self.ring
+            self.ring = HashRing([n.rstrip('/') for n in nodes], self.vnodes)
+            return previous
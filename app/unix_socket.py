@@ -0,0 +1,231 @@
+"""
+Length-prefixed binary protocol served on a Unix domain socket
+
+Co-located clients can skip HTTP, JSON and Flask routing entirely. Every
+frame is a 4-byte big-endian length followed by the body:
+
+    request:  op (B) | priority (i) | timeout_ms (I) | queue_length (B) | key_length (B) |
+              queue (utf-8) | idempotency_key (utf-8) | name (utf-8)
+    response: status (B) | position (i) | queue_size (I) | estimated_wait (d) | name (utf-8)
+
+An empty ``queue`` selects the default queue; an empty ``idempotency_key``
+means none (it is only used by OP_JOIN). ``estimated_wait`` is -1 when
+no estimate is available. An OP_NEXT request names the task it completes
+(empty for the next one that is not a job); ``name`` is only set in
+responses to OP_NEXT. Connections are persistent; a client may send any
+number of requests on one connection.
+"""
+import fcntl
+import os
+import socketserver
+import struct
+import threading
+import logging
+
+from app.config import Config
+from app.engine import (IdempotencyConflictError, QueueFullError, QueueRegistry, ReadOnlyError,
+                        TaskClaimedError)
+
+logger = logging.getLogger(__name__)
+
+LENGTH = struct.Struct('!I')
+REQUEST_HEADER = struct.Struct('!BiIBB')
+RESPONSE_HEADER = struct.Struct('!BiId')
+MAX_FRAME_SIZE = 64 * 1024
+
+# Operations
+OP_JOIN = 1
+OP_WAIT = 2
+OP_NEXT = 3
+OP_REMOVE = 4
+OP_POSITION = 5
+
+# Response status codes
+STATUS_OK = 0
+STATUS_NOT_FOUND = 1
+STATUS_QUEUE_FULL = 2
+STATUS_TIMEOUT = 3
+STATUS_BAD_REQUEST = 4
+STATUS_ERROR = 5
+STATUS_READ_ONLY = 6
+STATUS_CONFLICT = 7
+
+
+def encode_request(op, name='', priority=0, timeout_ms=0, queue='', idempotency_key=''):
+    queue, key = queue.encode('utf-8'), idempotency_key.encode('utf-8')
+    body = REQUEST_HEADER.pack(op, priority, timeout_ms, len(queue), len(key)) + queue + key + name.encode('utf-8')
+    return LENGTH.pack(len(body)) + body
+
+
+def decode_request(body):
+    """Return (op, name, priority, timeout_ms, queue, idempotency_key) from a request body"""
+    op, priority, timeout_ms, queue_length, key_length = REQUEST_HEADER.unpack_from(body)
+    key_start = REQUEST_HEADER.size + queue_length
+    name_start = key_start + key_length
+    if len(body) < name_start:
+        raise struct.error('queue name or key runs past the end of the frame')
+    queue = body[REQUEST_HEADER.size:key_start].decode('utf-8')
+    key = body[key_start:name_start].decode('utf-8')
+    return op, body[name_start:].decode('utf-8'), priority, timeout_ms, queue, key
+
+
+def encode_response(status, position=-1, queue_size=0, estimated_wait=None, name=''):
+    wait = -1.0 if estimated_wait is None else estimated_wait
+    body = RESPONSE_HEADER.pack(status, position, queue_size, wait) + name.encode('utf-8')
+    return LENGTH.pack(len(body)) + body
+
+
+def decode_response(body):
+    status, position, queue_size, wait = RESPONSE_HEADER.unpack_from(body)
+    return {
+        'status': status,
+        'position': position,
+        'queue_size': queue_size,
+        'estimated_wait': None if wait < 0 else wait,
+        'name': body[RESPONSE_HEADER.size:].decode('utf-8') or None
+    }
+
+
+def read_frame(sock_file):
+    """Read one frame body from a binary file object, or None on EOF"""
+    header = sock_file.read(LENGTH.size)
+    if len(header) < LENGTH.size:
+        return None
+    (length,) = LENGTH.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {length} bytes exceeds limit")
+    body = sock_file.read(length)
+    if len(body) < length:
+        return None
+    return body
+
+
+def handle_request(registry, body):
+    """Apply one decoded request to its queue and return the response frame
+
+    Only joins create a queue that does not exist yet.
+    """
+    try:
+        op, name, priority, timeout_ms, queue, idempotency_key = decode_request(body)
+    except (struct.error, UnicodeDecodeError):
+        return encode_response(STATUS_BAD_REQUEST)
+
+    queue = queue or QueueRegistry.DEFAULT
+    if not QueueRegistry.valid_name(queue):
+        return encode_response(STATUS_BAD_REQUEST)
+    engine = registry.get(queue) if op == OP_JOIN else registry.lookup(queue)
+
+    if op == OP_JOIN:
+        if not name:
+            return encode_response(STATUS_BAD_REQUEST)
+        try:
+            result = engine.join(name, priority, None, idempotency_key or None)
+        except QueueFullError:
+            return encode_response(STATUS_QUEUE_FULL, queue_size=engine.size())
+        except (IdempotencyConflictError, TaskClaimedError):
+            return encode_response(STATUS_CONFLICT, queue_size=engine.size())
+        wait = engine.estimate_start(result['position'])['estimated_wait']
+        return encode_response(STATUS_OK, result['position'], result['queue_size'], wait)
+
+    if op == OP_WAIT:
+        position = engine.wait(name, min(timeout_ms / 1000.0, Config.MAX_WAIT_SECONDS))
+        if position == -1:
+            return encode_response(STATUS_NOT_FOUND)
+        status = STATUS_OK if position == 1 else STATUS_TIMEOUT
+        wait = engine.estimate_start(position)['estimated_wait']
+        return encode_response(status, position, engine.size(), wait)
+
+    if op == OP_POSITION:
+        result = engine.position(name)
+        if result is None:
+            return encode_response(STATUS_NOT_FOUND)
+        wait = engine.estimate_start(result['position'])['estimated_wait']
+        return encode_response(STATUS_OK, result['position'], result['queue_size'], wait)
+
+    if op == OP_NEXT:
+        next_name, _, remaining = engine.next(name or None)
+        if next_name is None:
+            return encode_response(STATUS_NOT_FOUND)
+        return encode_response(STATUS_OK, queue_size=remaining, name=next_name)
+
+    if op == OP_REMOVE:
+        if engine.remove(name):
+            return encode_response(STATUS_OK, queue_size=engine.size())
+        return encode_response(STATUS_NOT_FOUND)
+
+    return encode_response(STATUS_BAD_REQUEST)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                body = read_frame(self.rfile)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Dropping unix socket connection: {e}")
+                return
+            if body is None:
+                return
+
+            try:
+                response = handle_request(self.server.registry, body)
+            except ReadOnlyError:
+                response = encode_response(STATUS_READ_ONLY)
+            except Exception as e:
+                logger.error(f"Error handling unix socket request: {e}")
+                response = encode_response(STATUS_ERROR)
+
+            try:
+                self.wfile.write(response)
+            except OSError:
+                return
+
+
+class UnixQueueServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, registry, lock_file=None):
+        self.registry = registry
+        self.lock_file = lock_file
+        super().__init__(path, _RequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+
+def _lock(path):
+    """Return the open lock file for ``path``, or None if another process holds it"""
+    lock_file = open(path + '.lock', 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def start_unix_server(registry, path):
+    """Serve the binary protocol for a registry's queues on ``path`` from a background thread
+
+    Returns None without binding if another process already serves ``path``;
+    the lock is held until the server is closed or the process exits.
+    """
+    lock_file = _lock(path)
+    if lock_file is None:
+        logger.info(f"unix://{path} is served by another process")
+        return None
+    # Holding the lock, any existing socket file is left over from a dead server
+    if os.path.exists(path):
+        os.unlink(path)
+    try:
+        server = UnixQueueServer(path, registry, lock_file)
+    except Exception:
+        lock_file.close()
+        raise
+    thread = threading.Thread(target=server.serve_forever, name='unix-queue-server', daemon=True)
+    thread.start()
+    logger.info(f"Binary protocol listening on unix://{path}")
+    return server
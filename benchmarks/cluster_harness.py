@@ -0,0 +1,117 @@
+"""
+Multi-process localhost harness for sharded cluster throughput
+
+Starts clusters of 1, 2, 4... queue server processes, spreads named queues
+over them by consistent hashing and drives join/next cycles from several
+load-generator processes with client-side routing. Prints aggregate
+operations per second for each cluster size.
+
+    python benchmarks/cluster_harness.py --nodes 1 2 4 --clients 8 --duration 10
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from queue_enhanced import ShardedQueueClient  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_cluster(size, data_dir):
+    ports = [free_port() for _ in range(size)]
+    urls = [f'http://127.0.0.1:{port}' for port in ports]
+    processes = []
+    for port, url in zip(ports, urls):
+        env = dict(
+            os.environ,
+            CLUSTER_NODES=','.join(urls),
+            NODE_URL=url,
+            DATABASE_PATH=os.path.join(data_dir, f'node_{port}.db'),
+            MAX_QUEUE_SIZE='1000000',
+            ENABLE_METRICS='false'
+        )
+        processes.append(subprocess.Popen(
+            [sys.executable, '-c', f'from app import app; app.run(port={port}, threaded=True)'],
+            cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ))
+
+    for url in urls:
+        deadline = time.time() + 15
+        while True:
+            try:
+                requests.get(f'{url}/health', timeout=1)
+                break
+            except requests.RequestException:
+                if time.time() > deadline:
+                    raise RuntimeError(f'{url} did not start')
+                time.sleep(0.1)
+    return processes, urls
+
+
+def generate_load(args):
+    urls, queues, duration, seed = args
+    rng = random.Random(seed)
+    router = ShardedQueueClient(urls)
+    owners = {queue: router.client_for(queue).server_url for queue in queues}
+    session = requests.Session()
+
+    ops = 0
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        queue = rng.choice(queues)
+        owner = owners[queue]
+        session.post(f'{owner}/queue', params={'queue': queue},
+                     json={'name': f'task-{seed}-{ops}'}, timeout=10)
+        session.post(f'{owner}/queue/next', params={'queue': queue}, timeout=10)
+        ops += 2
+    return ops
+
+
+def run(size, clients, queues, duration):
+    with tempfile.TemporaryDirectory() as data_dir:
+        processes, urls = start_cluster(size, data_dir)
+        try:
+            names = [f'queue-{i}' for i in range(queues)]
+            with multiprocessing.Pool(clients) as pool:
+                started = time.time()
+                counts = pool.map(generate_load, [(urls, names, duration, i) for i in range(clients)])
+                elapsed = time.time() - started
+            return sum(counts) / elapsed
+        finally:
+            for process in processes:
+                process.kill()
+                process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=8, help='load-generator processes')
+    parser.add_argument('--queues', type=int, default=64, help='named queues to spread')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per cluster size')
+    args = parser.parse_args()
+
+    baseline = None
+    for size in args.nodes:
+        throughput = run(size, args.clients, args.queues, args.duration)
+        baseline = baseline or throughput
+        print(f'{size} node(s): {throughput:10.0f} ops/s  ({throughput / baseline:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
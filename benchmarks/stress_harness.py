@@ -0,0 +1,445 @@
+"""
+Concurrency stress and differential check for a queue server
+
+Several load-generator processes, each running many threads, issue a random
+mix of join, next, remove and position calls against one queue while:
+
+- a sampler checks listed snapshots: positions are exactly 1..n, names are
+  unique and priorities never rise towards the tail;
+- a tailer follows the replication journal. Afterwards the journal is
+  replayed through ReferenceQueue, a plain sorted list: every next must have
+  taken the model's head and the model must end equal to the final listing;
+- the clients' own records must match the journal, so every acknowledged
+  join is accounted for exactly once as queued, completed or removed.
+
+Throughput and latency per operation are reported alongside.
+
+    python benchmarks/stress_harness.py --processes 4 --threads 8 --duration 10
+    python benchmarks/stress_harness.py --engine-mode process
+    python benchmarks/stress_harness.py --url http://127.0.0.1:5000
+
+Exits with status 1 if any invariant was violated.
+"""
+import argparse
+import bisect
+import collections
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUEUE = 'stress'
+
+# Relative weights of the calls each client thread makes
+OPERATIONS = {'join': 4, 'position': 4, 'next': 2, 'remove': 1}
+PRIORITIES = (0, 0, 0, 1, 5)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(data_dir, engine_mode='thread'):
+    """Start a server on a free port, with an engine process if asked
+
+    Returns the started processes and the server URL.
+    """
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_PATH=os.path.join(data_dir, 'stress.db'),
+        MAX_QUEUE_SIZE='1000000',
+        REPLICATION_JOURNAL_SIZE='10000000',
+        ENABLE_METRICS='false',
+        LOG_LEVEL='WARNING'
+    )
+    processes = []
+    if engine_mode == 'process':
+        address = os.path.join(data_dir, 'engine.sock')
+        env.update(ENGINE_MODE='process', ENGINE_ADDRESS=address)
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'app.engine_process'],
+            cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ))
+        deadline = time.time() + 15
+        while not os.path.exists(address):
+            if time.time() > deadline:
+                raise RuntimeError('Engine process did not start')
+            time.sleep(0.05)
+
+    processes.append(subprocess.Popen(
+        [sys.executable, '-c', f'from app import app; app.run(port={port}, threaded=True)'],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    ))
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 15
+    while True:
+        try:
+            requests.get(f'{url}/health', timeout=1)
+            return processes, url
+        except requests.RequestException:
+            if time.time() > deadline:
+                raise RuntimeError(f'{url} did not start')
+            time.sleep(0.1)
+
+
+class ReferenceQueue:
+    """Sequential model of one queue: highest priority first, then join order"""
+
+    def __init__(self):
+        self.entries = []   # (-priority, join sequence, name), kept sorted
+        self.keys = {}
+
+    def join(self, name, priority, seq):
+        if name in self.keys:
+            return f'{name} joined twice'
+        key = (-priority, seq, name)
+        self.keys[name] = key
+        bisect.insort(self.entries, key)
+
+    def next(self, name):
+        if not self.entries:
+            return f'next took {name} from an empty queue'
+        head = self.entries[0][2]
+        if head != name:
+            return f'next took {name} while {head} was at the head'
+        self.remove(name)
+
+    def remove(self, name):
+        key = self.keys.pop(name, None)
+        if key is None:
+            return f'{name} left the queue without being queued'
+        del self.entries[bisect.bisect_left(self.entries, key)]
+
+    def names(self):
+        return [entry[2] for entry in self.entries]
+
+
+def check_listing(tasks):
+    """Invariant violations in one /queue/list snapshot"""
+    violations = []
+    names = [task['name'] for task in tasks]
+    if len(set(names)) != len(names):
+        duplicated = [name for name, count in collections.Counter(names).items() if count > 1]
+        violations.append(f'listing repeats {duplicated[:5]}')
+    positions = [task['position'] for task in tasks]
+    if positions != list(range(1, len(tasks) + 1)):
+        violations.append(f'listing positions are not 1..{len(tasks)}')
+    for ahead, behind in zip(tasks, tasks[1:]):
+        if behind['priority'] > ahead['priority']:
+            violations.append(f"{behind['name']} (priority {behind['priority']}) is behind "
+                              f"{ahead['name']} (priority {ahead['priority']})")
+            break
+    return violations
+
+
+def check_history(entries, final_names, records):
+    """Replay journal entries through the model and reconcile client records
+
+    ``entries`` are (seq, op) pairs for the stressed queue, ``final_names``
+    the queue's final listing and ``records`` the merged client records.
+    Returns a list of violations.
+    """
+    violations = []
+    model = ReferenceQueue()
+    journaled = collections.defaultdict(list)
+    for seq, op in entries:
+        kind = op['op']
+        if kind == 'join':
+            violation = model.join(op['name'], op['metadata'].get('priority', 0), seq)
+            journaled['joined'].append(op['name'])
+        elif kind == 'next':
+            violation = model.next(op['name'])
+            journaled['nexted'].append(op['name'])
+        elif kind in ('remove', 'remove_many'):
+            names = [op['name']] if kind == 'remove' else op['names']
+            violation = next(filter(None, map(model.remove, names)), None)
+            journaled['removed'].extend(names)
+        else:
+            violation = f'unexpected journal entry {kind} at {seq}'
+        if violation:
+            violations.append(f'journal {seq}: {violation}')
+
+    if model.names() != final_names:
+        violations.append(f'final queue of {len(final_names)} differs from the model of {len(model.names())}')
+
+    for kind in ('joined', 'nexted', 'removed'):
+        acknowledged = collections.Counter(records[kind])
+        recorded = collections.Counter(journaled[kind])
+        if acknowledged != recorded:
+            lost = list((acknowledged - recorded).elements())
+            unacknowledged = list((recorded - acknowledged).elements())
+            violations.append(f'{kind}: {len(lost)} acknowledged but not journaled {lost[:5]}, '
+                              f'{len(unacknowledged)} journaled but not acknowledged {unacknowledged[:5]}')
+
+    # A task a client found gone must have left through next or remove
+    left = set(journaled['nexted']) | set(journaled['removed'])
+    vanished = [name for name in records['gone'] if name not in left]
+    if vanished:
+        violations.append(f'{len(vanished)} tasks vanished without next or remove {vanished[:5]}')
+    return violations
+
+
+def client_thread(url, headers, seed, start_at, deadline, record):
+    """Issue random calls until ``deadline``, recording every outcome"""
+    rng = random.Random(seed)
+    session = requests.Session()
+    params = {'queue': QUEUE}
+    operations, weights = zip(*OPERATIONS.items())
+    live = []  # tasks this thread joined and has not seen leave
+    joins = 0
+
+    time.sleep(max(0, start_at - time.time()))
+    while time.time() < deadline:
+        operation = rng.choices(operations, weights)[0]
+        if operation in ('position', 'remove') and not live:
+            operation = 'join'
+        started = time.perf_counter()
+        try:
+            if operation == 'join':
+                name = f'{seed}-{joins}'
+                joins += 1
+                response = session.post(f'{url}/queue', params=params, headers=headers, timeout=30,
+                                        json={'name': name, 'priority': rng.choice(PRIORITIES)})
+                if response.status_code == 200:
+                    data = response.json()
+                    record['joined'].append(name)
+                    live.append(name)
+                    if not 1 <= data['position'] <= data['queue_size']:
+                        record['violations'].append(
+                            f"join of {name} returned position {data['position']} of {data['queue_size']}")
+            elif operation == 'next':
+                response = session.post(f'{url}/queue/next', params=params, headers=headers, timeout=30)
+                if response.status_code == 200 and response.json()['next'] is not None:
+                    record['nexted'].append(response.json()['next'])
+            elif operation == 'remove':
+                name = live.pop(rng.randrange(len(live)))
+                response = session.delete(f'{url}/queue/remove/{name}', params=params, headers=headers,
+                                          timeout=30)
+                if response.status_code == 200:
+                    record['removed'].append(name)
+                elif response.status_code == 404:
+                    record['gone'].append(name)
+            else:
+                index = rng.randrange(len(live))
+                name = live[index]
+                response = session.get(f'{url}/queue/{name}', params=params, headers=headers, timeout=30)
+                if response.status_code == 200:
+                    data = response.json()
+                    if data['position'] == -1:
+                        record['gone'].append(live.pop(index))
+                    elif not 1 <= data['position'] <= data['queue_size']:
+                        record['violations'].append(
+                            f"{name} reported at position {data['position']} of {data['queue_size']}")
+        except requests.RequestException as e:
+            record['errors'].append(f'{operation}: {e}')
+            continue
+
+        record['latency'][operation].append(time.perf_counter() - started)
+        if response.status_code not in (200, 404) or (response.status_code == 404 and operation != 'remove'):
+            record['errors'].append(f'{operation}: HTTP {response.status_code}')
+
+
+def new_record():
+    return {
+        'joined': [], 'nexted': [], 'removed': [], 'gone': [],
+        'violations': [], 'errors': [],
+        'latency': collections.defaultdict(list)
+    }
+
+
+def generate_load(args):
+    """Run client threads in this process and return their merged records"""
+    url, api_key, process, threads, start_at, deadline = args
+    headers = {'X-API-Key': api_key} if api_key else {}
+    records = [new_record() for _ in range(threads)]
+    workers = [
+        threading.Thread(target=client_thread,
+                         args=(url, headers, f'p{process}t{n}', start_at, deadline, records[n]))
+        for n in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    merged = new_record()
+    for record in records:
+        for key, value in record.items():
+            if key == 'latency':
+                for operation, samples in value.items():
+                    merged['latency'][operation].extend(samples)
+            else:
+                merged[key].extend(value)
+    merged['latency'] = dict(merged['latency'])
+    return merged
+
+
+class JournalTailer(threading.Thread):
+    """Follow the server's replication journal from a starting sequence"""
+
+    def __init__(self, url, headers, since):
+        super().__init__(daemon=True)
+        self.url = url
+        self.headers = headers
+        self.since = since
+        self.entries = []
+        self.error = None
+        self.stop_at = None  # sequence to read up to before stopping
+
+    def run(self):
+        session = requests.Session()
+        while self.stop_at is None or self.since < self.stop_at:
+            try:
+                response = session.get(f'{self.url}/replication/journal', headers=self.headers, timeout=30,
+                                       params={'since': self.since, 'wait': 1, 'limit': 10000})
+                response.raise_for_status()
+            except requests.RequestException as e:
+                self.error = f'journal tail failed after {self.since}: {e}'
+                return
+            for seq, op in response.json()['entries']:
+                self.since = seq
+                if op.get('queue') == QUEUE:
+                    self.entries.append((seq, op))
+
+    def finish(self, last_seq):
+        self.stop_at = last_seq
+        self.join()
+
+
+class Sampler(threading.Thread):
+    """Check the invariants of listed snapshots while the load runs"""
+
+    def __init__(self, url, headers, interval=0.2):
+        super().__init__(daemon=True)
+        self.url = url
+        self.headers = headers
+        self.interval = interval
+        self.samples = 0
+        self.violations = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        session = requests.Session()
+        while not self.stopped.wait(self.interval):
+            try:
+                response = session.get(f'{self.url}/queue/list', params={'queue': QUEUE},
+                                       headers=self.headers, timeout=30)
+            except requests.RequestException:
+                continue
+            if response.status_code == 200:
+                self.samples += 1
+                self.violations.extend(check_listing(response.json()['queue']))
+
+
+def stress(url, processes=4, threads=8, duration=10, api_key=None):
+    """Run the load against ``url`` and check it, returning a report dict"""
+    headers = {'X-API-Key': api_key} if api_key else {}
+    requests.post(f'{url}/queue/clear', params={'queue': QUEUE}, headers=headers, timeout=30).raise_for_status()
+    status = requests.get(f'{url}/replication/status', headers=headers, timeout=30).json()
+
+    tailer = JournalTailer(url, headers, status['last_seq'])
+    sampler = Sampler(url, headers)
+    tailer.start()
+    sampler.start()
+
+    start_at = time.time() + 0.5
+    deadline = start_at + duration
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(generate_load, [(url, api_key, n, threads, start_at, deadline)
+                                           for n in range(processes)])
+    elapsed = time.time() - start_at
+
+    sampler.stopped.set()
+    sampler.join()
+    status = requests.get(f'{url}/replication/status', headers=headers, timeout=30).json()
+    tailer.finish(status['last_seq'])
+    listing = requests.get(f'{url}/queue/list', params={'queue': QUEUE}, headers=headers, timeout=30).json()
+
+    records = new_record()
+    latency = collections.defaultdict(list)
+    for result in results:
+        for key in ('joined', 'nexted', 'removed', 'gone', 'violations', 'errors'):
+            records[key].extend(result[key])
+        for operation, samples in result['latency'].items():
+            latency[operation].extend(samples)
+
+    violations = records['violations'] + sampler.violations + check_listing(listing['queue'])
+    if tailer.error:
+        violations.append(tailer.error)
+    else:
+        final_names = [task['name'] for task in listing['queue']]
+        violations.extend(check_history(tailer.entries, final_names, records))
+
+    operations = {}
+    for operation, samples in sorted(latency.items()):
+        samples.sort()
+        operations[operation] = {
+            'count': len(samples),
+            'ops_per_sec': len(samples) / elapsed,
+            'p50_ms': samples[len(samples) // 2] * 1000,
+            'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000
+        }
+    return {
+        'elapsed': elapsed,
+        'ops_per_sec': sum(len(samples) for samples in latency.values()) / elapsed,
+        'operations': operations,
+        'journal_entries': len(tailer.entries),
+        'samples': sampler.samples,
+        'final_size': len(listing['queue']),
+        'errors': records['errors'],
+        'violations': violations
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='existing server to stress instead of starting one')
+    parser.add_argument('--engine-mode', choices=['thread', 'process'], default='thread',
+                        help='engine mode of the started server')
+    parser.add_argument('--processes', type=int, default=4, help='load-generator processes')
+    parser.add_argument('--threads', type=int, default=8, help='client threads per process')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load')
+    parser.add_argument('--api-key', help='X-API-Key to send')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        processes, url = ([], args.url) if args.url else start_server(data_dir, args.engine_mode)
+        try:
+            report = stress(url, args.processes, args.threads, args.duration, args.api_key)
+        finally:
+            for process in processes:
+                process.kill()
+                process.wait()
+
+    print(f"{args.processes * args.threads} clients for {report['elapsed']:.1f}s: "
+          f"{report['ops_per_sec']:.0f} ops/s")
+    for operation, stats in report['operations'].items():
+        print(f"  {operation:<9} {stats['count']:8d} calls {stats['ops_per_sec']:9.0f} ops/s  "
+              f"p50 {stats['p50_ms']:7.2f} ms  p99 {stats['p99_ms']:7.2f} ms")
+    print(f"  {report['journal_entries']} journal entries replayed, {report['samples']} listings checked, "
+          f"{report['final_size']} tasks left")
+
+    for error in report['errors'][:10]:
+        print(f'error: {error}')
+    for violation in report['violations'][:20]:
+        print(f'VIOLATION: {violation}')
+    if report['violations']:
+        print(f"{len(report['violations'])} invariant violations")
+        sys.exit(1)
+    print('All invariants held')
+
+
+if __name__ == '__main__':
+    main()
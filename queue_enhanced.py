@@ -1,31 +1,125 @@
 """
 Enhanced Queue Client with advanced features
 """
+import os
 import time
+import uuid
+import base64
+import socket
+import struct
+import threading
 import requests
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
 from typing import Callable, Optional, Any
 from functools import wraps
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Applications configure logging; per-poll messages are at DEBUG
 logger = logging.getLogger(__name__)
 
+class UnixSocketTransport:
+    """Client side of the binary protocol served by app.unix_socket
+
+    Keeps one persistent connection per thread. Every request is sent to the
+    named ``queue`` (the default queue when None). Transport failures are
+    raised as ``requests.ConnectionError`` so callers retry them like HTTP errors.
+    """
+
+    LENGTH = struct.Struct('!I')
+    REQUEST_HEADER = struct.Struct('!BiIBB')
+    RESPONSE_HEADER = struct.Struct('!BiId')
+
+    OP_JOIN, OP_WAIT, OP_NEXT, OP_REMOVE, OP_POSITION = 1, 2, 3, 4, 5
+    STATUS_OK, STATUS_NOT_FOUND, STATUS_QUEUE_FULL, STATUS_TIMEOUT = 0, 1, 2, 3
+    STATUS_READ_ONLY, STATUS_CONFLICT = 6, 7
+
+    def __init__(self, path: str, timeout: float = 10, queue: Optional[str] = None):
+        self.path = path
+        self.timeout = timeout
+        self.queue = (queue or '').encode('utf-8')
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+            conn = self._local.conn = (sock, sock.makefile('rb'))
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+
+    def request(self, op: int, name: str = '', priority: int = 0, wait_timeout: float = 0,
+                idempotency_key: Optional[str] = None) -> dict:
+        """Send one request and return the decoded response"""
+        timeout_ms = int(wait_timeout * 1000)
+        key = (idempotency_key or '').encode('utf-8')
+        body = (self.REQUEST_HEADER.pack(op, priority, timeout_ms, len(self.queue), len(key)) + self.queue +
+                key + name.encode('utf-8'))
+        try:
+            sock, rfile = self._connection()
+            sock.settimeout(self.timeout + wait_timeout)
+            sock.sendall(self.LENGTH.pack(len(body)) + body)
+            header = rfile.read(self.LENGTH.size)
+            if len(header) < self.LENGTH.size:
+                raise ConnectionError('connection closed by server')
+            (length,) = self.LENGTH.unpack(header)
+            response = rfile.read(length)
+        except OSError as e:
+            self.close()
+            raise requests.ConnectionError(f'unix://{self.path}: {e}') from e
+
+        status, position, queue_size, wait = self.RESPONSE_HEADER.unpack_from(response)
+        if status not in (self.STATUS_OK, self.STATUS_NOT_FOUND, self.STATUS_TIMEOUT):
+            reasons = {self.STATUS_QUEUE_FULL: 'Queue full', self.STATUS_READ_ONLY: 'Server is a read-only follower',
+                       self.STATUS_CONFLICT: 'Task is claimed or the idempotency key belongs to another task'}
+            reason = reasons.get(status, f'Request failed with status {status}')
+            raise requests.HTTPError(reason)
+
+        return {
+            'position': -1 if status == self.STATUS_NOT_FOUND else position,
+            'queue_size': queue_size,
+            'estimated_wait': None if wait < 0 else wait,
+            'next': response[self.RESPONSE_HEADER.size:].decode('utf-8') or None
+        }
+
 class QueueClient:
-    """Enhanced queue client with retry logic, timeouts, and better error handling"""
+    """Enhanced queue client with retry logic, timeouts, and better error handling
+
+    ``server_url`` may be ``unix:///path/to/socket`` to use the binary protocol
+    of a co-located server instead of HTTP. ``queue`` selects a named queue on
+    the server (the default queue when None).
+    """
 
     def __init__(self,
                  server_url: str = 'http://127.0.0.1:5000',
                  api_key: Optional[str] = None,
                  poll_interval: int = 5,
-                 timeout: int = 3600):
+                 timeout: int = 3600,
+                 adaptive_polling: bool = True,
+                 min_poll_interval: float = 0.5,
+                 max_poll_interval: float = 60,
+                 queue: Optional[str] = None):
         self.server_url = server_url
+        self.queue = queue
         self.api_key = api_key
         self.poll_interval = poll_interval
         self.timeout = timeout
+        self.adaptive_polling = adaptive_polling
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
         self.headers = {'X-API-Key': api_key} if api_key else {}
+        self._unix = None
+        if server_url.startswith('unix://'):
+            self._unix = UnixSocketTransport(server_url[len('unix://'):], queue=queue)
 
-    def queue_decorator(self, name: str, priority: int = 0, max_retries: int = 3):
+    def queue_decorator(self, name: str, priority: int = 0, max_retries: int = 3, tags: Optional[list] = None):
         """
         Decorator to queue function execution
 
@@ -33,27 +127,22 @@ class QueueClient:
             name: Task name
             priority: Task priority (higher = runs sooner)
             max_retries: Number of retries on failure
+            tags: Tags for bulk cancellation and reprioritization
         """
         def decorator(func: Callable) -> Callable:
             @wraps(func)
             def wrapper(*args, **kwargs) -> Any:
                 retries = 0
+                # One key per call, so a join retried after a lost response is not queued twice
+                idempotency_key = uuid.uuid4().hex
                 while retries <= max_retries:
                     try:
                         # Join the queue
-                        response = requests.post(
-                            f'{self.server_url}/queue',
-                            json={'name': name, 'priority': priority},
-                            headers=self.headers,
-                            timeout=10
-                        )
-                        response.raise_for_status()
-
-                        data = response.json()
+                        data = self._join(name, priority, idempotency_key, tags)
                         position = data['position']
                         queue_size = data.get('queue_size', 'unknown')
 
-                        logger.info(f'{name} joined queue at position {position} (queue size: {queue_size})')
+                        logger.info('%s joined queue at position %s (queue size: %s)', name, position, queue_size)
 
                         # Poll the queue until it's our turn
                         start_time = time.time()
@@ -64,44 +153,36 @@ class QueueClient:
                                 self._remove_from_queue(name)
                                 raise TimeoutError(f'Task {name} timed out after {self.timeout} seconds')
 
-                            time.sleep(self.poll_interval)
-
                             try:
-                                response = requests.get(
-                                    f'{self.server_url}/queue/{name}',
-                                    headers=self.headers,
-                                    timeout=10
-                                )
-                                response.raise_for_status()
-
-                                data = response.json()
+                                remaining = self.timeout - (time.time() - start_time)
+                                data = self._await_position(name, data, remaining)
                                 position = data['position']
 
                                 if position == -1:
                                     logger.warning(f'{name} was removed from queue')
                                     raise RuntimeError(f'Task {name} was removed from queue')
 
-                                logger.info(f'{name} at position {position}')
+                                logger.debug('%s at position %s', name, position)
 
                             except requests.RequestException as e:
                                 logger.warning(f'Error checking position: {e}')
-                                # Continue polling even if one check fails
+                                # Continue polling even if one check fails; a unix
+                                # wait fails at once when the server is down, so back off
+                                if self._unix:
+                                    time.sleep(self.min_poll_interval)
                                 continue
 
                         # It's our turn!
-                        logger.info(f'{name} is now running')
+                        logger.info('%s is now running', name)
 
-                        # Execute the function
-                        result = func(*args, **kwargs)
+                        # Execute the function, heartbeating so the server keeps the task
+                        with self._heartbeat(name, self._heartbeat_interval(data)):
+                            result = func(*args, **kwargs)
 
                         # Notify completion
                         try:
-                            requests.post(
-                                f'{self.server_url}/queue/next',
-                                headers=self.headers,
-                                timeout=10
-                            )
-                            logger.info(f'{name} completed successfully')
+                            self._notify_completion(name)
+                            logger.info('%s completed successfully', name)
                         except requests.RequestException as e:
                             logger.warning(f'Failed to notify completion: {e}')
 
@@ -126,26 +207,140 @@ class QueueClient:
             return wrapper
         return decorator
 
+    def _request(self, method: str, path: str, raise_for_status: bool = True, **kwargs) -> requests.Response:
+        """Send an HTTP request for this client's queue
+
+        A 421 response from a sharded cluster names the node that owns the
+        queue; the client switches to that node and retries once.
+        """
+        if self.queue:
+            kwargs['params'] = {**kwargs.get('params', {}), 'queue': self.queue}
+
+        kwargs.setdefault('timeout', 10)
+
+        kwargs['headers'] = kwargs.get('headers') or self.headers
+
+        response = requests.request(method, f'{self.server_url}{path}', **kwargs)
+        if response.status_code == 421:
+            owner = response.json().get('owner')
+            if owner and owner != self.server_url:
+                logger.info(f'Queue {self.queue} moved to {owner}')
+                self.server_url = owner
+                response = requests.request(method, f'{self.server_url}{path}', **kwargs)
+
+        if raise_for_status:
+            response.raise_for_status()
+        return response
+
+    def _join(self, name: str, priority: int, idempotency_key: Optional[str] = None,
+              tags: Optional[list] = None) -> dict:
+        """Join the queue and return the server's position response"""
+        if self._unix:
+            if tags:
+                self._require_http('Tagging')
+            return self._unix.request(UnixSocketTransport.OP_JOIN, name, priority, idempotency_key=idempotency_key)
+
+        body = {'name': name, 'priority': priority}
+        if tags:
+            body['tags'] = list(tags)
+        headers = {**self.headers, 'Idempotency-Key': idempotency_key} if idempotency_key else None
+        response = self._request('POST', '/queue', json=body, headers=headers)
+        return response.json()
+
+    def _await_position(self, name: str, data: dict, remaining: float) -> dict:
+        """Wait for the next position update of a queued task
+
+        Over HTTP this sleeps for the poll delay and checks the position. Over
+        a unix socket the server blocks until the task reaches the head.
+        """
+        if self._unix:
+            wait_timeout = max(0.0, min(remaining, self.max_poll_interval))
+            return self._unix.request(UnixSocketTransport.OP_WAIT, name, wait_timeout=wait_timeout)
+
+        time.sleep(self._next_poll_delay(data))
+        response = self._request('GET', f'/queue/{name}')
+        return response.json()
+
+    def _positions(self, names: list) -> dict:
+        """Look up the positions of many tasks, with the server's hints for the nearest"""
+        if self._unix:
+            positions = {}
+            for name in names:
+                data = self._unix.request(UnixSocketTransport.OP_POSITION, name)
+                positions[name] = data['position']
+            return {'positions': positions}
+
+        response = self._request('POST', '/queue/positions', json={'names': names})
+        return response.json()
+
+    def _notify_completion(self, name: str):
+        """Tell the server this client's task has finished"""
+        if self._unix:
+            self._unix.request(UnixSocketTransport.OP_NEXT, name)
+            return
+
+        self._request('POST', '/queue/next', json={'name': name}, raise_for_status=False)
+
+    def _next_poll_delay(self, data: dict) -> float:
+        """Pick the delay before the next position check
+
+        Uses the server's ``poll_after`` hint when adaptive polling is on, so
+        tasks far back in the queue poll rarely and tasks near the head poll
+        often. Falls back to ``poll_interval`` when no hint is available.
+        """
+        suggested = data.get('poll_after') if self.adaptive_polling else None
+        if suggested is None:
+            return self.poll_interval
+        return min(max(suggested, self.min_poll_interval), self.max_poll_interval)
+
+    def _heartbeat_interval(self, data: dict) -> float:
+        """Pick the interval between heartbeats of a running task
+
+        A quarter of the task's TTL when the server reported it, else
+        ``max_poll_interval``.
+        """
+        ttl = (data.get('metadata') or {}).get('ttl')
+        return min(ttl / 4, self.max_poll_interval) if ttl else self.max_poll_interval
+
+    @contextmanager
+    def _heartbeat(self, name: str, interval: float):
+        """Check a running task's position every ``interval`` seconds
+
+        The server expires tasks whose clients go quiet, including the one at
+        the head once TASK_TIMEOUT has passed.
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    self._positions([name])
+                except requests.RequestException as e:
+                    logger.warning(f'Heartbeat for {name} failed: {e}')
+
+        thread = threading.Thread(target=beat, name=f'heartbeat-{name}', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+
     def _remove_from_queue(self, name: str):
         """Remove a task from the queue"""
         try:
-            requests.delete(
-                f'{self.server_url}/queue/remove/{name}',
-                headers=self.headers,
-                timeout=10
-            )
+            if self._unix:
+                self._unix.request(UnixSocketTransport.OP_REMOVE, name)
+                return
+            self._request('DELETE', f'/queue/remove/{name}', raise_for_status=False)
         except requests.RequestException as e:
             logger.warning(f'Failed to remove task from queue: {e}')
 
     def get_queue_status(self) -> dict:
         """Get current queue status"""
+        if self._unix:
+            return {'error': 'Queue listing is not available over a unix socket'}
         try:
-            response = requests.get(
-                f'{self.server_url}/queue/list',
-                headers=self.headers,
-                timeout=10
-            )
-            response.raise_for_status()
+            response = self._request('GET', '/queue/list')
             return response.json()
         except requests.RequestException as e:
             logger.error(f'Failed to get queue status: {e}')
@@ -153,13 +348,10 @@ class QueueClient:
 
     def get_metrics(self) -> dict:
         """Get queue metrics"""
+        if self._unix:
+            return {'error': 'Metrics are not available over a unix socket'}
         try:
-            response = requests.get(
-                f'{self.server_url}/metrics',
-                headers=self.headers,
-                timeout=10
-            )
-            response.raise_for_status()
+            response = self._request('GET', '/metrics')
             return response.json()
         except requests.RequestException as e:
             logger.error(f'Failed to get metrics: {e}')
@@ -167,6 +359,12 @@ class QueueClient:
 
     def health_check(self) -> bool:
         """Check if server is healthy"""
+        if self._unix:
+            try:
+                self._unix.request(UnixSocketTransport.OP_POSITION)
+                return True
+            except requests.RequestException:
+                return False
         try:
             response = requests.get(
                 f'{self.server_url}/health',
@@ -178,6 +376,551 @@ class QueueClient:
         except requests.RequestException:
             return False
 
+    def executor(self, max_workers: int = 4, pool: str = 'thread', timeout: Optional[float] = None) -> 'QueueExecutor':
+        """Create an executor that queues many calls behind one coordinator"""
+        return QueueExecutor(self, max_workers=max_workers, pool=pool, timeout=timeout)
+
+    def run_many(self, calls, priority: int = 0, max_workers: int = 4, pool: str = 'thread') -> list:
+        """Queue many calls at once and return their results in order
+
+        ``calls`` holds ``(name, func)``, ``(name, func, args)`` or
+        ``(name, func, args, kwargs)`` tuples. The first exception raised by
+        a call is re-raised once all calls have finished.
+        """
+        with self.executor(max_workers=max_workers, pool=pool) as executor:
+            futures = []
+            for call in calls:
+                name, func, *rest = call
+                args = rest[0] if rest else ()
+                kwargs = rest[1] if len(rest) > 1 else {}
+                futures.append(executor.submit(name, func, *args, priority=priority, **kwargs))
+        return [future.result() for future in futures]
+
+    def _require_http(self, feature: str):
+        if self._unix:
+            raise RuntimeError(f'{feature} is not available over a unix socket')
+
+    def submit(self, name: str, payload: bytes, priority: int = 0, tags: Optional[list] = None) -> dict:
+        """Queue a job whose payload will be processed by a remote worker"""
+        self._require_http('Job submission')
+        body = {
+            'name': name,
+            'priority': priority,
+            'payload': base64.b64encode(payload).decode('ascii')
+        }
+        if tags:
+            body['tags'] = list(tags)
+        response = self._request('POST', '/queue', json=body)
+        return response.json()
+
+    def claim(self, count: int = 1, worker: Optional[str] = None, wait: float = 0) -> list:
+        """Claim up to ``count`` jobs, waiting up to ``wait`` seconds for one
+
+        Returns a list of dicts with name, payload (bytes) and priority.
+        """
+        self._require_http('Job claiming')
+        response = self._request('POST', '/queue/claim',
+                                 json={'count': count, 'worker': worker, 'wait': wait},
+                                 timeout=wait + 10)
+        jobs = response.json()['jobs']
+        for job in jobs:
+            job['payload'] = base64.b64decode(job['payload'])
+        return jobs
+
+    def report_result(self, name: str, result: Optional[bytes] = None, error: Optional[str] = None):
+        """Report a claimed job as completed, or as failed when ``error`` is set"""
+        self._require_http('Job reporting')
+        body = {'status': 'failed' if error is not None else 'completed', 'error': error}
+        if result is not None:
+            body['result'] = base64.b64encode(result).decode('ascii')
+        self._request('POST', f'/jobs/{name}/result', json=body)
+
+    def update_priority(self, name: str, priority: int) -> Optional[dict]:
+        """Change a queued task's priority; returns its new position, or None if not queued"""
+        self._require_http('Reprioritization')
+        response = self._request('PATCH', f'/queue/{name}', json={'priority': priority}, raise_for_status=False)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def cancel_matching(self, tag: Optional[str] = None, prefix: Optional[str] = None) -> list:
+        """Remove every queued task with ``tag`` and/or a name starting with ``prefix``"""
+        return self._bulk({'action': 'remove', 'tag': tag, 'prefix': prefix})
+
+    def reprioritize_matching(self, priority: int, tag: Optional[str] = None, prefix: Optional[str] = None) -> list:
+        """Set the priority of every queued task with ``tag`` and/or name ``prefix``"""
+        return self._bulk({'action': 'reprioritize', 'priority': priority, 'tag': tag, 'prefix': prefix})
+
+    def _bulk(self, body: dict) -> list:
+        self._require_http('Bulk updates')
+        response = self._request('POST', '/queue/bulk', json=body)
+        return response.json()['tasks']
+
+    def get_job(self, name: str) -> Optional[dict]:
+        """Get a job's status and, once it has finished, its result as bytes"""
+        self._require_http('Job status')
+        response = self._request('GET', f'/jobs/{name}', raise_for_status=False)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        job = response.json()
+        if job.get('result') is not None:
+            job['result'] = base64.b64decode(job['result'])
+        return job
+
+    def save_snapshot(self, fileobj) -> int:
+        """Write a point-in-time snapshot of the queue to a binary file, returning its size"""
+        self._require_http('Snapshots')
+        written = 0
+        with self._request('GET', '/admin/snapshot', stream=True) as response:
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                fileobj.write(chunk)
+                written += len(chunk)
+        return written
+
+    def restore_snapshot(self, fileobj) -> dict:
+        """Replace the queue with a snapshot read from a binary file"""
+        self._require_http('Snapshots')
+        # Restoring a large queue outlasts the default timeout
+        response = self._request('POST', '/admin/restore', data=fileobj, timeout=None)
+        return response.json()
+
+
+class QueueExecutor:
+    """Run many queued calls of one process behind a single coordinator
+
+    Each ``submit`` joins the queue and returns a ``concurrent.futures.Future``.
+    A background thread checks the positions of all pending tasks with one
+    request per tick and hands each call to a thread or process pool once
+    its task reaches the head, instead of every call polling on its own
+    thread as ``queue_decorator`` does.
+    """
+
+    def __init__(self, client: QueueClient, max_workers: int = 4, pool: str = 'thread',
+                 timeout: Optional[float] = None):
+        if pool not in ('thread', 'process'):
+            raise ValueError("pool must be 'thread' or 'process'")
+        self.client = client
+        self.timeout = client.timeout if timeout is None else timeout
+        executor_class = ProcessPoolExecutor if pool == 'process' else ThreadPoolExecutor
+        self._pool = executor_class(max_workers=max_workers)
+        self._pending = {}
+        self._running = {}
+        self._changed = threading.Condition()
+        self._shutdown = False
+        self._coordinator = threading.Thread(target=self._coordinate, name='queue-executor', daemon=True)
+        self._coordinator.start()
+
+    def submit(self, name: str, func: Callable, *args, priority: int = 0, **kwargs) -> Future:
+        """Queue ``func(*args, **kwargs)`` as task ``name``
+
+        ``priority`` is consumed here and not passed on to ``func``.
+        """
+        with self._changed:
+            if self._shutdown:
+                raise RuntimeError('Cannot submit after shutdown')
+            if name in self._pending or name in self._running:
+                raise ValueError(f'Task {name} is already pending')
+
+        data = self.client._join(name, priority)
+        logger.debug('%s joined queue at position %s', name, data['position'])
+
+        future = Future()
+        with self._changed:
+            self._pending[name] = (future, func, args, kwargs, time.time() + self.timeout)
+            self._changed.notify_all()
+        return future
+
+    def _coordinate(self):
+        hints = {}
+        while True:
+            with self._changed:
+                while not self._pending and not self._running and not self._shutdown:
+                    self._changed.wait()
+                if not self._pending and not self._running:
+                    return
+                # Running tasks are polled too, as heartbeats
+                names = list(self._pending) + list(self._running)
+                waiting = bool(self._pending)
+
+            try:
+                hints = self.client._positions(names)
+                self._dispatch(hints['positions'])
+            except requests.RequestException as e:
+                logger.warning(f'Error checking positions: {e}')
+
+            with self._changed:
+                # A finished call frees the head, so check again right away
+                if waiting:
+                    self._changed.wait(self.client._next_poll_delay(hints))
+                else:
+                    self._changed.wait(self.client._heartbeat_interval({}))
+
+    def _dispatch(self, positions: dict):
+        now = time.time()
+        for name, position in positions.items():
+            with self._changed:
+                entry = self._pending.get(name)
+                if entry is None or (position > 1 and now <= entry[4]):
+                    continue
+                del self._pending[name]
+                if position == 1:
+                    self._running[name] = entry[0]
+            future, func, args, kwargs, _ = entry
+
+            if position == -1:
+                future.set_exception(RuntimeError(f'Task {name} was removed from queue'))
+            elif position != 1:
+                self.client._remove_from_queue(name)
+                future.set_exception(TimeoutError(f'Task {name} timed out after {self.timeout} seconds'))
+            else:
+                logger.debug('%s is now running', name)
+                try:
+                    pool_future = self._pool.submit(func, *args, **kwargs)
+                except Exception as e:
+                    self._finished(name, future, None, e)
+                    continue
+                pool_future.add_done_callback(lambda f, name=name, future=future: self._finished(name, future, f))
+
+    def _finished(self, name: str, future: Future, pool_future, error: Optional[BaseException] = None):
+        """Complete the head task on the server and resolve its future"""
+        if pool_future is not None:
+            error = pool_future.exception()
+        try:
+            self.client._notify_completion(name)
+        except requests.RequestException as e:
+            logger.warning(f'Failed to notify completion: {e}')
+
+        if error is None:
+            logger.debug('%s completed successfully', name)
+            future.set_result(pool_future.result())
+        else:
+            logger.error(f'{name} encountered an error: {error}')
+            future.set_exception(error)
+
+        with self._changed:
+            self._running.pop(name, None)
+            self._changed.notify_all()
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting calls; with ``wait`` block until every call finished"""
+        with self._changed:
+            self._shutdown = True
+            self._changed.notify_all()
+        if wait:
+            self._coordinator.join()
+        self._pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown(wait=True)
+        return False
+
+
+class QueueWorker:
+    """Claim jobs from a queue server and run them in a local pool
+
+    ``handler`` receives a job's payload bytes and returns its result as
+    bytes, str (sent as UTF-8) or None. An exception, or any other return
+    type, reports the job as failed. With ``pool='process'`` the handler must
+    be picklable, i.e. a module-level function.
+    """
+
+    def __init__(self,
+                 client: QueueClient,
+                 handler: Callable[[bytes], Any],
+                 max_workers: int = 4,
+                 pool: str = 'thread',
+                 batch_size: Optional[int] = None,
+                 worker_id: Optional[str] = None,
+                 wait: float = 5):
+        if pool not in ('thread', 'process'):
+            raise ValueError("pool must be 'thread' or 'process'")
+        self.client = client
+        self.handler = handler
+        self.max_workers = max_workers
+        self.pool = pool
+        self.batch_size = batch_size or max_workers
+        self.worker_id = worker_id or f'{socket.gethostname()}-{id(self):x}'
+        self.wait = wait
+        self.running = False
+        self.thread = None
+        self._executor = None
+        self._in_flight = 0
+        self._slots = threading.Condition()
+
+    def _finished(self, name: str, future):
+        """Report a finished job back to the server and free its slot"""
+        try:
+            result = future.result()
+            if result is None:
+                result = b''
+            elif isinstance(result, str):
+                result = result.encode('utf-8')
+            if isinstance(result, bytes):
+                self.client.report_result(name, result)
+            else:
+                self.client.report_result(name, error=f'Handler returned {type(result).__name__}, expected bytes')
+        except requests.RequestException as e:
+            # The job's lease expires and the server queues it again
+            logger.warning(f'Failed to report result of {name}: {e}')
+        except Exception as e:
+            logger.error(f'Job {name} failed: {e}')
+            try:
+                self.client.report_result(name, error=str(e) or type(e).__name__)
+            except requests.RequestException as report_error:
+                logger.warning(f'Failed to report failure of {name}: {report_error}')
+        finally:
+            with self._slots:
+                self._in_flight -= 1
+                self._slots.notify_all()
+
+    def run(self):
+        """Claim and run jobs until stopped"""
+        self.running = True
+        self._loop()
+
+    def _loop(self):
+        executor_class = ProcessPoolExecutor if self.pool == 'process' else ThreadPoolExecutor
+        self._executor = executor_class(max_workers=self.max_workers)
+        logger.info(f'Worker {self.worker_id} started with {self.max_workers} {self.pool}s')
+        try:
+            while self.running:
+                with self._slots:
+                    self._slots.wait_for(lambda: self._in_flight < self.max_workers or not self.running)
+                    free = self.max_workers - self._in_flight
+                if not self.running:
+                    break
+
+                try:
+                    jobs = self.client.claim(min(free, self.batch_size), self.worker_id, self.wait)
+                except requests.RequestException as e:
+                    logger.warning(f'Failed to claim jobs: {e}')
+                    time.sleep(min(self.wait, 1) or 1)
+                    continue
+
+                for job in jobs:
+                    with self._slots:
+                        self._in_flight += 1
+                    future = self._executor.submit(self.handler, job['payload'])
+                    future.add_done_callback(lambda f, name=job['name']: self._finished(name, f))
+        finally:
+            self._executor.shutdown(wait=True)
+            logger.info(f'Worker {self.worker_id} stopped')
+
+    def start(self):
+        """Run the worker in a background thread"""
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, name='queue-worker', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop claiming jobs and wait for running ones to be reported"""
+        self.running = False
+        with self._slots:
+            self._slots.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+
+
+class ShardedQueueClient:
+    """Route each named queue straight to the cluster node that owns it
+
+    Owners are looked up once per queue via any node and cached; when queues
+    move after a membership change, the per-queue clients follow the 421
+    redirect from the old owner.
+    """
+
+    def __init__(self, nodes: list, api_key: Optional[str] = None, **client_kwargs):
+        self.nodes = [node.rstrip('/') for node in nodes]
+        self.api_key = api_key
+        self.client_kwargs = client_kwargs
+        self.headers = {'X-API-Key': api_key} if api_key else {}
+        self._clients = {}
+
+    def _lookup_owner(self, queue: str) -> str:
+        last_error = None
+        for node in self.nodes:
+            try:
+                response = requests.get(f'{node}/cluster/owner/{queue}', headers=self.headers, timeout=10)
+                response.raise_for_status()
+                return response.json()['owner'] or node
+            except requests.RequestException as e:
+                last_error = e
+        raise requests.ConnectionError(f'No cluster node reachable: {last_error}')
+
+    def client_for(self, queue: str) -> QueueClient:
+        """Return a QueueClient bound to the node that owns ``queue``"""
+        client = self._clients.get(queue)
+        if client is None:
+            owner = self._lookup_owner(queue)
+            client = QueueClient(owner, api_key=self.api_key, queue=queue, **self.client_kwargs)
+            self._clients[queue] = client
+        return client
+
+    def queue_decorator(self, queue: str, name: str, priority: int = 0, max_retries: int = 3,
+                        tags: Optional[list] = None):
+        """Decorator to queue function execution on a named queue
+
+        The owning node is resolved on the first call, not at decoration time.
+        """
+        def decorator(func: Callable) -> Callable:
+            @wraps(func)
+            def wrapper(*args, **kwargs) -> Any:
+                queued = self.client_for(queue).queue_decorator(name, priority, max_retries, tags)(func)
+                return queued(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+class InProcessQueueClient(QueueClient):
+    """QueueClient backed by a queue engine in this process, without HTTP
+
+    Has the same API as QueueClient, so ``queue_decorator``, ``run_many``,
+    ``QueueWorker`` and job submission work unchanged. Waiting for a turn
+    blocks on the engine's condition variable instead of polling. Clients
+    created without a ``service`` share one in-memory queue per process.
+    """
+
+    _shared_service = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, service=None, queue: Optional[str] = None, timeout: int = 3600,
+                 max_poll_interval: float = 60, **kwargs):
+        super().__init__('inprocess://', queue=queue, timeout=timeout,
+                         max_poll_interval=max_poll_interval, **kwargs)
+        self.service = service
+
+    @property
+    def _service(self):
+        if self.service is None:
+            with InProcessQueueClient._shared_lock:
+                if InProcessQueueClient._shared_service is None:
+                    from app.embedded import QueueService
+                    InProcessQueueClient._shared_service = QueueService()
+                self.service = InProcessQueueClient._shared_service
+        return self.service
+
+    def _join(self, name: str, priority: int, idempotency_key: Optional[str] = None,
+              tags: Optional[list] = None) -> dict:
+        return self._service.join(self.queue, name, priority, idempotency_key=idempotency_key, tags=tags)
+
+    def _await_position(self, name: str, data: dict, remaining: float) -> dict:
+        wait_timeout = max(0.0, min(remaining, self.max_poll_interval))
+        return self._service.wait(self.queue, name, wait_timeout)
+
+    def _positions(self, names: list) -> dict:
+        return self._service.positions(self.queue, names)
+
+    def _notify_completion(self, name: str):
+        self._service.next(self.queue, name)
+
+    def _remove_from_queue(self, name: str):
+        self._service.remove(self.queue, name)
+
+    def _require_http(self, feature: str):
+        pass
+
+    def get_queue_status(self) -> dict:
+        return self._service.list_tasks(self.queue)
+
+    def get_metrics(self) -> dict:
+        return self._service.metrics(self.queue)
+
+    def health_check(self) -> bool:
+        try:
+            self._service.position(self.queue, '')
+            return True
+        except Exception:
+            return False
+
+    def submit(self, name: str, payload: bytes, priority: int = 0, tags: Optional[list] = None) -> dict:
+        return self._service.join(self.queue, name, priority, payload, tags=tags)
+
+    def claim(self, count: int = 1, worker: Optional[str] = None, wait: float = 0) -> list:
+        return self._service.claim(self.queue, count, worker, wait)
+
+    def report_result(self, name: str, result: Optional[bytes] = None, error: Optional[str] = None):
+        status = 'failed' if error is not None else 'completed'
+        self._service.report(self.queue, name, status, result, error)
+
+    def update_priority(self, name: str, priority: int) -> Optional[dict]:
+        return self._service.update(self.queue, name, priority)
+
+    def _bulk(self, body: dict) -> list:
+        if body['action'] == 'remove':
+            return self._service.remove_matching(self.queue, body['tag'], body['prefix'])
+        return self._service.reprioritize_matching(self.queue, body['priority'], body['tag'], body['prefix'])
+
+    def get_job(self, name: str) -> Optional[dict]:
+        return self._service.job(self.queue, name)
+
+    def save_snapshot(self, fileobj) -> int:
+        data = self._service.snapshot(self.queue)
+        fileobj.write(data)
+        return len(data)
+
+    def restore_snapshot(self, fileobj) -> dict:
+        return self._service.restore(self.queue, fileobj.read())
+
+
+class MultiprocessQueueClient(InProcessQueueClient):
+    """InProcessQueueClient sharing one queue between processes on a host
+
+    The queue lives in a manager process (see app.embedded.QueueManager);
+    calls are forwarded over a local connection and waits block in the
+    manager. The client pickles, so it can be handed to child processes,
+    which reconnect on first use.
+
+        client = MultiprocessQueueClient.start()
+        multiprocessing.Process(target=work, args=(client,)).start()
+    """
+
+    def __init__(self, address, authkey: bytes, queue: Optional[str] = None, **kwargs):
+        super().__init__(queue=queue, **kwargs)
+        self.address = address
+        self.authkey = authkey
+        self.manager = None
+        self._connection = None
+
+    @classmethod
+    def start(cls, queue: Optional[str] = None, **kwargs) -> 'MultiprocessQueueClient':
+        """Start a manager process and return a client connected to it"""
+        import multiprocessing
+        from app.embedded import start_manager
+        authkey = bytes(multiprocessing.current_process().authkey)
+        manager = start_manager(authkey=authkey)
+        client = cls(manager.address, authkey, queue=queue, **kwargs)
+        client.manager = manager
+        return client
+
+    @property
+    def _service(self):
+        # Proxies cannot be shared across processes, so connect once per pid
+        pid = os.getpid()
+        if self._connection is None or self._connection[0] != pid:
+            from app.embedded import QueueManager
+            manager = QueueManager(address=self.address, authkey=self.authkey)
+            manager.connect()
+            self._connection = (pid, manager.service())
+        return self._connection[1]
+
+    def shutdown(self):
+        """Stop the manager process if this client started it"""
+        if self.manager is not None:
+            self.manager.shutdown()
+            self.manager = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['manager'] = None
+        state['_connection'] = None
+        return state
+
 
 # Default client instance
 QUEUE_SERVER_URL = 'http://127.0.0.1:5000'
@@ -190,6 +933,8 @@ def queue_decorator(name: str, priority: int = 0):
 
 # Example usage
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
     # Create a client
     client = QueueClient('http://127.0.0.1:5000')
 
@@ -0,0 +1,56 @@
+import pytest
+import os
+import socket
+import subprocess
+import sys
+import time
+import requests
+from app import app
+from app.config import TestingConfig
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def client():
+    app.config.from_object(TestingConfig)
+    with app.test_client() as client:
+        # Queue state is module-global, start every test from an empty queue
+        client.post('/queue/clear')
+        yield client
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def server_node(tmp_path):
+    """Start queue server processes on localhost, killed after the test
+
+    Usage: ``process, url = server_node(port=None, **env)``
+    """
+    processes = []
+
+    def start(port=None, **env):
+        port = port or free_port()
+        node_env = dict(os.environ, DATABASE_PATH=str(tmp_path / f'node_{port}.db'), **env)
+        process = subprocess.Popen(
+            [sys.executable, '-c', f'from app import app; app.run(port={port}, threaded=True)'],
+            cwd=REPO_ROOT, env=node_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        processes.append(process)
+        url = f'http://127.0.0.1:{port}'
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            try:
+                requests.get(f'{url}/health', timeout=1)
+                return process, url
+            except requests.RequestException:
+                time.sleep(0.1)
+        pytest.fail(f'Node on port {port} did not start')
+
+    yield start
+
+    for process in processes:
+        process.kill()
+        process.wait()
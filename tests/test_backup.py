@@ -0,0 +1,129 @@
+import gzip
+import io
+import json
+import pytest
+from app.backup import SnapshotFormatError, dump_lines, load_lines
+from app.engine import QueueEngine
+from app.replication import MutationJournal, JournalTruncatedError
+from queue_enhanced import InProcessQueueClient
+
+def sample_engine():
+    engine = QueueEngine(journal=MutationJournal())
+    engine.join('a', tags=['batch'])
+    engine.join('b', priority=5, payload=b'payload')
+    engine.join('c', payload=b'job')
+    engine.claim(1, 'w1')  # claims b
+    return engine
+
+def test_snapshot_round_trip():
+    """Test that a dump restores queued tasks, payloads and claimed jobs"""
+    engine = sample_engine()
+    data = b''.join(dump_lines(engine.export_view(), 'default'))
+    header, *tasks = data.splitlines()
+    assert json.loads(header)['tasks'] == 2 and len(tasks) == 3
+
+    restored = QueueEngine()
+    restored.restore(load_lines(io.BytesIO(data)))
+    assert restored.queue == ['a', 'c']
+    assert restored.task_payloads == {'b': b'payload', 'c': b'job'}
+    assert restored.job('b')['worker'] == 'w1'
+    assert restored.select(tag='batch') == ['a']
+    assert restored.metrics['total_tasks'] == 3
+
+def test_export_view_is_point_in_time():
+    """Test that writes after the view is taken do not change the dump"""
+    engine = sample_engine()
+    view = engine.export_view()
+    engine.join('d')
+    engine.next()
+
+    state = load_lines(io.BytesIO(b''.join(dump_lines(view, 'default'))))
+    assert state['queue'] == ['a', 'c']
+
+def test_truncated_and_invalid_snapshots_are_rejected():
+    """Test that restores fail on incomplete or foreign input"""
+    data = b''.join(dump_lines(sample_engine().export_view(), 'default'))
+    with pytest.raises(SnapshotFormatError):
+        load_lines(io.BytesIO(data.rsplit(b'\n', 2)[0]))
+    with pytest.raises(SnapshotFormatError):
+        load_lines(io.BytesIO(b'{"format": "other"}\n'))
+    with pytest.raises(SnapshotFormatError):
+        load_lines(io.BytesIO(data.splitlines()[0] + b'\n{not json\n'))
+
+def test_inconsistent_snapshots_are_rejected_before_loading():
+    """Test each rejected inconsistency, and that a failed load changes nothing"""
+    def snapshot(*tasks):
+        claimed = sum(len(task) > 3 for task in tasks)
+        header = {'format': 'queue-snapshot', 'version': 1, 'tasks': len(tasks) - claimed, 'claimed': claimed}
+        return io.BytesIO(b'\n'.join(json.dumps(line).encode() for line in (header, *tasks)))
+
+    claim = {'worker': 'w1', 'claimed_at': 0}
+    for tasks in ([['a', {}, None], ['a', {}, None]],
+                  [['a', {}, None], ['a', {}, None, claim]],
+                  [['a', 'priority 5', None]],
+                  [['a', {'priority': '5'}, None]],
+                  [['a', {'priority': True}, None]],
+                  [['a', {'ttl': 'abc'}, None]],
+                  [['a', {'ttl': -1}, None]],
+                  [['a', {'tags': 5}, None]],
+                  [['a', {'tags': ['']}, None]],
+                  [['a', {'timestamp': 'now'}, None]],
+                  [['a', {}, None, 'w1']]):
+        with pytest.raises(SnapshotFormatError):
+            load_lines(snapshot(*tasks))
+
+    engine = sample_engine()
+    state = engine.export_state()
+    state['queue'].append('b')
+    with pytest.raises(SnapshotFormatError):
+        engine.load_state(state)
+    state['queue'].pop()
+    state['metadata']['a'] = {**state['metadata']['a'], 'ttl': 'abc'}
+    with pytest.raises(SnapshotFormatError):
+        engine.load_state(state)
+    state['metadata']['a'] = {**state['metadata']['a'], 'ttl': 60}
+    state['payloads']['a'] = 'not base64!'
+    with pytest.raises(ValueError):
+        engine.load_state(state)
+    assert engine.queue == ['a', 'c'] and list(engine.claimed) == ['b']
+    assert engine.snapshot.queue == ('a', 'c')
+    assert engine.task_payloads == {'b': b'payload', 'c': b'job'}
+
+def test_restore_restarts_journal():
+    """Test that followers are sent to bootstrap after a restore"""
+    engine = sample_engine()
+    last_seq = engine.journal.last_seq
+    engine.restore(load_lines(io.BytesIO(b''.join(dump_lines(engine.export_view(), 'default')))))
+    with pytest.raises(JournalTruncatedError):
+        engine.journal.since(last_seq)
+
+def test_snapshot_endpoints(client):
+    """Test streaming a gzipped snapshot out and restoring it over HTTP"""
+    client.post('/queue', json={'name': 'first'})
+    client.post('/queue', json={'name': 'second', 'priority': 3})
+
+    response = client.get('/admin/snapshot', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    snapshot = response.data
+    assert len(gzip.decompress(snapshot).splitlines()) == 3
+
+    client.post('/queue/clear')
+    response = client.post('/admin/restore?queue=copy', data=snapshot, headers={'Content-Encoding': 'gzip'})
+    assert json.loads(response.data) == {'queue': 'copy', 'restored': 2, 'claimed': 0}
+    listed = json.loads(client.get('/queue/list?queue=copy').data)
+    assert [task['name'] for task in listed['queue']] == ['second', 'first']
+
+    assert client.post('/admin/restore', data=b'garbage').status_code == 400
+    assert client.post('/admin/restore', data=b'garbage', headers={'Content-Encoding': 'gzip'}).status_code == 400
+
+def test_in_process_client_snapshots():
+    """Test saving and restoring through the in-process client"""
+    source = InProcessQueueClient(queue='snapshot_source')
+    source._service.join('snapshot_source', 'task')
+    buffer = io.BytesIO()
+    assert source.save_snapshot(buffer) == len(buffer.getvalue())
+
+    buffer.seek(0)
+    target = InProcessQueueClient(queue='snapshot_target')
+    assert target.restore_snapshot(buffer)['restored'] == 1
+    assert target.get_queue_status()['total'] == 1
@@ -0,0 +1,86 @@
+import json
+from app.engine import QueueEngine
+from app.replication import MutationJournal
+
+def test_update_priority_keeps_join_order():
+    """Test that a reprioritized task keeps its join time among equals"""
+    engine = QueueEngine()
+    engine.join('a')
+    engine.join('b', priority=5)
+    engine.join('c', priority=5)
+
+    assert engine.update('a', 5)['position'] == 1
+    assert engine.queue == ['a', 'b', 'c']
+    assert engine.update('b', 0)['position'] == 3
+    assert engine.update('missing', 1) is None
+
+def test_update_moves_only_the_affected_range():
+    """Test that a single reprioritized task is moved without re-sorting the queue"""
+    engine = QueueEngine()
+    for name in ('a', 'b', 'c', 'd', 'e'):
+        engine.join(name)
+    engine._reorder_by_priority = None  # a full sort would fail
+
+    assert engine.update('d', 5)['position'] == 1
+    assert engine.queue == ['d', 'a', 'b', 'c', 'e']
+    assert engine.update('d', 0)['position'] == 4
+    assert engine.update('a', -1)['position'] == 5
+    assert engine.queue == ['b', 'c', 'd', 'e', 'a']
+    assert [engine.queue_position[name] for name in engine.queue] == [1, 2, 3, 4, 5]
+
+def test_bulk_operations_by_tag_and_prefix():
+    """Test bulk cancel and reprioritize through the tag index"""
+    engine = QueueEngine()
+    for i in range(5):
+        engine.join(f'tenant_a.{i}', tags=['tenant:a', 'batch:1' if i < 3 else 'batch:2'])
+        engine.join(f'tenant_b.{i}', tags=['tenant:b'])
+
+    moved = engine.reprioritize_matching(10, tag='tenant:b')
+    assert len(moved) == 5
+    assert engine.queue[:5] == [f'tenant_b.{i}' for i in range(5)]
+
+    removed = engine.remove_matching(tag='batch:1')
+    assert sorted(removed) == ['tenant_a.0', 'tenant_a.1', 'tenant_a.2']
+    assert engine.size() == 7
+    assert [engine.position(name)['position'] for name in engine.queue] == list(range(1, 8))
+    assert 'batch:1' not in engine.tag_index
+
+    assert sorted(engine.remove_matching(prefix='tenant_a.')) == ['tenant_a.3', 'tenant_a.4']
+    assert engine.select(tag='tenant:a') == []
+    assert engine.remove_matching(tag='unknown') == []
+
+def test_bulk_operations_replicate():
+    """Test that followers replay bulk operations to the same state"""
+    primary = QueueEngine(journal=MutationJournal())
+    follower = QueueEngine(journal=MutationJournal())
+    for i in range(6):
+        primary.join(f'task_{i}', tags=['even' if i % 2 == 0 else 'odd'])
+    primary.reprioritize_matching(3, tag='odd')
+    primary.remove_matching(tag='even')
+    primary.update('task_5', 7)
+
+    entries, _ = primary.journal.since(0)
+    for seq, op in entries:
+        follower.apply(op, seq)
+    assert follower.queue == primary.queue == ['task_5', 'task_1', 'task_3']
+    assert follower.tag_index == primary.tag_index
+
+def test_patch_and_bulk_endpoints(client):
+    """Test reprioritizing and bulk updates over HTTP"""
+    client.post('/queue', json={'name': 'first'})
+    client.post('/queue', json={'name': 'second', 'tags': ['batch']})
+    client.post('/queue', json={'name': 'third', 'tags': ['batch']})
+
+    response = client.patch('/queue/third', json={'priority': 9})
+    assert json.loads(response.data)['position'] == 1
+    assert client.patch('/queue/third', json={'priority': 'high'}).status_code == 400
+    assert client.patch('/queue/missing', json={'priority': 1}).status_code == 404
+    assert client.post('/queue', json={'name': 'bad', 'tags': 'batch'}).status_code == 400
+
+    response = client.post('/queue/bulk', json={'action': 'remove', 'tag': 'batch'})
+    data = json.loads(response.data)
+    assert data['affected'] == 2
+    assert data['queue_size'] == 1
+
+    assert client.post('/queue/bulk', json={'action': 'remove'}).status_code == 400
+    assert client.post('/queue/bulk', json={'action': 'explode', 'tag': 'batch'}).status_code == 400
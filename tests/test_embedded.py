@@ -0,0 +1,101 @@
+import multiprocessing
+import subprocess
+import sys
+import threading
+import time
+from conftest import REPO_ROOT
+from queue_enhanced import InProcessQueueClient, MultiprocessQueueClient, QueueWorker
+from app.embedded import QueueService
+
+def test_engine_import_has_no_server_side_effects(tmp_path):
+    """Test that embedding the engine does not create the Flask app or a database"""
+    code = ('import sys; import app.engine, app.embedded; '
+            'assert "flask" not in sys.modules and "app.server" not in sys.modules')
+    subprocess.run([sys.executable, '-c', code], cwd=tmp_path, check=True,
+                   env={'PYTHONPATH': REPO_ROOT})
+    assert list(tmp_path.iterdir()) == []
+
+def test_in_process_decorator_runs_tasks_one_at_a_time():
+    """Test the decorator against an in-process queue, woken without polling"""
+    client = InProcessQueueClient(QueueService(), poll_interval=30)
+    running = []
+    overlaps = []
+
+    def make_task(i):
+        @client.queue_decorator(f'task_{i}')
+        def task():
+            running.append(i)
+            overlaps.append(len(running) > 1)
+            time.sleep(0.01)
+            running.remove(i)
+            return i
+        return task
+
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(make_task(i)())) for i in range(8)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == list(range(8))
+    assert not any(overlaps)
+    assert time.time() - start < 5
+    assert client.get_queue_status()['total'] == 0
+    assert client.get_metrics()['metrics']['completed_tasks'] == 8
+
+def test_in_process_worker_and_run_many():
+    """Test job workers and run_many through the in-process client"""
+    client = InProcessQueueClient(QueueService(), queue='jobs')
+    client.submit('job', b'abc')
+    worker = QueueWorker(client, lambda payload: payload.upper(), wait=0.1).start()
+    deadline = time.time() + 5
+    while client.get_job('job')['status'] != 'completed' and time.time() < deadline:
+        time.sleep(0.01)
+    worker.stop()
+    assert client.get_job('job')['result'] == b'ABC'
+
+    assert client.run_many([('a', len, ('xy',)), ('b', len, ('xyz',))]) == [2, 3]
+
+def _exclusive_section(client, i, spans):
+    @client.queue_decorator(f'proc_task_{i}')
+    def task():
+        started = time.time()
+        time.sleep(0.05)
+        spans.put((started, time.time()))
+    task()
+
+def test_multiprocess_client_shares_one_queue():
+    """Test that decorated calls in several processes take turns"""
+    client = MultiprocessQueueClient.start()
+    try:
+        spans = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_exclusive_section, args=(client, i, spans))
+                     for i in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(20)
+            assert process.exitcode == 0
+
+        intervals = sorted(spans.get(timeout=1) for _ in processes)
+        for (_, end), (next_start, _) in zip(intervals, intervals[1:]):
+            assert next_start >= end
+        assert client.get_queue_status()['total'] == 0
+    finally:
+        client.shutdown()
+
+def test_manager_expires_abandoned_tasks():
+    """Test that a task whose client process died stops blocking the shared queue"""
+    client = MultiprocessQueueClient.start()
+    try:
+        service = client._service
+        service.join(None, 'head', 0, None, None, None, 0)
+        service.join(None, 'abandoned', 0, None, None, None, 1)
+        deadline = time.time() + 10
+        while client.get_queue_status()['total'] > 1 and time.time() < deadline:
+            time.sleep(0.2)
+        assert [task['name'] for task in client.get_queue_status()['queue']] == ['head']
+    finally:
+        client.shutdown()
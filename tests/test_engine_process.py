@@ -0,0 +1,169 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.shared_memory import SharedMemory
+import pytest
+import requests
+from app.engine import QueueEngine, QueueRegistry, IdempotencyConflictError
+from app.engine_process import (EngineClient, EngineServer, EngineUnavailableError, RemoteRegistry,
+                                ShmRing, FRAME_INLINE, _decode, _encode)
+from app.persistence import PersistenceLayer
+from app.replication import MutationJournal
+from conftest import REPO_ROOT
+
+@pytest.fixture
+def engine_server(tmp_path):
+    """Engine loop on a background thread, with a client connected to it"""
+    address = str(tmp_path / 'engine.sock')
+    server = EngineServer(QueueRegistry(None, MutationJournal()), address)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = EngineClient(address, ring_bytes=64 * 1024)
+    yield server, client
+    client.close()
+    server.shutdown()
+    thread.join(5)
+
+def test_ring_wraps_and_reports_full():
+    """Test that frames survive wrap-around and a full ring refuses writes"""
+    shm = SharedMemory(create=True, size=ShmRing.size(64))
+    ring = ShmRing(shm.buf, 64)
+    try:
+        assert ring.put(FRAME_INLINE, b'a' * 30) is True
+        assert ring.put(FRAME_INLINE, b'b' * 20) is False
+        assert ring.put(FRAME_INLINE, b'c' * 20) is None
+        assert ring.get_all() == [(FRAME_INLINE, b'a' * 30), (FRAME_INLINE, b'b' * 20)]
+
+        assert ring.put(FRAME_INLINE, b'c' * 40) is True
+        assert ring.get_all() == [(FRAME_INLINE, b'c' * 40)]
+        with pytest.raises(ValueError):
+            ring.put(FRAME_INLINE, b'd' * 64)
+    finally:
+        ring.release()
+        shm.close()
+        shm.unlink()
+
+def test_large_messages_spill_to_their_own_segment():
+    """Test that messages too large for a ring travel through a separate segment"""
+    message = {'payload': os.urandom(10000)}
+    kind, body = _encode(message, 1024)
+    assert kind != FRAME_INLINE and len(body) < 100
+    assert _decode(kind, body) == message
+
+def test_deferred_persistence_writes_once(tmp_path, monkeypatch):
+    """Test that a batch of mutations is saved in a single write"""
+    engine = QueueEngine(PersistenceLayer(str(tmp_path / 'queue.db')))
+    saves = []
+    original = engine.persistence.save_queue_state
+    monkeypatch.setattr(engine.persistence, 'save_queue_state',
+                        lambda *args: saves.append(args) or original(*args))
+
+    with engine.deferred_persistence():
+        for name in ('a', 'b', 'c'):
+            engine.join(name)
+        engine.remove('b')
+        assert saves == []
+    assert len(saves) == 1
+
+    restarted = QueueEngine(PersistenceLayer(str(tmp_path / 'queue.db')))
+    assert restarted.queue == ['a', 'c']
+
+def test_commands_run_in_engine_loop(engine_server):
+    """Test calls, errors, parked claims and journal reads through the rings"""
+    server, client = engine_server
+    registry = RemoteRegistry(client)
+    queue = registry.get('jobs')
+
+    assert queue.join('a', 0, None, 'key', None)['position'] == 1
+    assert queue.position('a')['position'] == 1
+    assert 'jobs' in registry.names()
+    assert registry.lookup('jobs').size() == 1
+    assert registry.lookup('ghost').position('a') is None and 'ghost' not in registry.names()
+    with pytest.raises(IdempotencyConflictError):
+        queue.join('b', 0, None, 'key', None)
+    with pytest.raises(AttributeError):
+        queue.lock
+
+    claimed = []
+    worker = threading.Thread(target=lambda: claimed.extend(queue.claim(1, 'w1', 5)))
+    worker.start()
+    time.sleep(0.2)
+    assert server.parked
+    queue.join('job', 0, b'payload', None, None)
+    worker.join(5)
+    assert claimed == [{'name': 'job', 'payload': b'payload', 'priority': 0}]
+
+    assert client.call(('journal', None), 'last_seq') == 3
+    with pytest.raises(ValueError):
+        client.call(('registry', None), 'set_read_only', True)
+
+def test_clients_must_authenticate(engine_server):
+    """Test that the engine generates a private key and rejects other clients"""
+    server, client = engine_server
+    assert os.stat(f'{server.address}.key').st_mode & 0o777 == 0o600
+    assert client.call(('registry', None), 'names') == ['default']
+    with pytest.raises(EngineUnavailableError):
+        EngineClient(server.address, authkey=b'wrong').call(('registry', None), 'names')
+
+def test_parked_calls_wait_for_a_change(engine_server):
+    """Test that a parked wait is only retried once some queue changed"""
+    server, client = engine_server
+    queue = RemoteRegistry(client).get()
+    queue.join('first', 0, None, None, None)
+    queue.join('second', 0, None, None, None)
+
+    engine = server.registry.get()
+    calls = []
+    wait = engine.wait
+    engine.wait = lambda *args: calls.append(args) or wait(*args)
+    positions = []
+    waiter = threading.Thread(target=lambda: positions.append(queue.wait('second', 5)))
+    waiter.start()
+    time.sleep(0.5)
+    assert len(calls) <= 2
+
+    queue.next('first')
+    waiter.join(5)
+    assert positions == [1]
+
+def test_concurrent_front_end_threads(engine_server):
+    """Test that many threads sharing one client get their own answers"""
+    _, client = engine_server
+    queue = RemoteRegistry(client).get()
+
+    def join_many(prefix):
+        for i in range(50):
+            assert queue.join(f'{prefix}_{i}', 0, None, None, None)['queue_size'] > 0
+
+    threads = [threading.Thread(target=join_many, args=(f't{n}',)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert queue.size() == 200
+
+def test_http_front_end_in_process_mode(server_node, tmp_path):
+    """Test serving the HTTP API from an engine process"""
+    address = str(tmp_path / 'engine.sock')
+    env = dict(os.environ, ENGINE_ADDRESS=address, DATABASE_PATH=str(tmp_path / 'engine.db'))
+    engine = subprocess.Popen([sys.executable, '-m', 'app.engine_process'], cwd=REPO_ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 10
+        while not os.path.exists(address) and time.time() < deadline:
+            time.sleep(0.05)
+
+        _, url = server_node(ENGINE_MODE='process', ENGINE_ADDRESS=address)
+        assert requests.post(f'{url}/queue', json={'name': 'remote', 'priority': 2}).status_code == 200
+        data = requests.get(f'{url}/queue/remote').json()
+        assert data['position'] == 1
+        assert requests.get(f'{url}/metrics').json()['metrics']['total_tasks'] == 1
+        listed = requests.get(f'{url}/queue/list').json()
+        assert [task['name'] for task in listed['queue']] == ['remote']
+        assert json.loads(requests.post(f'{url}/queue/next').text)['next'] == 'remote'
+    finally:
+        engine.terminate()
+        engine.wait(5)
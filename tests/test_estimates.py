@@ -0,0 +1,65 @@
+import json
+from app.estimator import RunTimeEstimator
+from queue_enhanced import QueueClient
+
+def test_estimator_without_history():
+    """Test that no estimate is given before any task completed"""
+    estimator = RunTimeEstimator()
+    assert estimator.estimate_wait(1, 'a', 0.0) == 0.0
+    assert estimator.estimate_wait(5, 'a', 0.0) is None
+    assert RunTimeEstimator.poll_delay(None, 0.5, 60) is None
+
+def test_estimator_ewma():
+    """Test EWMA averages per name and per queue"""
+    estimator = RunTimeEstimator(alpha=0.5)
+    estimator.mark_started('a', 0.0)
+    estimator.finish('a', 10.0)
+    estimator.mark_started('b', 10.0)
+    estimator.finish('b', 30.0)
+
+    assert estimator.expected_duration('a') == 10.0
+    assert estimator.expected_duration('b') == 20.0
+    assert estimator.queue_average == 15.0
+    assert estimator.expected_duration('unknown') == 15.0
+
+def test_estimator_wait_accounts_for_running_head():
+    """Test that elapsed head run time is subtracted from the estimate"""
+    estimator = RunTimeEstimator(alpha=1.0)
+    estimator.mark_started('a', 0.0)
+    estimator.finish('a', 10.0)
+
+    estimator.mark_started('a', 100.0)
+    # Head has 6s left, then two more tasks of ~10s each
+    assert estimator.estimate_wait(4, 'a', 104.0) == 26.0
+
+def test_cancelled_tasks_not_recorded():
+    """Test that removed tasks do not skew the averages"""
+    estimator = RunTimeEstimator()
+    estimator.mark_started('a', 0.0)
+    assert estimator.finish('a', 50.0, record=False) is None
+    assert estimator.queue_average is None
+
+def test_position_includes_eta(client):
+    """Test that position responses carry ETA and poll hints"""
+    client.post('/queue', json={'name': 'eta_1'})
+    client.post('/queue/next')
+    client.post('/queue', json={'name': 'eta_2'})
+    client.post('/queue', json={'name': 'eta_3'})
+
+    response = client.get('/queue/eta_3')
+    data = json.loads(response.data)
+    assert data['position'] == 2
+    assert data['estimated_wait'] is not None
+    assert data['estimated_start'] is not None
+    assert data['poll_after'] > 0
+
+def test_client_poll_delay():
+    """Test adaptive poll delay selection in the client"""
+    queue_client = QueueClient(poll_interval=5, min_poll_interval=1, max_poll_interval=30)
+    assert queue_client._next_poll_delay({}) == 5
+    assert queue_client._next_poll_delay({'poll_after': None}) == 5
+    assert queue_client._next_poll_delay({'poll_after': 0.1}) == 1
+    assert queue_client._next_poll_delay({'poll_after': 120}) == 30
+
+    fixed_client = QueueClient(poll_interval=5, adaptive_polling=False)
+    assert fixed_client._next_poll_delay({'poll_after': 120}) == 5
@@ -0,0 +1,54 @@
+import json
+import pytest
+import requests
+from queue_enhanced import QueueClient
+
+def test_positions_endpoint(client):
+    """Test looking up many positions in one request"""
+    client.post('/queue', json={'name': 'first'})
+    client.post('/queue', json={'name': 'second'})
+
+    response = client.post('/queue/positions', json={'names': ['first', 'second', 'missing']})
+    data = json.loads(response.data)
+    assert data['positions'] == {'first': 1, 'second': 2, 'missing': -1}
+    assert data['queue_size'] == 2
+    assert 'poll_after' in data
+
+    response = client.post('/queue/positions', json={'names': 'first'})
+    assert response.status_code == 400
+
+def _square(x):
+    return x * x
+
+def _fail():
+    raise ValueError('bad call')
+
+@pytest.mark.parametrize('pool', ['thread', 'process'])
+def test_run_many(server_node, pool):
+    """Test running many queued calls behind one coordinator"""
+    _, url = server_node(POLL_MIN_INTERVAL='0.05')
+    queue_client = QueueClient(url, poll_interval=0.05, min_poll_interval=0)
+
+    results = queue_client.run_many([(f'square_{i}', _square, (i,)) for i in range(20)], pool=pool)
+    assert results == [i * i for i in range(20)]
+    assert requests.get(f'{url}/queue/list').json()['total'] == 0
+
+def test_executor_futures(server_node):
+    """Test executor futures for failing, removed and successful calls"""
+    _, url = server_node(POLL_MIN_INTERVAL='0.05')
+    queue_client = QueueClient(url, poll_interval=0.05, min_poll_interval=0)
+
+    # Hold the head so the other calls stay queued
+    requests.post(f'{url}/queue', json={'name': 'blocker'})
+    with queue_client.executor() as executor:
+        failing = executor.submit('failing', _fail)
+        removed = executor.submit('removed', _square, 3)
+        kept = executor.submit('kept', _square, x=4)
+        requests.delete(f'{url}/queue/remove/removed')
+        requests.post(f'{url}/queue/next')
+
+    with pytest.raises(ValueError):
+        failing.result()
+    with pytest.raises(RuntimeError):
+        removed.result()
+    assert kept.result() == 16
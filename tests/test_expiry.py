@@ -0,0 +1,100 @@
+import threading
+import time
+from app.config import Config
+from app.embedded import QueueService
+from app.engine import QueueEngine
+from app.expiry import TimingWheel
+from app.replication import MutationJournal
+from queue_enhanced import InProcessQueueClient
+
+def test_timing_wheel_pops_due_keys():
+    """Test scheduling, rescheduling and deadlines more than one turn away"""
+    wheel = TimingWheel(tick=1.0, slots=4, now=100.0)
+    wheel.schedule('a', 101.5)
+    wheel.schedule('b', 102.0)
+    wheel.schedule('far', 109.5)
+    wheel.schedule('gone', 101.0)
+    wheel.remove('gone')
+
+    assert wheel.pop_due(101.2) == []
+    assert wheel.pop_due(101.6) == ['a']
+    wheel.schedule('b', 103.0)
+    assert wheel.pop_due(102.5) == []
+    assert wheel.pop_due(105.0) == ['b']
+    assert wheel.pop_due(109.0) == [] and len(wheel) == 1
+    assert wheel.pop_due(110.0) == ['far']
+
+def test_abandoned_tasks_expire_and_polled_tasks_stay():
+    """Test that only tasks whose clients stopped polling are dropped"""
+    engine = QueueEngine(journal=MutationJournal())
+    joined = time.monotonic()
+    engine.join('head', ttl=1)
+    engine.join('polled', ttl=1)
+    engine.join('abandoned', ttl=1)
+    engine.join('behind', ttl=0)
+    engine.join('job', payload=b'work', ttl=1)
+
+    time.sleep(0.3)
+    engine.position('polled')
+    assert engine.expire_tasks(now=joined + 1.15) == ['abandoned']
+    assert engine.queue == ['head', 'polled', 'behind', 'job']
+    assert engine.position('behind')['position'] == 3
+    entries, _ = engine.journal.since(0)
+    assert entries[-1][1]['op'] == 'remove_many' and entries[-1][1]['names'] == ['abandoned']
+
+    # The head has TASK_TIMEOUT to run; the polled task's deadline passes too
+    assert engine.expire_tasks(now=joined + 5) == ['polled']
+    assert engine.queue == ['head', 'behind', 'job']
+
+def test_expiry_skips_followers():
+    """Test that followers leave expiry to the primary and promotion restarts the TTLs"""
+    engine = QueueEngine()
+    joined = time.monotonic()
+    engine.join('head', ttl=1)
+    engine.join('waiting', ttl=1)
+    engine.set_read_only(True)
+    assert engine.expire_tasks(now=joined + 5) == []
+
+    # The follower never saw the clients' polls: they get a full TTL after promotion
+    time.sleep(0.3)
+    engine.set_read_only(False)
+    assert engine.expire_tasks(now=joined + 1.15) == []
+    assert engine.queue == ['head', 'waiting']
+    assert engine.expire_tasks(now=time.monotonic() + 5) == ['waiting']
+
+def test_running_task_survives_while_its_client_heartbeats(monkeypatch):
+    """Test that a call outlasting TASK_TIMEOUT is kept while its client heartbeats"""
+    monkeypatch.setattr(Config, 'TASK_TIMEOUT', 0)
+    monkeypatch.setattr(Config, 'TASK_HEARTBEAT_TTL', 0.4)
+    service = QueueService()
+    engine = service.registry.get()
+    assert engine.join('polled', ttl=8) and engine.estimate_start(1, 'polled')['poll_after'] <= 2
+    engine.remove('polled')
+
+    stop = threading.Event()
+    def reap():
+        while not stop.wait(0.05):
+            engine.expire_tasks()
+    reaper = threading.Thread(target=reap)
+    reaper.start()
+
+    client = InProcessQueueClient(service, max_poll_interval=0.1)
+
+    @client.queue_decorator('long_call')
+    def long_call():
+        time.sleep(1)
+        return engine.position('long_call')['position']
+
+    try:
+        assert long_call() == 1
+    finally:
+        stop.set()
+        reaper.join()
+    assert client.get_metrics()['metrics']['completed_tasks'] == 1
+
+def test_join_ttl_validation(client):
+    """Test that the join endpoint accepts only non-negative TTLs"""
+    assert client.post('/queue', json={'name': 'keep', 'ttl': 0}).status_code == 200
+    assert client.post('/queue', json={'name': 'short', 'ttl': 2.5}).status_code == 200
+    assert client.post('/queue', json={'name': 'bad', 'ttl': -1}).status_code == 400
+    assert client.post('/queue', json={'name': 'bad', 'ttl': 'soon'}).status_code == 400
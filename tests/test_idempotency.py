@@ -0,0 +1,58 @@
+import json
+import pytest
+from app.engine import QueueEngine, IdempotencyConflictError
+from app.idempotency import IdempotencyCache
+from app.replication import MutationJournal
+
+def test_cache_expiry_and_bound():
+    """Test that keys expire after the TTL and the cache stays bounded"""
+    cache = IdempotencyCache(ttl=10, max_entries=3)
+    cache.put('a', 'task_a', now=0)
+    cache.put('b', 'task_b', now=5)
+    assert cache.get('a', now=9) == 'task_a'
+    assert cache.get('a', now=11) is None
+    assert cache.get('b', now=11) == 'task_b'
+
+    for i in range(5):
+        cache.put(f'k{i}', f'task_{i}', now=12)
+    assert len(cache) == 3
+    assert cache.get('k0', now=12) is None
+    assert cache.get('k4', now=12) == 'task_4'
+
+def test_retried_join_is_not_queued_twice():
+    """Test that a join repeating its key reports the original task"""
+    engine = QueueEngine(journal=MutationJournal())
+    engine.join('task', idempotency_key='key-1')
+    engine.join('other')
+    seq = engine.journal.last_seq
+
+    result = engine.join('task', idempotency_key='key-1')
+    assert result['position'] == 1
+    assert result['duplicate']
+    assert engine.journal.last_seq == seq
+
+    # The task ran; a late retry must not queue it again
+    engine.next()
+    result = engine.join('task', idempotency_key='key-1')
+    assert result['position'] == -1
+    assert engine.queue == ['other']
+
+    # Without the key the name can be reused
+    assert engine.join('task')['position'] == 2
+
+    with pytest.raises(IdempotencyConflictError):
+        engine.join('different', idempotency_key='key-1')
+
+def test_idempotency_key_header(client):
+    """Test idempotent joins over HTTP"""
+    headers = {'Idempotency-Key': 'http-key'}
+    first = json.loads(client.post('/queue', json={'name': 'http_task'}, headers=headers).data)
+    client.post('/queue/next')
+
+    retry = json.loads(client.post('/queue', json={'name': 'http_task'}, headers=headers).data)
+    assert first['position'] == 1
+    assert retry['position'] == -1
+    assert retry['duplicate']
+
+    response = client.post('/queue', json={'name': 'other_task'}, headers=headers)
+    assert response.status_code == 409
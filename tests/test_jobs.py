@@ -0,0 +1,197 @@
+import base64
+import json
+import sqlite3
+import time
+import pytest
+from app.config import Config
+from app.engine import QueueEngine, PayloadTooLargeError, TaskClaimedError
+from app.persistence import PersistenceLayer
+from app.embedded import QueueService
+from queue_enhanced import InProcessQueueClient, QueueClient, QueueWorker
+
+def test_claim_and_report():
+    """Test that claimed jobs leave the queue and report their results"""
+    engine = QueueEngine()
+    engine.join('plain_task')
+    engine.join('job_a', payload=b'a')
+    engine.join('job_b', priority=5, payload=b'b')
+
+    jobs = engine.claim(5, 'worker-1')
+    assert [job['name'] for job in jobs] == ['job_b', 'job_a']
+    assert jobs[0]['payload'] == b'b'
+    assert engine.queue == ['plain_task']
+    assert engine.job('job_a')['status'] == 'running'
+
+    assert engine.report('job_a', 'completed', result=b'done')
+    assert engine.report('job_b', 'failed', error='boom')
+    assert not engine.report('job_a', 'completed')
+    assert engine.job('job_a')['result'] == b'done'
+    assert engine.job('job_b')['error'] == 'boom'
+    assert engine.claim(1, 'worker-1') == []
+
+def test_completion_leaves_jobs_queued():
+    """Test that finishing a decorated call never takes a job off the queue"""
+    engine = QueueEngine()
+    engine.join('call')
+    engine.join('job', priority=5, payload=b'x')
+    assert engine.next()[0] == 'call'
+    engine.join('other')
+    assert engine.next('job')[0] is None and engine.next('missing')[0] is None
+    assert engine.next('other')[0] == 'other'
+    assert engine.queue == ['job']
+
+    service = QueueService()
+    client = InProcessQueueClient(service)
+
+    @client.queue_decorator('call')
+    def call():
+        # A higher-priority job overtakes the running call
+        service.join(None, 'job', priority=5, payload=b'x')
+
+    call()
+    assert [task['name'] for task in service.list_tasks(None)['queue']] == ['job']
+    assert service.metrics(None)['metrics']['completed_tasks'] == 1
+
+def test_join_rejects_claimed_name(client):
+    """Test that a running job's name cannot be queued a second time"""
+    engine = QueueEngine()
+    engine.join('job', payload=b'x')
+    engine.claim(1, 'worker-1')
+    with pytest.raises(TaskClaimedError):
+        engine.join('job')
+    assert engine.queue == [] and engine.report('job', 'completed')
+    assert engine.join('job')['position'] == 1
+
+    payload = base64.b64encode(b'x').decode()
+    client.post('/queue', json={'name': 'busy', 'payload': payload})
+    client.post('/queue/claim', json={'worker': 'w'})
+    response = client.post('/queue', json={'name': 'busy'})
+    assert response.status_code == 409
+    assert client.get('/queue/list').get_json()['total'] == 0
+
+def test_payloads_are_written_once(tmp_path, monkeypatch):
+    """Test that state saves leave stored payloads alone until their job finishes"""
+    db_path = str(tmp_path / 'queue.db')
+    persistence = PersistenceLayer(db_path)
+    engine = QueueEngine(persistence)
+    engine.join('job_a', payload=b'a' * 1000)
+    engine.join('job_b', payload=b'b')
+
+    statements = []
+    connect = persistence._connect
+    def traced():
+        conn = connect()
+        conn.set_trace_callback(statements.append)
+        return conn
+    monkeypatch.setattr(persistence, '_connect', traced)
+    engine.join('plain_task')
+    engine.claim(1, 'worker-1')
+    assert not [sql for sql in statements if 'task_payloads' in sql]
+
+    engine.report('job_a', 'completed')
+    restarted = QueueEngine(PersistenceLayer(db_path))
+    assert restarted.task_payloads == {'job_b': b'b'}
+    conn = sqlite3.connect(db_path)
+    assert [row[0] for row in conn.execute('SELECT task_name FROM task_payloads')] == ['job_b']
+    conn.close()
+
+def test_payloads_move_out_of_legacy_state_rows(tmp_path):
+    """Test that payloads saved with the queue state by older versions are kept"""
+    db_path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        CREATE TABLE queue_state (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_name TEXT UNIQUE NOT NULL,
+            position INTEGER,
+            priority INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            metadata TEXT,
+            payload BLOB
+        )
+    ''')
+    conn.execute("INSERT INTO queue_state (task_name, position, metadata, payload) VALUES ('job', 1, '{}', x'01')")
+    conn.commit()
+    conn.close()
+
+    engine = QueueEngine(PersistenceLayer(db_path))
+    assert engine.task_payloads == {'job': b'\x01'}
+    engine.join('next')
+    assert QueueEngine(PersistenceLayer(db_path)).task_payloads == {'job': b'\x01'}
+
+def test_expired_lease_requeues_job(monkeypatch):
+    """Test that a job is queued again when its worker goes silent"""
+    engine = QueueEngine()
+    engine.join('job', payload=b'x')
+    engine.claim(1, 'worker-1')
+
+    monkeypatch.setattr(Config, 'JOB_LEASE_TIMEOUT', -1)
+    jobs = engine.claim(1, 'worker-2')
+    assert [job['name'] for job in jobs] == ['job']
+    assert engine.job('job')['worker'] == 'worker-2'
+
+def test_payload_size_limit(monkeypatch):
+    """Test that oversized payloads are rejected"""
+    monkeypatch.setattr(Config, 'MAX_PAYLOAD_BYTES', 4)
+    engine = QueueEngine()
+    with pytest.raises(PayloadTooLargeError):
+        engine.join('job', payload=b'too large')
+    assert engine.size() == 0
+
+def test_job_endpoints(client):
+    """Test submitting, claiming and reporting jobs over HTTP"""
+    payload = base64.b64encode(b'input').decode('ascii')
+    response = client.post('/queue', json={'name': 'http_job', 'payload': payload})
+    assert response.status_code == 200
+
+    response = client.post('/queue', json={'name': 'bad_job', 'payload': 'not base64!'})
+    assert response.status_code == 400
+
+    response = client.post('/queue/claim', json={'count': 10, 'worker': 'w1'})
+    jobs = json.loads(response.data)['jobs']
+    assert [job['name'] for job in jobs] == ['http_job']
+    assert base64.b64decode(jobs[0]['payload']) == b'input'
+
+    result = base64.b64encode(b'output').decode('ascii')
+    response = client.post('/jobs/http_job/result', json={'status': 'completed', 'result': result})
+    assert response.status_code == 200
+    response = client.post('/jobs/http_job/result', json={'status': 'completed'})
+    assert response.status_code == 404
+
+    data = json.loads(client.get('/jobs/http_job').data)
+    assert data['status'] == 'completed'
+    assert base64.b64decode(data['result']) == b'output'
+    assert client.get('/jobs/unknown_job').status_code == 404
+
+def _reverse(payload):
+    if payload == b'fail':
+        raise ValueError('bad input')
+    return payload[::-1]
+
+@pytest.mark.parametrize('pool', ['thread', 'process'])
+def test_worker_end_to_end(server_node, pool):
+    """Test a QueueWorker processing jobs submitted to a live server"""
+    _, url = server_node()
+    client = QueueClient(url)
+    for i in range(6):
+        client.submit(f'job_{i}', f'payload {i}'.encode())
+    client.submit('job_fail', b'fail')
+
+    worker = QueueWorker(QueueClient(url), _reverse, max_workers=2, pool=pool, wait=0.5).start()
+    try:
+        deadline = time.time() + 20
+        while time.time() < deadline:
+            jobs = [client.get_job(f'job_{i}') for i in range(6)] + [client.get_job('job_fail')]
+            if all(job['status'] in ('completed', 'failed') for job in jobs):
+                break
+            time.sleep(0.2)
+    finally:
+        worker.stop()
+
+    for i in range(6):
+        job = client.get_job(f'job_{i}')
+        assert job['status'] == 'completed'
+        assert job['result'] == f'payload {i}'.encode()[::-1]
+    failed = client.get_job('job_fail')
+    assert failed['status'] == 'failed'
+    assert 'bad input' in failed['error']
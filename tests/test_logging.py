@@ -0,0 +1,45 @@
+import io
+import json
+import logging
+import pytest
+from app.config import Config
+from app.logs import (configure_logging, flush_logging, log_event, parse_sample_rates,
+                      set_sample_rates)
+
+@pytest.fixture
+def log_stream():
+    stream = io.StringIO()
+    yield stream
+    configure_logging(Config.LOG_LEVEL, Config.LOG_FORMAT, Config.LOG_ASYNC,
+                      parse_sample_rates(Config.LOG_SAMPLE_RATES))
+
+def test_parse_sample_rates():
+    """Test parsing per-event sampling rates from configuration"""
+    assert parse_sample_rates('task_added=0.01, task_completed=0.5') == {'task_added': 0.01, 'task_completed': 0.5}
+    assert parse_sample_rates('') == {}
+
+def test_async_structured_logging(log_stream):
+    """Test that events are written with their fields by the background listener"""
+    configure_logging('INFO', 'text', async_logging=True, stream=log_stream)
+    logger = logging.getLogger('test.structured')
+    log_event(logger, logging.INFO, 'task_added', task='a', position=3)
+    log_event(logger, logging.DEBUG, 'task_polled', task='a')
+    flush_logging()
+
+    assert log_stream.getvalue() == 'INFO:test.structured:task_added task=a position=3\n'
+
+def test_json_logging_and_sampling(log_stream):
+    """Test JSON output and that sampling keeps every Nth event but all warnings"""
+    configure_logging('INFO', 'json', async_logging=False, stream=log_stream,
+                      sample_rates={'task_added': 0.25, 'task_removed': 0})
+    logger = logging.getLogger('test.sampling')
+    for i in range(8):
+        log_event(logger, logging.INFO, 'task_added', task=i)
+        log_event(logger, logging.INFO, 'task_removed', task=i)
+    log_event(logger, logging.WARNING, 'task_removed', task='kept')
+
+    entries = [json.loads(line) for line in log_stream.getvalue().splitlines()]
+    assert [(e['message'], e['task']) for e in entries] == [
+        ('task_added', 0), ('task_added', 4), ('task_removed', 'kept')
+    ]
+    set_sample_rates({})
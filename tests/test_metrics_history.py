@@ -0,0 +1,142 @@
+import json
+import sqlite3
+import subprocess
+import sys
+import time
+from app import persistence as persistence_module
+from app.persistence import PersistenceLayer
+from conftest import REPO_ROOT
+
+DAY = 86400
+
+def test_rollups_match_raw_events(tmp_path):
+    """Test that rollups aggregate events at every granularity"""
+    persistence = PersistenceLayer(str(tmp_path / 'metrics.db'), metrics_retention_days=10000)
+    start = 1700000000 // DAY * DAY
+    for i in range(120):
+        persistence.save_metric('run_time', i, recorded_at=start + i * 60)
+
+    minutes = persistence.query_metrics('run_time', start, start + DAY, 60)
+    assert len(minutes) == 120
+    assert minutes[5] == {'time': start + 300, 'count': 1, 'sum': 5, 'min': 5, 'max': 5, 'avg': 5}
+
+    hours = persistence.query_metrics('run_time', start, start + DAY, 3600)
+    assert [(p['count'], p['min'], p['max']) for p in hours] == [(60, 0, 59), (60, 60, 119)]
+
+    five_minutes = persistence.query_metrics('run_time', start, start + 3600, 300)
+    assert len(five_minutes) == 12
+    assert five_minutes[1]['avg'] == 7
+
+    days = persistence.query_metrics('run_time', start, start + DAY, DAY)
+    assert days[0]['count'] == 120
+    assert persistence.query_metrics('task_added', start, start + DAY, DAY) == []
+
+def test_backfill_from_raw_rows(tmp_path):
+    """Test that databases from before rollups are backfilled on open"""
+    db_path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        CREATE TABLE metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            metric_type TEXT NOT NULL,
+            metric_value REAL,
+            recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany(
+        "INSERT INTO metrics (metric_type, metric_value, recorded_at) VALUES (?, ?, datetime(?, 'unixepoch'))",
+        [('task_completed', 'old_task_name', 1700000000), ('task_completed', 0, 1700000010)]
+    )
+    conn.commit()
+    conn.close()
+
+    persistence = PersistenceLayer(db_path, metrics_retention_days=10000)
+    points = persistence.query_metrics('task_completed', 1699990000, 1700010000, 3600)
+    assert sum(p['count'] for p in points) == 2
+
+    # The backfill also weighs rows standing for several events
+    conn = sqlite3.connect(db_path)
+    for table in ('metrics_minute', 'metrics_hour', 'metrics_day'):
+        conn.execute(f'DELETE FROM {table}')
+    conn.execute("UPDATE metrics SET event_count = 5 WHERE metric_value = 0")
+    conn.commit()
+    conn.close()
+    persistence = PersistenceLayer(db_path, metrics_retention_days=10000)
+    points = persistence.query_metrics('task_completed', 1699990000, 1700010000, 60)
+    assert sum(p['count'] for p in points) == 6
+
+def test_buffered_bulk_events(tmp_path):
+    """Test that buffered events reach the rollups on query, weighted by their count"""
+    db_path = str(tmp_path / 'metrics.db')
+    persistence = PersistenceLayer(db_path, metrics_retention_days=10000)
+    start = 1700000000 // DAY * DAY
+    persistence.record_metric('task_failed', 1, count=4, recorded_at=start)
+    persistence.record_metric('task_failed', 1, recorded_at=start + 1)
+    persistence.record_metric('run_time', 2.5, recorded_at=start)
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT COUNT(*) FROM metrics').fetchone()[0] == 0
+    points = persistence.query_metrics('task_failed', start, start + DAY, 60)
+    assert points == [{'time': start, 'count': 5, 'sum': 5, 'min': 1, 'max': 1, 'avg': 1}]
+    assert conn.execute('SELECT SUM(event_count) FROM metrics').fetchone()[0] == 6
+    conn.close()
+    assert persistence.query_metrics('run_time', start, start + DAY, DAY)[0]['avg'] == 2.5
+
+def test_old_raw_rows_are_pruned(tmp_path):
+    """Test that raw rows and minute rollups past retention are deleted"""
+    db_path = str(tmp_path / 'metrics.db')
+    persistence = PersistenceLayer(db_path, metrics_retention_days=1)
+    now = time.time()
+    persistence.save_metric('task_added', 1, recorded_at=now - 3 * DAY)
+    persistence.save_metric('task_added', 1, recorded_at=now)
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT COUNT(*) FROM metrics').fetchone()[0] == 1
+    assert conn.execute('SELECT COUNT(*) FROM metrics_minute').fetchone()[0] == 1
+    conn.close()
+    assert sum(p['count'] for p in persistence.query_metrics('task_added', now - 4 * DAY, now + 1, DAY)) == 2
+
+def test_failed_flush_keeps_events(tmp_path, monkeypatch):
+    """Test that a batch written while the database is locked is kept for the next flush"""
+    db_path = str(tmp_path / 'metrics.db')
+    persistence = PersistenceLayer(db_path, metrics_retention_days=10000)
+    monkeypatch.setattr(persistence_module, 'BUSY_TIMEOUT', 0.05)
+    start = 1700000000 // DAY * DAY
+
+    writer = sqlite3.connect(db_path)
+    writer.execute('BEGIN IMMEDIATE')
+    persistence.save_metric('task_added', 1, count=3, recorded_at=start)
+    writer.rollback()
+    writer.close()
+
+    points = persistence.query_metrics('task_added', start, start + DAY, DAY)
+    assert points[0]['count'] == 3
+
+def test_buffered_events_are_flushed_at_exit(tmp_path):
+    """Test that events still buffered when the interpreter exits are written"""
+    db_path = str(tmp_path / 'metrics.db')
+    subprocess.run([sys.executable, '-c', (
+        'from app.persistence import PersistenceLayer; '
+        f'PersistenceLayer({db_path!r}).record_metric("task_added", 1, count=7)'
+    )], cwd=REPO_ROOT, check=True)
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT SUM(event_count) FROM metrics').fetchone()[0] == 7
+    conn.close()
+
+def test_metrics_history_endpoint(client):
+    """Test querying metric history over HTTP"""
+    client.post('/queue', json={'name': 'history_task'})
+    client.post('/queue/next')
+
+    response = client.get('/metrics/history?type=task_completed&step=minute')
+    data = json.loads(response.data)
+    assert response.status_code == 200
+    assert data['step'] == 60
+    assert sum(p['count'] for p in data['points']) >= 1
+
+    assert client.get('/metrics/history').status_code == 400
+    assert client.get('/metrics/history?type=run_time&step=90').status_code == 400
+    assert client.get('/metrics/history?type=run_time&from=0&step=minute').status_code == 400
+    assert client.get('/metrics/history?type=run_time&from=nan&step=minute').status_code == 400
+    assert client.get('/metrics/history?type=run_time&to=inf').status_code == 400
@@ -1,13 +1,5 @@
 import pytest
 import json
-from app import app
-from app.config import TestingConfig
-
-@pytest.fixture
-def client():
-    app.config.from_object(TestingConfig)
-    with app.test_client() as client:
-        yield client
 
 def test_health_check(client):
     """Test health check endpoint"""
@@ -109,6 +101,11 @@ def test_invalid_request(client):
                           content_type='application/json')
     assert response.status_code == 400
 
+    for priority in (1.5, '5', True):
+        response = client.post('/queue', json={'name': 'bad_priority', 'priority': priority})
+        assert response.status_code == 400
+    assert json.loads(client.get('/queue/list').data)['total'] == 0
+
 def test_not_found_task(client):
     """Test checking position of non-existent task"""
     response = client.get('/queue/nonexistent')
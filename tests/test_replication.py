@@ -0,0 +1,184 @@
+import pytest
+import json
+import threading
+import time
+import requests
+from types import SimpleNamespace
+from app import replication
+from app.engine import QueueEngine, QueueRegistry, ReadOnlyError
+from app.replication import Follower, MutationJournal, JournalTruncatedError
+
+def test_journal_since_and_truncation():
+    """Test reading journal entries and detecting truncation"""
+    journal = MutationJournal(max_entries=3)
+    for i in range(5):
+        journal.append({'op': 'clear', 'i': i})
+
+    entries, last_seq = journal.since(3)
+    assert last_seq == 5
+    assert [seq for seq, _ in entries] == [4, 5]
+    assert journal.since(5) == ([], 5)
+
+    with pytest.raises(JournalTruncatedError):
+        journal.since(1)
+
+def test_follower_engine_replays_primary():
+    """Test that replaying the journal reproduces the primary's state"""
+    primary = QueueEngine(journal=MutationJournal())
+    follower = QueueEngine(journal=MutationJournal())
+    follower.read_only = True
+
+    primary.join('a')
+    primary.join('b', priority=5)
+    primary.join('c')
+    primary.next()
+    primary.remove('c')
+
+    entries, _ = primary.journal.since(0)
+    for seq, op in entries:
+        follower.apply(op, seq)
+
+    assert follower.queue == primary.queue == ['a']
+    assert follower.journal.last_seq == primary.journal.last_seq
+    with pytest.raises(ReadOnlyError):
+        follower.join('d')
+
+def test_follower_replays_key_registered_on_existing_task():
+    """Test that a key attached to an already queued task reaches followers"""
+    primary = QueueEngine(journal=MutationJournal())
+    follower = QueueEngine(journal=MutationJournal())
+    follower.read_only = True
+
+    primary.join('a')
+    primary.join('a', idempotency_key='k1')
+    entries, _ = primary.journal.since(0)
+    for seq, op in entries:
+        follower.apply(op, seq)
+
+    follower.set_read_only(False)
+    follower.next()
+    assert follower.join('a', idempotency_key='k1')['position'] == -1
+    assert follower.queue == []
+
+def test_follower_bootstraps_when_primary_journal_changes(monkeypatch):
+    """Test that a restarted primary's sequence numbers are not mistaken for the old ones"""
+    primary = QueueRegistry(None, MutationJournal())
+
+    def get(url, params=None, **kwargs):
+        if url.endswith('/replication/snapshot'):
+            state, last_seq = primary.export_state()
+            body = {'state': state, 'last_seq': last_seq}
+        else:
+            entries, last_seq = primary.journal.since(params['since'])
+            body = {'entries': entries, 'last_seq': last_seq}
+        body['journal_id'] = primary.journal.id
+        return SimpleNamespace(status_code=200, json=lambda: body, raise_for_status=lambda: None)
+    monkeypatch.setattr(replication.requests, 'get', get)
+
+    primary.get().join('a')
+    primary.get().join('b')
+    follower = Follower(QueueRegistry(None, MutationJournal()), 'http://primary')
+    follower.running = True
+    follower.bootstrap()
+    assert follower.registry.get().queue == ['a', 'b']
+
+    # Restarted with an empty journal that moves past the follower's position
+    primary = QueueRegistry(None, MutationJournal())
+    for name in ('x', 'y', 'z'):
+        primary.get().join(name)
+    follower.sync_once()
+    assert follower.registry.get().queue == ['x', 'y', 'z']
+    assert follower.journal_id == primary.journal.id
+
+@pytest.mark.parametrize('status_code', [200, 410])
+def test_promotion_discards_in_flight_replication(monkeypatch, status_code):
+    """Test that nothing from a long-poll answered after promotion reaches the node"""
+    primary = QueueRegistry(None, MutationJournal())
+    primary.get().join('a')
+    polled, answer = threading.Event(), threading.Event()
+
+    def get(url, params=None, **kwargs):
+        if url.endswith('/replication/snapshot'):
+            state, last_seq = primary.export_state()
+            body = {'state': state, 'last_seq': last_seq}
+        else:
+            polled.set()
+            answer.wait(5)
+            entries, last_seq = primary.journal.since(params['since'])
+            body = {'entries': entries, 'last_seq': last_seq}
+        body['journal_id'] = primary.journal.id
+        return SimpleNamespace(status_code=status_code, json=lambda: body, raise_for_status=lambda: None)
+    monkeypatch.setattr(replication.requests, 'get', get)
+
+    registry = QueueRegistry(None, MutationJournal())
+    registry.set_read_only(True)
+    follower = Follower(registry, 'http://primary')
+    follower.running = True
+    follower.bootstrap()
+    primary.get().join('b')
+    follower.start()
+    assert polled.wait(5)
+
+    stopping = threading.Thread(target=follower.stop)
+    stopping.start()
+    while follower.running:
+        time.sleep(0.01)
+    assert stopping.is_alive()
+    answer.set()
+    stopping.join(5)
+    assert not follower.thread.is_alive()
+
+    registry.set_read_only(False)
+    registry.get().join('local')
+    assert registry.get().queue == ['a', 'local']
+
+def test_journal_endpoint(client):
+    """Test the journal endpoint used by followers"""
+    from app.routes_enhanced import journal
+    since = journal.last_seq
+    client.post('/queue', json={'name': 'replicated_task'})
+
+    response = client.get(f'/replication/journal?since={since}')
+    data = json.loads(response.data)
+    assert data['entries'][-1][1]['name'] == 'replicated_task'
+    assert data['last_seq'] == since + 1
+
+    response = client.get('/replication/snapshot')
+    data = json.loads(response.data)
+    assert data['state']['default']['queue'] == ['replicated_task']
+    assert data['journal_id'] == journal.id == client.get('/replication/status').get_json()['journal_id']
+
+def _wait_for(predicate, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+def test_primary_follower_processes(server_node):
+    """Test replication, read-only followers and promotion across processes"""
+    primary, primary_url = server_node()
+    follower, follower_url = server_node(
+        REPLICATION_ROLE='follower', PRIMARY_URL=primary_url, REPLICATION_POLL_TIMEOUT='1'
+    )
+
+    requests.post(f'{primary_url}/queue', json={'name': 'job_a'})
+    requests.post(f'{primary_url}/queue', json={'name': 'job_b', 'priority': 5})
+
+    assert _wait_for(lambda: requests.get(f'{follower_url}/queue/job_a').json()['position'] == 2)
+    data = requests.get(f'{follower_url}/queue/job_b').json()
+    assert data['position'] == 1
+    assert data['staleness'] is not None
+
+    response = requests.post(f'{follower_url}/queue', json={'name': 'job_c'})
+    assert response.status_code == 503
+
+    primary.kill()
+    primary.wait()
+    response = requests.post(f'{follower_url}/replication/promote')
+    assert response.status_code == 200
+
+    response = requests.post(f'{follower_url}/queue', json={'name': 'job_c'})
+    assert response.status_code == 200
+    assert response.json()['position'] == 3
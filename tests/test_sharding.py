@@ -0,0 +1,160 @@
+import json
+import pytest
+import requests
+from app.engine import QueueEngine, QueueMovedError, QueueRegistry
+from app.replication import MutationJournal
+from app.sharding import HashRing
+from conftest import free_port
+from queue_enhanced import ShardedQueueClient
+
+def test_ring_moves_only_affected_keys():
+    """Test that adding a node only moves keys onto the new node"""
+    nodes = ['http://a', 'http://b', 'http://c']
+    keys = [f'queue-{i}' for i in range(2000)]
+    before = HashRing(nodes)
+    after = HashRing(nodes + ['http://d'])
+
+    moved = [key for key in keys if before.node_for(key) != after.node_for(key)]
+    assert moved
+    assert all(after.node_for(key) == 'http://d' for key in moved)
+    # Roughly a quarter of the keys should move to the fourth node
+    assert len(moved) < len(keys) / 2
+
+def test_ring_spreads_keys():
+    """Test that every node owns part of the key space"""
+    ring = HashRing(['http://a', 'http://b', 'http://c'])
+    owners = {ring.node_for(f'queue-{i}') for i in range(300)}
+    assert owners == {'http://a', 'http://b', 'http://c'}
+
+def test_named_queues_are_independent(client):
+    """Test that ?queue= selects separate queues"""
+    client.post('/queue?queue=emails', json={'name': 'task1'})
+    client.post('/queue?queue=emails', json={'name': 'task2'})
+    client.post('/queue', json={'name': 'task1'})
+
+    data = json.loads(client.get('/queue/task2?queue=emails').data)
+    assert data['position'] == 2
+    data = json.loads(client.get('/queue/list').data)
+    assert data['total'] == 1
+
+    client.post('/queue/clear?queue=emails')
+    response = client.get('/queue/task1?queue=bad/name')
+    assert response.status_code in (400, 404)
+    response = client.get('/queue/list?queue=bad name')
+    assert response.status_code == 400
+
+def test_reads_do_not_create_queues(client, tmp_path):
+    """Test that only joins create a named queue"""
+    assert client.get('/queue/task?queue=ghost').get_json()['position'] == -1
+    assert client.get('/queue/list?queue=ghost').get_json()['total'] == 0
+    assert client.post('/queue/next?queue=ghost', json={}).get_json()['next'] is None
+    assert client.delete('/queue/remove/task?queue=ghost').status_code == 404
+    assert 'ghost' not in client.get('/cluster').get_json()['queues']
+
+    registry = QueueRegistry(str(tmp_path / 'queue_data.db'))
+    assert registry.lookup('reports').position('monthly') is None
+    assert registry.names() == ['default'] and len(list(tmp_path.iterdir())) == 1
+    registry.get('reports').join('monthly')
+    assert registry.lookup('reports').position('monthly')['position'] == 1
+
+def test_registry_rediscovers_named_queues(tmp_path):
+    """Test that named queues are reloaded from their database files"""
+    db_path = str(tmp_path / 'queue_data.db')
+    registry = QueueRegistry(db_path)
+    registry.get('reports').join('monthly')
+
+    reloaded = QueueRegistry(db_path)
+    assert sorted(reloaded.names()) == ['default', 'reports']
+    assert reloaded.get('reports').position('monthly')['position'] == 1
+
+def test_cluster_routing_and_rebalance(server_node):
+    """Test client-side routing and queue handoff when a node joins"""
+    ports = [free_port() for _ in range(3)]
+    urls = [f'http://127.0.0.1:{port}' for port in ports]
+    two_nodes = ','.join(urls[:2])
+    for port, url in zip(ports[:2], urls[:2]):
+        server_node(port, CLUSTER_NODES=two_nodes, NODE_URL=url)
+
+    sharded = ShardedQueueClient(urls[:2], min_poll_interval=0)
+    queues = [f'q{i}' for i in range(12)]
+    for queue in queues:
+        sharded.client_for(queue)._join('job', 0)
+    # Queues holding only a running job and a finished result
+    busy = [f'busy{i}' for i in range(12)]
+    for queue in busy:
+        client = sharded.client_for(queue)
+        client.submit('done', b'x')
+        client.claim(1, 'worker')
+        client.report_result('done', b'ok')
+        client.submit('work', b'y')
+        client.claim(1, 'worker')
+
+    # Each queue lives only on its owner
+    placement = {queue: sharded.client_for(queue).server_url for queue in queues + busy}
+    assert set(placement.values()) == set(urls[:2])
+    response = requests.get(f'{urls[0]}/queue/job', params={'queue': queues[0]})
+    assert response.status_code == (200 if placement[queues[0]] == urls[0] else 421)
+
+    # A third node joins: only queues now owned by it move
+    server_node(ports[2], CLUSTER_NODES=','.join(urls), NODE_URL=urls[2])
+    moved = []
+    for url in urls:
+        response = requests.post(f'{url}/cluster/nodes', json={'nodes': urls})
+        assert response.status_code == 200
+        moved += [entry['queue'] for entry in response.json()['moved']]
+
+    ring = HashRing(urls)
+    assert sorted(moved) == sorted(q for q in queues + busy if ring.node_for(q) != placement[q])
+    assert all(ring.node_for(q) == urls[2] for q in moved)
+
+    # Cached clients follow the redirect to the new owner, tasks kept their place
+    for queue in queues:
+        assert sharded.client_for(queue)._await_position('job', {'poll_after': 0}, 10)['position'] == 1
+        assert sharded.client_for(queue).server_url == ring.node_for(queue)
+    for queue in busy:
+        client = sharded.client_for(queue)
+        assert client.get_job('work')['status'] == 'running'
+        assert client.get_job('done')['result'] == b'ok'
+
+    # Only the owner accepts an import
+    other = next(url for url in urls if url != ring.node_for(queues[0]))
+    response = requests.post(f'{other}/cluster/import', params={'queue': queues[0]},
+                             json={'queue': [], 'metadata': {}})
+    assert response.status_code == 421 and response.json()['owner'] == ring.node_for(queues[0])
+
+def test_handoff_exports_claims_and_stops_writes():
+    """Test that a queue being handed off ships its claims and refuses writes"""
+    engine = QueueEngine()
+    engine.join('job', payload=b'x')
+    engine.claim(1, 'worker')
+    state = engine.begin_handoff('http://b')
+    assert state['queue'] == [] and list(state['claimed']) == ['job']
+    with pytest.raises(QueueMovedError) as error:
+        engine.join('late')
+    assert error.value.owner == 'http://b'
+    assert engine.expire_tasks() == []
+
+    engine.cancel_handoff()
+    assert engine.join('late')['position'] == 1
+
+def test_import_merges_into_existing_queue():
+    """Test that an imported queue joins tasks already queued on the new owner"""
+    old = QueueEngine()
+    old.join('early', priority=1)
+    old.join('shared')
+    old.join('job', payload=b'x')
+    old.claim(1, 'worker')
+    state = old.export_state()
+
+    new = QueueEngine(journal=MutationJournal())
+    new.join('shared')
+    new.join('late')
+    new.merge_state(state)
+    assert new.queue == ['early', 'shared', 'late']
+    assert new.job('job')['status'] == 'running'
+
+    follower = QueueEngine()
+    entries, _ = new.journal.since(0)
+    for seq, op in entries:
+        follower.apply(op, seq)
+    assert follower.queue == new.queue and list(follower.claimed) == ['job']
@@ -0,0 +1,47 @@
+import threading
+import pytest
+from app.engine import QueueEngine
+
+def test_reads_do_not_wait_for_writers():
+    """Test that reads are served while a writer holds the lock"""
+    engine = QueueEngine()
+    engine.join('a')
+    engine.join('b', priority=5)
+
+    held = threading.Event()
+    release = threading.Event()
+
+    def writer():
+        with engine.lock:
+            held.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    held.wait(5)
+    try:
+        results = []
+        reader = threading.Thread(target=lambda: results.append(
+            (engine.position('a')['position'], engine.size(), [t['name'] for t in engine.list_tasks()])))
+        reader.start()
+        reader.join(2)
+        assert results == [(2, 2, ['b', 'a'])]
+    finally:
+        release.set()
+        thread.join()
+
+def test_snapshot_is_immutable_and_replaced():
+    """Test that each mutation publishes a new snapshot and old ones stay intact"""
+    engine = QueueEngine()
+    engine.join('a')
+    before = engine.snapshot
+
+    engine.join('b')
+    engine.next()
+
+    assert before.queue == ('a',)
+    assert dict(before.positions) == {'a': 1}
+    assert engine.snapshot.queue == ('b',)
+    assert engine.snapshot.metrics['completed_tasks'] == 1
+    with pytest.raises(TypeError):
+        engine.snapshot.positions['c'] = 3
@@ -0,0 +1,39 @@
+from benchmarks.stress_harness import QUEUE, check_history, check_listing, new_record, stress
+
+def join(seq, name, priority=0):
+    return seq, {'op': 'join', 'name': name, 'metadata': {'priority': priority}, 'queue': QUEUE}
+
+def test_reference_model_flags_divergence():
+    """Test that the differential check catches reordering, loss and duplication"""
+    entries = [join(1, 'a'), join(2, 'b', priority=5), join(3, 'c'),
+               (4, {'op': 'next', 'name': 'b', 'queue': QUEUE})]
+    records = new_record()
+    records['joined'] = ['a', 'b', 'c']
+    records['nexted'] = ['b']
+    assert check_history(entries, ['a', 'c'], records) == []
+
+    # Next skipped the head, the server lost c, a client saw b twice
+    wrong = entries[:3] + [(4, {'op': 'next', 'name': 'a', 'queue': QUEUE})]
+    records['nexted'] = ['b', 'b']
+    violations = check_history(wrong, ['b'], records)
+    assert any('while b was at the head' in v for v in violations)
+    assert any(v.startswith('final queue') for v in violations)
+    assert any(v.startswith('nexted') for v in violations)
+
+def test_listing_invariants():
+    """Test the snapshot checks on positions, uniqueness and priority order"""
+    def task(name, position, priority=0):
+        return {'name': name, 'position': position, 'priority': priority}
+
+    assert check_listing([task('a', 1, 5), task('b', 2)]) == []
+    assert len(check_listing([task('a', 1), task('a', 2)])) == 1
+    assert len(check_listing([task('a', 1), task('b', 3)])) == 1
+    assert len(check_listing([task('a', 1), task('b', 2, 5)])) == 1
+
+def test_concurrent_clients_keep_invariants(server_node):
+    """Test the server under concurrent processes and threads against the model"""
+    _, url = server_node(MAX_QUEUE_SIZE='1000000', REPLICATION_JOURNAL_SIZE='1000000')
+    report = stress(url, processes=2, threads=4, duration=2)
+    assert report['violations'] == []
+    assert report['errors'] == []
+    assert report['journal_entries'] > 0 and report['operations']['join']['count'] > 0
@@ -0,0 +1,141 @@
+import pytest
+import requests
+import threading
+import time
+from app.config import Config
+from app.engine import QueueRegistry
+from app.unix_socket import (start_unix_server, encode_request, decode_request,
+                             encode_response, decode_response, OP_JOIN)
+from queue_enhanced import QueueClient, UnixSocketTransport
+
+@pytest.fixture
+def unix_server(tmp_path):
+    registry = QueueRegistry()
+    path = str(tmp_path / 'queue.sock')
+    server = start_unix_server(registry, path)
+    yield registry.get(), path
+    server.shutdown()
+    server.server_close()
+
+def test_frame_round_trip():
+    """Test encoding and decoding of protocol frames"""
+    frame = encode_request(OP_JOIN, 'task', priority=3, timeout_ms=250, queue='emails', idempotency_key='k1')
+    assert decode_request(frame[4:]) == (OP_JOIN, 'task', 3, 250, 'emails', 'k1')
+
+    frame = encode_response(0, position=2, queue_size=5, estimated_wait=1.5, name='x')
+    data = decode_response(frame[4:])
+    assert data['position'] == 2
+    assert data['estimated_wait'] == 1.5
+    assert data['name'] == 'x'
+
+def test_join_position_next_remove(unix_server):
+    """Test the basic operations over the unix socket"""
+    engine, path = unix_server
+    transport = UnixSocketTransport(path)
+
+    assert transport.request(UnixSocketTransport.OP_JOIN, 'a')['position'] == 1
+    assert transport.request(UnixSocketTransport.OP_JOIN, 'b', priority=5)['position'] == 1
+    assert transport.request(UnixSocketTransport.OP_POSITION, 'a')['position'] == 2
+    assert transport.request(UnixSocketTransport.OP_POSITION, 'missing')['position'] == -1
+
+    assert transport.request(UnixSocketTransport.OP_NEXT)['next'] == 'b'
+    assert transport.request(UnixSocketTransport.OP_REMOVE, 'a')['position'] == -1
+    assert engine.size() == 0
+
+def test_wait_blocks_until_head(unix_server):
+    """Test that a wait returns as soon as the task reaches the head"""
+    engine, path = unix_server
+    engine.join('first')
+    engine.join('second')
+
+    threading.Timer(0.1, engine.next).start()
+    transport = UnixSocketTransport(path)
+    started = time.time()
+    data = transport.request(UnixSocketTransport.OP_WAIT, 'second', wait_timeout=5)
+    assert data['position'] == 1
+    assert time.time() - started < 2
+
+def test_decorator_over_unix_socket(unix_server):
+    """Test that QueueClient selects the binary protocol for unix:// URLs"""
+    engine, path = unix_server
+    queue_client = QueueClient(f'unix://{path}')
+
+    @queue_client.queue_decorator('unix_task')
+    def task():
+        return engine.position('unix_task')['position']
+
+    assert task() == 1
+    assert engine.size() == 0
+    assert queue_client.health_check()
+
+def test_requests_name_their_queue(unix_server):
+    """Test that a client's queue travels in the frame and reads create nothing"""
+    engine, path = unix_server
+    emails = UnixSocketTransport(path, queue='emails')
+    assert emails.request(UnixSocketTransport.OP_JOIN, 'a')['position'] == 1
+    assert UnixSocketTransport(path, queue='ghost').request(UnixSocketTransport.OP_POSITION, 'a')['position'] == -1
+    assert engine.size() == 0
+
+    queue_client = QueueClient(f'unix://{path}', queue='emails')
+    assert queue_client._join('b', 0)['position'] == 2
+    with pytest.raises(requests.HTTPError):
+        UnixSocketTransport(path, queue='bad name').request(UnixSocketTransport.OP_JOIN, 'a')
+
+def test_join_idempotency_key(unix_server):
+    """Test that a retried join with the same key is not queued twice"""
+    engine, path = unix_server
+    transport = UnixSocketTransport(path)
+    assert transport.request(UnixSocketTransport.OP_JOIN, 'a', idempotency_key='k1')['position'] == 1
+    engine.next('a')
+    assert transport.request(UnixSocketTransport.OP_JOIN, 'a', idempotency_key='k1')['position'] == -1
+    assert engine.size() == 0
+    with pytest.raises(requests.HTTPError):
+        transport.request(UnixSocketTransport.OP_JOIN, 'b', idempotency_key='k1')
+
+def test_wait_is_clamped(unix_server, monkeypatch):
+    """Test that a client cannot hold a server thread past MAX_WAIT_SECONDS"""
+    engine, path = unix_server
+    monkeypatch.setattr(Config, 'MAX_WAIT_SECONDS', 0.1)
+    engine.join('first')
+    engine.join('second')
+
+    started = time.time()
+    data = UnixSocketTransport(path).request(UnixSocketTransport.OP_WAIT, 'second', wait_timeout=5)
+    assert data['position'] == 2
+    assert time.time() - started < 2
+
+def test_only_one_server_binds_a_path(unix_server):
+    """Test that a second server on the same path backs off instead of stealing the socket"""
+    engine, path = unix_server
+    assert start_unix_server(QueueRegistry(), path) is None
+    assert UnixSocketTransport(path).request(UnixSocketTransport.OP_JOIN, 'a')['position'] == 1
+    assert engine.size() == 1
+
+def test_app_starts_unix_server(server_node, tmp_path):
+    """Test that server processes sharing UNIX_SOCKET_PATH serve it exactly once"""
+    path = str(tmp_path / 'app.sock')
+    _, url = server_node(UNIX_SOCKET_PATH=path)
+    server_node(UNIX_SOCKET_PATH=path)
+
+    assert UnixSocketTransport(path).request(UnixSocketTransport.OP_JOIN, 'a')['position'] == 1
+    assert requests.get(f'{url}/queue/a').json()['position'] == 1
+
+def test_wait_backs_off_when_server_is_unreachable(unix_server, monkeypatch):
+    """Test that failed unix waits are retried at the poll interval, not in a tight loop"""
+    engine, path = unix_server
+    engine.join('first')
+    queue_client = QueueClient(f'unix://{path}', timeout=1, min_poll_interval=0.2)
+    attempts = []
+
+    def unreachable(name, data, remaining):
+        attempts.append(name)
+        raise requests.ConnectionError('socket is down')
+    monkeypatch.setattr(queue_client, '_await_position', unreachable)
+
+    @queue_client.queue_decorator('blocked', max_retries=0)
+    def task():
+        pass
+
+    with pytest.raises(TimeoutError):
+        task()
+    assert len(attempts) <= 10